@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+from ratelimit import TokenBucket
+
+# === Admission Control and Load Shedding ===
+# Expensive requests (result lookups, top 3, rankings and class statistics,
+# registrations) are admitted at ingress, before they touch a sheet:
+# - every user has a token bucket, so one user hammering S1/S2/Ave buttons is
+#   throttled without affecting anyone else;
+# - at most `slots` admitted requests run at once. The rest wait in a bounded
+#   queue per kind and are started in priority order as slots free up:
+#   result lookups first, then registrations, then top-3/ranking lookups.
+#   Each kind's queue holds its share of `queue_size`, so as the bot saturates
+#   top-3/ranking lookups are shed first, then registrations, and result
+#   lookups last. A request is shed only when its queue is full.
+# A refused request is answered right away with a short toast and never
+# queued. submit() takes a job that starts the request (it runs on whichever
+# thread submits or releases, outside the lock, so it should only hand the
+# request over); callers release() every started request when its handler is
+# done.
+
+ADMITTED = 'admitted'
+THROTTLED = 'throttled'
+SHED = 'shed'
+VERDICTS = (ADMITTED, THROTTLED, SHED)
+PRIORITY_SHARES = {'results': 1.0, 'register': 0.8, 'top3': 0.6}
+
+class Admission:
+    def __init__(self, slots=16, queue_size=128, user_rate=0.5, user_burst=4, shares=None, max_users=10000):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.shares = dict(shares or PRIORITY_SHARES)
+        self.priorities = sorted(self.shares, key=self.shares.get, reverse=True)
+        self.queue_limits = {kind: max(1, int(queue_size * share)) for kind, share in self.shares.items()}
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> TokenBucket, least recently seen first
+        self._queues = {kind: deque() for kind in self.priorities}
+        self.active = 0
+        self.counts = {kind: dict.fromkeys(VERDICTS, 0) for kind in self.shares}
+
+    def _user_bucket(self, user_id, now):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            if len(self._users) >= self.max_users:
+                # The least recently seen user; their next request starts a full bucket
+                self._users.popitem(last=False)
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst, now)
+        else:
+            self._users.move_to_end(user_id)
+            bucket.refill(now)
+        return bucket
+
+    def _take_ready(self):
+        # Jobs to start now, highest priority first, while slots are free
+        ready = []
+        while self.active < self.slots:
+            queue = next((self._queues[kind] for kind in self.priorities if self._queues[kind]), None)
+            if queue is None:
+                break
+            ready.append(queue.popleft())
+            self.active += 1
+        return ready
+
+    def submit(self, user_id, kind, job):
+        # Queues job() to start the request and returns ADMITTED, or returns why
+        # it was refused; job() may run before this returns
+        now = time.monotonic()
+        with self._lock:
+            if len(self._queues[kind]) >= self.queue_limits[kind]:
+                verdict = SHED
+            else:
+                bucket = self._user_bucket(user_id, now)
+                if bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    self._queues[kind].append(job)
+                    verdict = ADMITTED
+                else:
+                    verdict = THROTTLED
+            self.counts[kind][verdict] += 1
+            ready = self._take_ready()
+        for start in ready:
+            start()
+        return verdict
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            ready = self._take_ready()
+        for start in ready:
+            start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slots': self.slots,
+                'active': self.active,
+                'queued': {kind: len(queue) for kind, queue in self._queues.items()},
+                'queue_limits': dict(self.queue_limits),
+                'users': len(self._users),
+                'counts': {kind: dict(counts) for kind, counts in self.counts.items()}
+            }
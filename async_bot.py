@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import bot as core
+import ratelimit
+import admission
+import metrics
+
+# === Asyncio Runtime ===
+# The bot.py handlers as coroutines on AsyncTeleBot, so one event loop can
+# keep many Telegram calls in flight. Each coroutine runs bot.py's shared
+# *_replies function for its update on a bounded thread pool (every user-store
+# call and sheet load happens in there, so a busy SQLite lock or a WAL
+# checkpoint never stalls the loop) and then sends the Replies it returns;
+# state, caches, rendering and the scheduler are shared with bot.py.
+# Run with: python async_bot.py
+
+abot = AsyncTeleBot(core.BOT_TOKEN)
+if core.TELEGRAM_API_URL:
+    asyncio_helper.API_URL = core.TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+if core.update_recorder:
+    core.update_recorder.attach_async(abot)
+metrics.install_async(core.perf)
+ratelimit.install_async(core.outbound_limiter)
+
+executor = ThreadPoolExecutor(max_workers=core.ASYNC_EXECUTOR_WORKERS, thread_name_prefix='async-io')
+
+async def offload(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+# === Sending Replies ===
+# Coroutine twins of core.send_replies / send_reply / show_welcome_message /
+# respond_in_place; see core.Reply for what each kind of reply does.
+async def send_replies(request, replies):
+    call = request if isinstance(request, types.CallbackQuery) else None
+    message = call.message if call else request
+    for reply in replies:
+        try:
+            await send_reply(call, message, reply)
+        except asyncio_helper.ApiException as e:
+            if reply.fallback is None:
+                raise
+            logging.error(f"Sending to {reply.chat_id or message.chat.id} failed: {str(e)}")
+            await abot.send_message(message.chat.id, reply.fallback, parse_mode="Markdown")
+            return
+
+async def send_reply(call, message, reply):
+    parse_mode = "Markdown" if reply.markdown else None
+    if reply.how == 'reply':
+        await abot.reply_to(message, reply.text, reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'edit':
+        await abot.edit_message_text(chat_id=message.chat.id, message_id=message.message_id, text=reply.text,
+                                     reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'in_place':
+        await respond_in_place(call, reply.text, reply.markup)
+    elif reply.how == 'answer':
+        await abot.answer_callback_query(call.id, reply.text)
+    elif reply.how == 'send':
+        await abot.send_message(reply.chat_id or message.chat.id, reply.text, reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'welcome':
+        await show_welcome_message(message, reply)
+
+async def show_welcome_message(message, reply):
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            await abot.reply_to(message, reply.text, parse_mode="Markdown", reply_markup=reply.markup)
+            return
+        except asyncio_helper.ApiException as e:
+            logging.error(f"Attempt {attempt + 1} failed: {str(e)}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)  # yields the loop, unlike time.sleep
+    await abot.reply_to(message, reply.fallback, parse_mode="Markdown")
+
+async def respond_in_place(call, text, markup=None):
+    try:
+        await abot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text,
+            reply_markup=markup,
+            parse_mode="Markdown"
+        )
+    except asyncio_helper.ApiTelegramException as e:
+        if 'message is not modified' not in e.description:
+            logging.warning(f"Editing message {call.message.message_id} in {call.message.chat.id} failed, sending instead: {str(e)}")
+            await abot.send_message(call.message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
+    finally:
+        await abot.answer_callback_query(call.id)
+
+# === Admission ===
+# Every update gets its own task as it arrives, so admitting at the top of the
+# handler is admission at ingress here: nothing waits in a handler queue first.
+# An admitted handler then awaits its turn in the admission queue.
+async def admit(request, kind):
+    # True once the request holds an admission slot, False if it was refused
+    loop = asyncio.get_running_loop()
+    turn = loop.create_future()
+    verdict = core.request_admission.submit(str(request.from_user.id), kind,
+                                            lambda: loop.call_soon_threadsafe(take_turn, turn))
+    if verdict != admission.ADMITTED:
+        await send_replies(request, await offload(core.refusal_replies, request, verdict))
+        return False
+    try:
+        await turn
+    except asyncio.CancelledError:
+        if not turn.cancelled():
+            core.request_admission.release()  # cancelled after its turn came
+        raise
+    return True
+
+def take_turn(turn):
+    # A handler cancelled while it waited gives its slot straight back
+    if turn.cancelled():
+        core.request_admission.release()
+    else:
+        turn.set_result(None)
+
+def admitted(handler):
+    # Requests core.admission_kind gates wait for a slot first and free it when the handler returns
+    @functools.wraps(handler)
+    async def handle(request):
+        kind = core.admission_kind(request)
+        if kind is None:
+            return await handler(request)
+        if not await admit(request, kind):
+            return
+        try:
+            return await handler(request)
+        finally:
+            core.request_admission.release()
+    return handle
+
+# === Handlers ===
+# Registered in the same order as bot.py's, so the same handler matches
+@abot.message_handler(commands=['register'])
+@admitted
+async def register_user(message):
+    await send_replies(message, await offload(core.register_replies, message))
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith('reg_lang_'))
+async def handle_registration_language(call):
+    await send_replies(call, await offload(core.registration_language_replies, call))
+
+@abot.message_handler(commands=['login'])
+async def login_user(message):
+    await send_replies(message, await offload(core.login_replies, message))
+
+@abot.message_handler(commands=['start'])
+async def send_welcome(message):
+    await send_replies(message, await offload(core.start_replies, message))
+
+@abot.message_handler(commands=['help'])
+async def send_help(message):
+    await send_replies(message, await offload(core.help_replies, message))
+
+@abot.message_handler(commands=['lang'])
+async def set_language(message):
+    await send_replies(message, await offload(core.language_replies, message))
+
+@abot.message_handler(commands=list(core.ADMIN_COMMANDS))
+async def run_admin_command(message):
+    await send_replies(message, await offload(core.admin_replies, message))
+
+@abot.message_handler(func=lambda message: True)
+async def handle_unexpected_input(message):
+    await send_replies(message, await offload(core.invalid_command_replies, message))
+
+@abot.callback_query_handler(func=lambda call: True)
+@admitted
+async def callback_handler(call):
+    await send_replies(call, await offload(core.callback_replies, call))
+
+# === Run Bot ===
+core.perf.instrument_handlers(abot)
+
+def run():
+    logging.info("📡 Bot is running (asyncio)...")
+    core.startup()
+    if core.UPDATE_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(abot.polling())
+
+def run_webhook():
+    from webhook import WebhookServer, register_webhook
+    loop = asyncio.new_event_loop()
+    server = WebhookServer(core.WEBHOOK_HOST, core.WEBHOOK_PORT, core.WEBHOOK_PATH, core.WEBHOOK_SECRET,
+                           lambda update: asyncio.run_coroutine_threadsafe(abot.process_new_updates([update]), loop))
+    register_webhook(core.bot, core.WEBHOOK_URL, core.WEBHOOK_PATH, core.WEBHOOK_SECRET)
+    server.start()
+    loop.run_forever()
+
+if __name__ == '__main__':
+    run()
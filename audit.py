@@ -0,0 +1,144 @@
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import atexit
+import logging
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# === Background Log Writers ===
+# Handlers only put records on an in-memory queue; a QueueListener thread does
+# the disk writes. The audit trail is one JSON object per line with an 'ts'
+# (epoch seconds) and 'event' field, rotated by size; rotated segments are
+# gzipped (audit.jsonl.1.gz is the newest). Readers stream the segments line
+# by line instead of loading them.
+
+class DroppingQueueHandler(QueueHandler):
+    # A full queue drops the record rather than blocking the handler thread
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, filename, max_bytes, backups):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = gzip_rotator
+
+# === Sharded Worker Processes ===
+# Under workers.py every process logs into one multiprocessing queue, set with
+# share_queue() before `import bot`. Only the supervisor serves it: its
+# listener writes bot.log/console and the audit file for all processes, so each
+# file (and its rotation) has a single writer.
+AUDIT_LOGGER = 'selam.audit'
+_shared_queue = None
+_shared_listener = None
+
+def share_queue(log_queue, serve=False):
+    global _shared_queue, _shared_listener
+    _shared_queue = log_queue
+    if serve:
+        _shared_listener = QueueListener(log_queue, respect_handler_level=True)
+        _shared_listener.start()
+        atexit.register(_shared_listener.stop)
+
+def _serve_shared(handler, audit_records):
+    # Audit and ordinary log records share the queue; the logger name tells them apart
+    handler.addFilter(lambda record: (record.name == AUDIT_LOGGER) == audit_records)
+    _shared_listener.handlers += (handler,)
+
+def install_queue_logging(log_format, handlers, level=logging.INFO):
+    if _shared_queue is not None:
+        logging.basicConfig(level=level, format=log_format, handlers=[QueueHandler(_shared_queue)])
+        if _shared_listener is not None:
+            for handler in handlers:
+                _serve_shared(handler, False)
+        return _shared_listener
+    # Routes the root logger through a queue so logging.info() never waits on disk
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logging.basicConfig(level=level, format=log_format, handlers=[QueueHandler(log_queue)])
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+class AuditLog:
+    def __init__(self, path, max_bytes, backups, max_pending=10000):
+        self.path = path
+        self._handler = DroppingQueueHandler(_shared_queue if _shared_queue is not None else queue.Queue(max_pending))
+        self._logger = logging.getLogger(AUDIT_LOGGER)
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(self._handler)
+        self._listener = None
+        if _shared_queue is not None and _shared_listener is None:
+            return  # a worker process: the supervisor writes the file
+        file_handler = GzipRotatingFileHandler(path, max_bytes, backups)
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        if _shared_listener is not None:
+            _serve_shared(file_handler, True)
+            return
+        self._listener = QueueListener(self._handler.queue, file_handler)
+        self._listener.start()
+        atexit.register(self.close)
+
+    @property
+    def dropped(self):
+        return self._handler.dropped
+
+    def record(self, event, **fields):
+        self._logger.info(json.dumps(dict(ts=round(time.time(), 3), event=event, **fields), ensure_ascii=False))
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()  # drains what is queued
+            self._listener = None
+
+    def segments(self):
+        # Oldest first: audit.jsonl.N.gz ... audit.jsonl.1.gz, then the live file
+        rotated = glob.glob(f"{glob.escape(self.path)}.*.gz")
+        rotated.sort(key=lambda p: int(p[len(self.path) + 1:-3]) if p[len(self.path) + 1:-3].isdigit() else 0, reverse=True)
+        return rotated + ([self.path] if os.path.exists(self.path) else [])
+
+    def events(self, since=None):
+        for path in self.segments():
+            # A segment last written before `since` holds nothing newer
+            if since is not None and os.path.getmtime(path) < since:
+                continue
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of a crashed write
+                    if since is None or event.get('ts', 0) >= since:
+                        yield event
+
+def aggregate(events):
+    # Result views per (grade_section, semester) plus a count of every event type
+    views = {}
+    totals = {}
+    for event in events:
+        kind = event.get('event')
+        totals[kind] = totals.get(kind, 0) + 1
+        if kind == 'result_view':
+            entry = views.setdefault((event['grade_section'], event['semester']), {'views': 0, 'students': set(), 'users': set()})
+            entry['views'] += 1
+            entry['students'].add(event['student_no'])
+            entry['users'].add(event['user_id'])
+    return views, totals
@@ -0,0 +1,84 @@
+import sys
+import glob
+import time
+import argparse
+import tracemalloc
+from statistics import median
+
+import xlsx_reader
+
+# === Cold-Load Benchmark: openpyxl vs xlsx_reader ===
+# Loads one sheet's data window the way a cache miss does and reports the median
+# wall time and the peak traced memory of each path, after checking both return the
+# same title, max_column and row values.
+# Usage: python bench_xlsx.py [--repeat 5] [data/4A.xlsx ...]
+
+DATA_START_ROW = 5
+DATA_END_ROW = 64
+DATA_MAX_COL = 18
+SEMESTERS = ['S1', 'S2', 'Ave']
+
+def load_openpyxl(path, semester):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, data_only=True)
+    ws = wb[semester]
+    rows = tuple(ws.iter_rows(min_row=DATA_START_ROW, max_row=DATA_END_ROW, max_col=DATA_MAX_COL, values_only=True))
+    return ws.title, ws.max_column, rows
+
+def load_streaming(path, semester):
+    return xlsx_reader.read_sheets(path, [semester], DATA_START_ROW, DATA_END_ROW, DATA_MAX_COL)[semester]
+
+def measure(loader, path, semester, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = loader(path, semester)
+        times.append(time.perf_counter() - started)
+    # Peak memory is taken from a separate traced run; tracing skews timings
+    tracemalloc.start()
+    loader(path, semester)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, median(times), peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold sheet loads of openpyxl and xlsx_reader.")
+    parser.add_argument('files', nargs='*', help="workbooks to load (default: data/*.xlsx)")
+    parser.add_argument('--repeat', type=int, default=3, help="loads per file and sheet (default: %(default)s)")
+    args = parser.parse_args()
+    files = args.files or sorted(glob.glob('data/*.xlsx'))
+
+    started = time.perf_counter()
+    import openpyxl  # noqa: F401
+    import_time = time.perf_counter() - started
+    print(f"openpyxl import: {import_time * 1000:.0f} ms")
+
+    print(f"{'file':<16}{'sheet':<6}{'openpyxl ms':>12}{'stream ms':>11}{'speedup':>9}{'openpyxl KiB':>14}{'stream KiB':>12}")
+    totals = [0.0, 0.0, 0, 0]
+    mismatches = 0
+    for path in files:
+        for semester in SEMESTERS:
+            expected, slow_time, slow_peak = measure(load_openpyxl, path, semester, args.repeat)
+            actual, fast_time, fast_peak = measure(load_streaming, path, semester, args.repeat)
+            same = expected == actual
+            mismatches += not same
+            totals[0] += slow_time
+            totals[1] += fast_time
+            totals[2] = max(totals[2], slow_peak)
+            totals[3] = max(totals[3], fast_peak)
+            print(
+                f"{path[-15:]:<16}{semester:<6}{slow_time * 1000:>12.1f}{fast_time * 1000:>11.1f}"
+                f"{slow_time / fast_time:>8.0f}x{slow_peak / 1024:>14.0f}{fast_peak / 1024:>12.0f}"
+                f"{'' if same else '  MISMATCH'}"
+            )
+    print(
+        f"{'total/max':<22}{totals[0] * 1000:>12.1f}{totals[1] * 1000:>11.1f}"
+        f"{totals[0] / totals[1]:>8.0f}x{totals[2] / 1024:>14.0f}{totals[3] / 1024:>12.0f}"
+    )
+    if mismatches:
+        print(f"{mismatches} sheet(s) differ between openpyxl and xlsx_reader")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
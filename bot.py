@@ -1,44 +1,168 @@
 import os
+import sys
+import glob
 import logging
-import json
 import random
+import bisect
+import heapq
 from datetime import datetime
 from dotenv import load_dotenv
-from openpyxl import load_workbook
 import telebot
 from telebot import types
+import xlsx_reader
+import ingest
+from user_store import open_user_store, StudentTaken, PinTaken
+from gradebook import (BASE_PATH, DATA_START_ROW, DATA_END_ROW, DATA_MAX_COL, DEFAULT_SNAPSHOT_FILE, SUMMARY_SHEET,
+                       split_grade_section, is_term_sheet, semester_order, result_sheets, read_sheets,
+                       row_index, GradebookSnapshot)
+from scheduler import Scheduler
+import ratelimit
+import metrics
+import broadcast
+import audit
+import admission
+import replay
+import expiring
 import time
-from threading import Timer
+import queue
+import threading
+import tracemalloc
+import functools
+import math
+from array import array
+from itertools import filterfalse
+from collections import OrderedDict
 
 # === Load Environment Variables ===
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID = os.getenv('ADMIN_ID')
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')  # 'polling' or 'webhook'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public base URL Telegram should POST to
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
 
 # === Logging Setup ===
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# bot.log and the console are written by a background listener thread (the
+# supervisor's, for shard workers, whose lines are tagged with the shard)
+shard_tag = '[%(processName)s] ' if os.getenv('BOT_SHARD') else ''
+audit.install_queue_logging(f'[%(asctime)s] %(levelname)s - {shard_tag}%(message)s', [
+    logging.FileHandler('bot.log'),
+    logging.StreamHandler()
+])
 
 # === Configurations ===
-BASE_PATH = 'data/'
-DATA_START_ROW = 5
-DATA_END_ROW = 64
 USER_MAPPING_FILE = 'user_mapping.json'
 STUDENT_IDENTIFIERS_FILE = 'student_identifiers.json'
-PROCESSED_CALLBACKS = set()
+USER_DB_FILE = os.getenv('USER_DB_FILE', 'users.db')
+USER_STORE = os.getenv('USER_STORE', 'sqlite')  # 'sqlite' or 'journal'
+USER_JOURNAL_FILE = os.getenv('USER_JOURNAL_FILE', 'user_events.jsonl')
+USER_STATE_FILE = os.getenv('USER_STATE_FILE', 'user_state.json')
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))  # Bot API messages/s across all chats
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))  # sustained messages/s to one chat
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))  # messages one chat may receive back to back
+ADMIN_DIGEST_INTERVAL = int(os.getenv('ADMIN_DIGEST_INTERVAL', '60'))  # seconds between result-view digests
+USER_JOURNAL_COMPACT_BYTES = int(os.getenv('USER_JOURNAL_COMPACT_BYTES', str(1 << 20)))  # compact the journal past this size
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', DEFAULT_SNAPSHOT_FILE)
 REGISTRATION_TIMEOUT = 300  # 5 minutes in seconds
+CALLBACK_DEDUPE_TTL = int(os.getenv('CALLBACK_DEDUPE_TTL', '900'))  # seconds a handled callback id is remembered
+CALLBACK_DEDUPE_MAX = int(os.getenv('CALLBACK_DEDUPE_MAX', '50000'))  # handled callback ids remembered at most
+PENDING_REGISTRATIONS_MAX = int(os.getenv('PENDING_REGISTRATIONS_MAX', '10000'))  # registrations awaiting a language at most
+PROCESSED_CALLBACKS = expiring.ExpiringSet(CALLBACK_DEDUPE_TTL, CALLBACK_DEDUPE_MAX)
+GRADEBOOK_CACHE_BYTES = int(os.getenv('GRADEBOOK_CACHE_BYTES', str(2 << 20)))  # approximate memory for cached sheets
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0')) or None  # ingest processes (default: CPU count)
+INGEST_INTERVAL = int(os.getenv('INGEST_INTERVAL', '300'))  # seconds between changed-workbook scans (0 = off)
+INGEST_BUDGET = float(os.getenv('INGEST_BUDGET', '10'))  # target seconds for the startup pre-warm
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '4096'))  # max cached result/top-3 texts
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. a local Bot API server; defaults to api.telegram.org
+BOT_WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS', '2'))  # telebot handler threads (sync runtime)
+ASYNC_EXECUTOR_WORKERS = int(os.getenv('ASYNC_EXECUTOR_WORKERS', '8'))  # blocking-work pool (async runtime)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Prometheus /metrics endpoint (0 = off)
+PERF_WINDOW_MINUTES = int(os.getenv('PERF_WINDOW_MINUTES', '15'))  # default /perf summary window
+RANKING_TOP_N = int(os.getenv('RANKING_TOP_N', '10'))  # students listed by the grade/school rankings
+PASS_MARK = float(os.getenv('PASS_MARK', '50'))  # lowest score counted as a pass in class statistics
+BROADCAST_BASELINE_FILE = os.getenv('BROADCAST_BASELINE_FILE', 'broadcast_baseline.json')  # row fingerprints last broadcast
+BROADCAST_PLAN_FILE = os.getenv('BROADCAST_PLAN_FILE', 'broadcast_plan.json')
+BROADCAST_PROGRESS_FILE = os.getenv('BROADCAST_PROGRESS_FILE', 'broadcast_progress.json')
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '5'))  # recipients/s pushed by a results broadcast
+AUDIT_LOG_FILE = os.getenv('AUDIT_LOG_FILE', 'audit.jsonl')
+AUDIT_MAX_BYTES = int(os.getenv('AUDIT_MAX_BYTES', str(10 << 20)))  # rotate the audit trail past this size
+AUDIT_BACKUPS = int(os.getenv('AUDIT_BACKUPS', '20'))  # gzipped audit segments kept
+ADMISSION_SLOTS = int(os.getenv('ADMISSION_SLOTS', '16'))  # expensive requests in progress at once
+ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', '128'))  # admitted requests waiting for a slot (lower priorities get a share)
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', '0.5'))  # sustained expensive requests/s per user
+ADMISSION_USER_BURST = int(os.getenv('ADMISSION_USER_BURST', '4'))  # expensive requests one user may make back to back
+UPDATE_RECORD_FILE = os.getenv('UPDATE_RECORD_FILE')  # anonymised JSONL of incoming updates for replay.py (unset = off)
+BOT_SHARD = os.getenv('BOT_SHARD')  # "<index>/<count>", set by workers.py in each worker process
+SHARD_INDEX, SHARD_COUNT = map(int, BOT_SHARD.split('/')) if BOT_SHARD else (0, 1)
 
 # === Initialize Bot ===
-bot = telebot.TeleBot(BOT_TOKEN)
+# A shard worker runs handlers inline on its own per-chat lanes (see workers.py)
+bot = telebot.TeleBot(BOT_TOKEN, threaded=not BOT_SHARD, num_threads=BOT_WORKER_THREADS)
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+
+# === Hot-Path Metrics ===
+# Spans for sheet loads/scans, user-store calls, Bot API round trips and
+# handlers; served on METRICS_PORT and summarised by /perf (see metrics.py).
+perf = metrics.Metrics()
+perf.describe('handler_seconds', "Time spent in update handlers", 'handler')
+perf.describe('api_call_seconds', "Bot API HTTP round trips", 'method')
+perf.describe('store_seconds', "User store reads and writes", 'op')
+perf.describe('sheet_load_seconds', "Gradebook cache misses loading a sheet ('coalesced': waiting on another caller's load)", 'source')
+perf.describe('sheet_scan_seconds', "Row scans over a loaded sheet", 'op')
+perf.describe('workbook_ingest_seconds', "Parsing one workbook during ingest", 'workbook')
+metrics.install(perf)
+
+# === Outbound Rate Limiting ===
+# All Bot API calls are paced globally and per chat, with 429 retry_after
+# honoured; see ratelimit.py. Shard workers split the global rate between them.
+outbound_limiter = ratelimit.OutboundLimiter(OUTBOUND_GLOBAL_RATE / SHARD_COUNT, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+ratelimit.install(outbound_limiter)
+
+# === Admission Control ===
+# Result, top-3/ranking/statistics and registration requests pass a per-user
+# token bucket, then wait in a bounded per-priority queue for one of
+# ADMISSION_SLOTS; refused ones get a toast and are dropped (see admission.py
+# and Admission at Ingress).
+request_admission = admission.Admission(ADMISSION_SLOTS, ADMISSION_QUEUE, ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+
+# === Audit Trail ===
+# Result views, registrations, logins and language changes as JSONL, written
+# off the handler threads and rotated with gzip (see audit.py). PINs and result
+# texts are never recorded.
+audit_log = audit.AuditLog(AUDIT_LOG_FILE, AUDIT_MAX_BYTES, AUDIT_BACKUPS)
 
 # === Temporary Registration Storage ===
-temp_registrations = {}
+# A /register waiting for its language choice. Entries expire after
+# REGISTRATION_TIMEOUT on their own (see expiring.py); nothing is scheduled.
+class PendingRegistration:
+    __slots__ = ('grade_section', 'student_no', 'username', 'message_id')
+
+    def __init__(self, grade_section, student_no, username, message_id):
+        self.grade_section = grade_section
+        self.student_no = student_no
+        self.username = username
+        self.message_id = message_id
+
+temp_registrations = expiring.ExpiringDict(REGISTRATION_TIMEOUT, PENDING_REGISTRATIONS_MAX)
+
+# === Delayed Tasks ===
+# Reingest, catalog refreshes and retry backoff all run on one thread, so a
+# task that calls the Bot API hands the call to a handler thread: a send can
+# wait on the outbound limiter or a 429 pause, and every other task would
+# wait with it.
+scheduler = Scheduler('bot-scheduler')
+
+def run_on_handler_thread(fn, *args):
+    if bot.threaded:
+        bot.worker_pool.put(fn, *args)
+    else:
+        # Shard workers run handlers on their lanes and have no pool
+        threading.Thread(target=fn, args=args, name='deferred-send', daemon=True).start()
 
 # === Localization Dictionary ===
 MESSAGES = {
@@ -77,11 +201,25 @@ MESSAGES = {
         'results_displayed': "✅ *Results Displayed Successfully!*",
         'check_my_results': "✅ Check My Results",
         'view_top3': "✅ View Top 3",
+        'results_published': "📢 *New results have been published!*",
+        'grade_top_button': "🏫 Grade {grade} Top {n}",
+        'school_top_button': "🌍 School Top {n}",
+        'scope_grade': "Grade {grade}",
+        'scope_school': "Whole School",
+        'select_ranking_semester': "🏆 *{scope} Ranking* 🎓\n--------------------------------\n🌟 Please select the semester:",
+        'ranking_header': "🏆 *Top {n} Students - {scope}, {semester}* 🎓",
+        'your_rank': "📍 *Your rank:* {rank} of {total} (percentile {percentile:.0f})",
+        'class_stats_button': "📊 Class Stats",
+        'select_stats_semester': "📊 *{section} Class Statistics* 🎓\n--------------------------------\n🌟 Please select the semester:",
+        'stats_header': "📊 *Class Statistics - {section}, {semester}* 🎓",
+        'your_standing': "📍 *Your standing* (score, rank, vs class average):",
         'back_button': "⬅️ Back",
         'language_selection': "🌍 *Please select your preferred language:*",
         'registration_complete': "✅ Registration complete! You can now use the bot in English.",
         'registration_timeout': "⏳ Registration session expired. Please start again with /register.",
-        'language_set': "✅ Language set to {language}."
+        'language_set': "✅ Language set to {language}.",
+        'throttled': "⏳ Too many requests. Please wait a few seconds and try again.",
+        'shed': "🚦 The bot is busy right now. Please try again in a minute."
     },
     'am': {
         'welcome': "🎓 *እንኳን ወደ ሰላም እስላማዊ አንደኛ ደረጃ ትምህርት ቤት ውጤት ቦት ተግባቢ እንኳን ደህና መጡ* 🎓\n--------------------------------\n📚 ለሰላም እስላማዊ አንደኛ ደረጃ ትምህርት ቤት ተግባቢ ቦት\n🌐 ከ1-6 ኛ ክፍል ውጤቶችን በእውነተኛ ጊዜ ያቀርባል\n👇 ለመጀመር ከታች ይጫኑ፡\n\n- የግል ውጤቶችዎን ይመልከቱ\n- ከፍተኛ 3 ተማሪዎችን ይመልከቱ\n\n📋 *ማሳሰቢያ:* ተጨማሪ መረጃ ለማግኘት /help ይጠቀሙ።",
@@ -118,11 +256,25 @@ MESSAGES = {
         'results_displayed': "✅ *ውጤቶች በተሳካ ሁኔታ ታይተዋል!*",
         'check_my_results': "✅ ውጤቶቼን ይመልከቱ",
         'view_top3': "✅ ከፍተኛ 3 ይመልከቱ",
+        'results_published': "📢 *አዲስ ውጤቶች ታትመዋል!*",
+        'grade_top_button': "🏫 {grade}ኛ ክፍል ከፍተኛ {n}",
+        'school_top_button': "🌍 የትምህርት ቤቱ ከፍተኛ {n}",
+        'scope_grade': "{grade}ኛ ክፍል",
+        'scope_school': "መላው ትምህርት ቤት",
+        'select_ranking_semester': "🏆 *የ{scope} ደረጃ* 🎓\n--------------------------------\n🌟 እባክዎ ሴሚስተር ይምረጡ:",
+        'ranking_header': "🏆 *ከፍተኛ {n} ተማሪዎች - {scope}፣ {semester}* 🎓",
+        'your_rank': "📍 *የእርስዎ ደረጃ:* ከ{total} {rank}ኛ (ፐርሰንታይል {percentile:.0f})",
+        'class_stats_button': "📊 የክፍል ስታቲስቲክስ",
+        'select_stats_semester': "📊 *የ{section} ክፍል ስታቲስቲክስ* 🎓\n--------------------------------\n🌟 እባክዎ ሴሚስተር ይምረጡ:",
+        'stats_header': "📊 *የክፍል ስታቲስቲክስ - {section}፣ {semester}* 🎓",
+        'your_standing': "📍 *የእርስዎ ደረጃ* (ውጤት፣ ደረጃ፣ ከክፍሉ አማካይ ልዩነት):",
         'back_button': "⬅️ ተመለስ",
         'language_selection': "🌍 *እባክዎ የሚፈልጉትን ቋንቋ ይምረጡ:*",
         'registration_complete': "✅ ምዝገባ ተጠናቅቋል! አሁን ቦቱን በአማርኛ መጠቀም ይችላሉ።",
         'registration_timeout': "⏳ የምዝገባ ሂደት ጊዜው አልፏል። እባክዎ እንደገና በ/register ይጀምሩ።",
-        'language_set': "✅ ቋንቋ �ስለ {language} ተዘጋጅቷል።"
+        'language_set': "✅ ቋንቋ �ስለ {language} ተዘጋጅቷል።",
+        'throttled': "⏳ በጣም ብዙ ጥያቄዎች። እባክዎ ጥቂት ሰከንዶች ቆይተው እንደገና ይሞክሩ።",
+        'shed': "🚦 ቦቱ አሁን ተጨናንቋል። እባክዎ ከአንድ ደቂቃ በኋላ እንደገና ይሞክሩ።"
     }
 }
 
@@ -133,16 +285,650 @@ def is_number(val):
     except:
         return False
 
-def get_value(cell):
-    return cell.value if cell and hasattr(cell, 'value') and cell.value is not None else 'N/A'
+def get_value(value):
+    return value if value is not None else 'N/A'
+
+def is_admin(user_id):
+    return bool(ADMIN_ID) and str(user_id) == str(ADMIN_ID)
 
 def validate_excel_structure(ws, semester):
-    expected_cols = 18 if semester in ['S1', 'S2'] else 17
+    expected_cols = 18 if is_term_sheet(semester) else 17
     if ws.max_column < expected_cols:
         logging.warning(f"Excel file for {ws.title} has fewer columns than expected ({ws.max_column} < {expected_cols})")
         return False
     return True
 
+# === Section Catalog ===
+# The sections and semesters on offer come from data/, not from code: every
+# <grade><section>.xlsx (e.g. 4A, 10C) is a section, and its result sheets are
+# the term sheets S1, S2, ... plus the Ave summary. A refresh re-stats the
+# directory and opens only workbooks whose mtime/size changed (to list their
+# sheets), so validation and menus are dict lookups and a request for a
+# section or sheet that does not exist never opens a file.
+class SectionCatalog:
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self._lock = threading.Lock()
+        self._workbooks = {}  # grade_section -> (stamp, result sheet names)
+        self._semesters_of = {}
+        self.sections = ()  # by grade number, then section letter
+        self.grades = ()
+        self.semesters = ()  # every result sheet found in any workbook
+        self.version = 0
+        self.scans = 0
+        self.opened = 0
+
+    def refresh(self):
+        # Returns True when the set of sections or sheets changed
+        with self._lock:
+            self.scans += 1
+            workbooks = {}
+            for path in glob.glob(f"{self.base_path}*.xlsx"):
+                grade_section = os.path.splitext(os.path.basename(path))[0]
+                if split_grade_section(grade_section)[0] is None:
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stamp = (st.st_mtime_ns, st.st_size)
+                known = self._workbooks.get(grade_section)
+                if known is not None and known[0] == stamp:
+                    workbooks[grade_section] = known
+                    continue
+                try:
+                    names = xlsx_reader.sheet_names(path)
+                    self.opened += 1
+                except Exception as e:
+                    logging.error(f"Leaving {path} out of the section catalog: {type(e).__name__}: {str(e)}")
+                    continue
+                workbooks[grade_section] = (stamp, result_sheets(names))
+            semesters_of = {gs: sheets for gs, (_, sheets) in workbooks.items() if sheets}
+            changed = semesters_of != self._semesters_of
+            self._workbooks = workbooks
+            if changed:
+                self._semesters_of = semesters_of
+                self.sections = tuple(sorted(semesters_of, key=lambda gs: (int(split_grade_section(gs)[0]), split_grade_section(gs)[1])))
+                self.grades = tuple(sorted({split_grade_section(gs)[0] for gs in semesters_of}, key=int))
+                self.semesters = tuple(sorted({sem for sheets in semesters_of.values() for sem in sheets}, key=semester_order))
+                self.version += 1
+                logging.info(f"Section catalog v{self.version}: {len(self.sections)} sections, semesters {', '.join(self.semesters)}")
+            return changed
+
+    def has_section(self, grade_section):
+        return grade_section in self._semesters_of
+
+    def semesters_of(self, grade_section):
+        return self._semesters_of.get(grade_section, ())
+
+    def has_sheet(self, grade_section, semester):
+        return semester in self._semesters_of.get(grade_section, ())
+
+    def sections_of_grade(self, grade):
+        return tuple(gs for gs in self.sections if split_grade_section(gs)[0] == grade)
+
+    def stats(self):
+        return {
+            'sections': len(self.sections),
+            'grades': len(self.grades),
+            'semesters': len(self.semesters),
+            'version': self.version,
+            'scans': self.scans,
+            'opened': self.opened
+        }
+
+section_catalog = SectionCatalog(BASE_PATH)
+section_catalog.refresh()
+
+# === Gradebook Cache ===
+# Parsed sheet rows are kept per (grade_section, semester) and reused until the
+# workbook's mtime/size changes, so repeat lookups never reparse the file.
+# Misses are served from the compiled snapshot when it is fresh, otherwise the
+# single sheet is streamed out of the workbook by xlsx_reader. Concurrent
+# misses for the same sheet version are single-flighted: the first caller
+# loads, the rest wait for its result (or its exception) and count as coalesced.
+class SheetData:
+    __slots__ = ('title', 'max_column', 'rows', 'stamp', 'index', 'size')
+
+    def __init__(self, title, max_column, rows, stamp, index=None):
+        self.title = title
+        self.max_column = max_column
+        self.rows = rows
+        self.stamp = stamp
+        self.index = index if index is not None else build_row_index(rows)
+        self.size = sheet_size(rows, self.index)
+
+    def find_student(self, student_no):
+        offset = self.index.get(student_no)
+        return self.rows[offset] if offset is not None else None
+
+def build_row_index(rows):
+    with perf.span('sheet_scan_seconds', 'index'):
+        return row_index(rows)
+
+def sheet_size(rows, index):
+    # Approximate bytes a cached sheet holds: row tuples, their cells and the
+    # student index (shared small ints and None are not counted)
+    size = sys.getsizeof(rows) + sys.getsizeof(index)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(cell) for cell in row if cell is not None)
+    return size
+
+def read_sheet(file_path, semester):
+    return read_sheets(file_path, [semester])[semester]
+
+class InFlightLoad:
+    __slots__ = ('done', 'sheet', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.sheet = None
+        self.error = None
+
+class GradebookCache:
+    # Bounded by the approximate memory of the cached sheets rather than their
+    # count, since sheet sizes differ between workbooks. The newest sheet is
+    # always kept, even if it alone is over the bound.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}  # ((grade_section, semester), stamp) -> InFlightLoad
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, grade_section, semester):
+        file_path = f"{BASE_PATH}{grade_section}.xlsx"
+        st = os.stat(file_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = (grade_section, semester)
+        with self._lock:
+            sheet = self._entries.get(key)
+            if sheet is not None and sheet.stamp == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sheet
+            flight = self._in_flight.get((key, stamp))
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[(key, stamp)] = InFlightLoad()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            started = time.perf_counter()
+            flight.done.wait()
+            perf.observe('sheet_load_seconds', time.perf_counter() - started, 'coalesced', ok=flight.error is None)
+            if flight.error is not None:
+                raise flight.error
+            return flight.sheet
+
+        try:
+            started = time.perf_counter()
+            snapshot = get_snapshot()
+            compiled = snapshot.get(grade_section, semester, stamp) if snapshot else None
+            sheet = SheetData(*compiled[:3], stamp, compiled[3]) if compiled else None
+            source = 'snapshot'
+            if sheet is None:
+                title, max_column, rows = read_sheet(file_path, semester)
+                sheet = SheetData(title, max_column, rows, stamp)
+                source = 'xlsx'
+            perf.observe('sheet_load_seconds', time.perf_counter() - started, source)
+            with self._lock:
+                replaced = self._entries.pop(key, None)
+                if replaced is not None:
+                    self.bytes -= replaced.size
+                self._entries[key] = sheet
+                self.bytes += sheet.size
+                while self.bytes > self.max_bytes and len(self._entries) > 1:
+                    evicted, old = self._entries.popitem(last=False)
+                    self.bytes -= old.size
+                    self.evictions += 1
+                    logging.info(f"Gradebook cache evicted {evicted[0]}/{evicted[1]}")
+            flight.sheet = sheet
+            return sheet
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[(key, stamp)]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def publish(self, sheets, replace=False):
+        # Swaps in a freshly ingested dataset in one step; readers see either
+        # the old entries or the new ones, never a half-loaded mix
+        with self._lock:
+            entries = OrderedDict() if replace else OrderedDict(self._entries)
+            entries.update(sheets)
+            size = sum(sheet.size for sheet in entries.values())
+            if size > self.max_bytes:
+                logging.info(f"Gradebook cache grown from {format_size(self.max_bytes)} to {format_size(size)} to hold the ingested dataset")
+                self.max_bytes = size
+            self._entries = entries
+            self.bytes = size
+
+    def stamps(self):
+        with self._lock:
+            return {grade_section: sheet.stamp for (grade_section, _), sheet in self._entries.items()}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight),
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+gradebook_cache = GradebookCache(GRADEBOOK_CACHE_BYTES)
+
+# === Render Cache ===
+# Finished result/top-3 texts keyed by (kind, grade_section, semester,
+# student_no, lang). Each entry remembers the sheet stamp (data version) it was
+# rendered from; a lookup with a newer stamp re-renders and replaces it, so a
+# replaced workbook invalidates its texts without any explicit purge.
+class RenderCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get_or_render(self, key, version, render):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.stale += 1
+        payload = render()
+        with self._lock:
+            self._entries[key] = (version, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+# === Gradebook Snapshot ===
+# Written by compile_data.py (see gradebook.py); reopened when the file changes.
+_snapshot = None
+_snapshot_stamp = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot():
+    global _snapshot, _snapshot_stamp
+    try:
+        st = os.stat(SNAPSHOT_FILE)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = None
+    with _snapshot_lock:
+        if stamp != _snapshot_stamp:
+            _snapshot_stamp = stamp
+            if _snapshot is not None:
+                _snapshot.close()  # unmap the replaced file; readers still holding it fall back to the workbook
+            _snapshot = None
+            if stamp is not None:
+                try:
+                    _snapshot = GradebookSnapshot(SNAPSHOT_FILE)
+                    logging.info(f"Loaded gradebook snapshot {SNAPSHOT_FILE} ({len(_snapshot.header['sheets'])} sheets)")
+                except (OSError, ValueError, KeyError) as e:
+                    logging.error(f"Ignoring gradebook snapshot {SNAPSHOT_FILE}: {str(e)}")
+        return _snapshot
+
+def load_sheet(grade_section, semester):
+    return gradebook_cache.get(grade_section, semester)
+
+# === Gradebook Ingest ===
+# At startup every data/<section>.xlsx is parsed in parallel worker processes
+# (see ingest.py), each sheet is checked with validate_excel_structure, and the
+# whole dataset is published into the gradebook cache at once, so no student
+# pays a cold parse. A periodic scan re-ingests only workbooks whose mtime/size
+# changed. The admin gets a per-file report with timings and problems.
+_ingest_lock = threading.Lock()
+
+def workbook_paths():
+    return sorted(glob.glob(f"{BASE_PATH}*.xlsx"))
+
+def ingest_workbooks(paths, replace=False):
+    started = time.perf_counter()
+    refresh_section_catalog()
+    semesters = section_catalog.semesters
+    dataset = {}
+    report = []
+    for result in ingest.read_workbooks(paths, semesters, DATA_START_ROW, DATA_END_ROW, DATA_MAX_COL, INGEST_WORKERS):
+        grade_section = os.path.splitext(os.path.basename(result['path']))[0]
+        problems = [result['error']] if result['error'] else []
+        perf.observe('workbook_ingest_seconds', result['seconds'], grade_section, ok=not result['error'])
+        for semester in semesters:
+            if result['error']:
+                break
+            if semester not in result['sheets']:
+                problems.append(f"missing sheet {semester}")
+                continue
+            title, max_column, rows = result['sheets'][semester]
+            sheet = SheetData(title, max_column, rows, result['stamp'])
+            if not validate_excel_structure(sheet, semester):
+                problems.append(f"{semester} has {max_column} columns")
+            dataset[(grade_section, semester)] = sheet
+        report.append({
+            'grade_section': grade_section,
+            'seconds': result['seconds'],
+            'sheets': len(result['sheets']),
+            'problems': problems
+        })
+    gradebook_cache.publish(dataset, replace=replace)
+    elapsed = time.perf_counter() - started
+    report.sort(key=lambda r: r['grade_section'])
+    logging.info(f"Ingested {len(report)} workbooks ({len(dataset)} sheets) in {elapsed:.2f}s")
+    return report, elapsed
+
+def ingest_report_text(title, report, elapsed, budget=None):
+    sheets = sum(r['sheets'] for r in report)
+    problems = sum(len(r['problems']) for r in report)
+    budget_text = f" (budget {budget:.0f}s {'✅' if elapsed <= budget else '⚠️ exceeded'})" if budget else ""
+    lines = [f"{'File':<5}{'Time':>7}{'Sheets':>7}  Problems"]
+    for r in report:
+        lines.append(f"{r['grade_section']:<5}{r['seconds']:>6.2f}s{r['sheets']:>7}  {'; '.join(r['problems']) or '-'}")
+    return (
+        f"📥 *{title}*\n"
+        f"{len(report)} files, {sheets} sheets in {elapsed:.2f}s{budget_text}\n"
+        f"{problems} problem(s) found\n"
+        f"```\n" + "\n".join(lines) + "\n```"
+    )
+
+def prewarm_gradebooks():
+    with _ingest_lock:
+        report, elapsed = ingest_workbooks(workbook_paths(), replace=True)
+        ranking_index.warm()
+        class_stats_index.warm()
+    if elapsed > INGEST_BUDGET:
+        logging.warning(f"Startup ingest took {elapsed:.2f}s, over the {INGEST_BUDGET:.0f}s budget")
+    notify_admin(ingest_report_text("Gradebook Pre-warm", report, elapsed, INGEST_BUDGET))
+    return report, elapsed
+
+def reingest_changed():
+    if not _ingest_lock.acquire(blocking=False):
+        return None  # a reload is already running
+    try:
+        refresh_section_catalog()  # also notices added and removed workbooks
+        published = gradebook_cache.stamps()
+        changed = []
+        for path in workbook_paths():
+            grade_section = os.path.splitext(os.path.basename(path))[0]
+            st = os.stat(path)
+            if published.get(grade_section) != (st.st_mtime_ns, st.st_size):
+                changed.append(path)
+        if not changed:
+            return None
+        report, elapsed = ingest_workbooks(changed)
+        ranking_index.warm()
+        class_stats_index.warm()
+    finally:
+        _ingest_lock.release()
+    notify_admin(ingest_report_text("Gradebook Re-ingest", report, elapsed))
+    return report, elapsed
+
+def schedule_reingest():
+    if INGEST_INTERVAL > 0:
+        scheduler.call_later(INGEST_INTERVAL, start_reingest, name='gradebook reingest')
+
+def schedule_catalog_refresh():
+    # Shard workers skip the re-ingest scan but still follow data/ for the catalog
+    if INGEST_INTERVAL > 0:
+        scheduler.call_later(INGEST_INTERVAL, run_catalog_refresh, name='section catalog refresh')
+
+def run_catalog_refresh():
+    try:
+        refresh_section_catalog()
+    finally:
+        schedule_catalog_refresh()
+
+def start_reingest():
+    # Parsing runs off the scheduler thread so other delayed jobs stay on time
+    def run():
+        try:
+            reingest_changed()
+        except Exception:
+            logging.exception("Background gradebook re-ingest failed")
+        finally:
+            schedule_reingest()
+    threading.Thread(target=run, name='gradebook-reingest', daemon=True).start()
+
+# === Ranking Index ===
+# Students with a numeric average, sorted best-first per (section, semester)
+# and rebuilt only when that sheet's stamp changes. Grade-wide and school-wide
+# rankings are k-way merges of the section lists, cached against the stamps of
+# their sheets, so top-N is a slice and a student's rank is a lookup plus a
+# bisect. Scopes are a section ('4A'), a grade ('4') or 'school'.
+class Ranking:
+    __slots__ = ('version', 'entries', 'keys', 'scores')
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = entries  # (-average, grade_section, row offset, student_no, name)
+        self.keys = [e[0] for e in entries]
+        self.scores = {(e[1], e[3]): e[0] for e in entries}
+
+    def top(self, n):
+        return self.entries[:n]
+
+    def position(self, grade_section, student_no):
+        # (rank, total, percentile) with tied averages sharing a rank; None if unranked
+        key = self.scores.get((grade_section, str(student_no)))
+        if key is None:
+            return None
+        total = len(self.keys)
+        rank = bisect.bisect_left(self.keys, key) + 1
+        return rank, total, 100.0 * (total - rank + 1) / total
+
+def rank_sheet(ws, grade_section, semester):
+    name_col, avg_col = (3, 16) if is_term_sheet(semester) else (2, 14)
+    entries = []
+    with perf.span('sheet_scan_seconds', 'ranking'):
+        for offset, row in enumerate(ws.rows):
+            no, avg = row[1], row[avg_col]
+            if no and avg and is_number(avg):
+                entries.append((-float(avg), grade_section, offset, str(no).strip(), row[name_col]))
+        entries.sort()
+    return entries
+
+def ranking_scopes():
+    return list(section_catalog.grades) + ['school']
+
+class RankingIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rankings = {}  # (scope, semester) -> Ranking
+        self.builds = 0
+
+    def sections(self, scope):
+        if scope == 'school':
+            return section_catalog.sections
+        return section_catalog.sections_of_grade(scope)
+
+    def ranking(self, scope, semester):
+        if scope in ranking_scopes():
+            # Grade and school rankings skip sections without a usable sheet
+            sheets = []
+            for grade_section in self.sections(scope):
+                try:
+                    ws = load_sheet(grade_section, semester)
+                except (FileNotFoundError, KeyError):
+                    continue
+                if validate_excel_structure(ws, semester):
+                    sheets.append((grade_section, ws))
+        else:
+            sheets = [(scope, load_sheet(scope, semester))]
+        version = tuple((grade_section, ws.stamp) for grade_section, ws in sheets)
+        with self._lock:
+            ranking = self._rankings.get((scope, semester))
+            if ranking is not None and ranking.version == version:
+                return ranking
+        if scope in ranking_scopes():
+            entries = list(heapq.merge(*(self.ranking(grade_section, semester).entries for grade_section, _ in sheets)))
+        else:
+            entries = rank_sheet(sheets[0][1], scope, semester)
+        ranking = Ranking(version, entries)
+        with self._lock:
+            self._rankings[(scope, semester)] = ranking
+            self.builds += 1
+        return ranking
+
+    def warm(self):
+        # Builds every grade and school ranking (and the section ones beneath)
+        for scope in ranking_scopes():
+            for semester in section_catalog.semesters:
+                self.ranking(scope, semester)
+
+    def stats(self):
+        with self._lock:
+            return {'rankings': len(self._rankings), 'builds': self.builds}
+
+ranking_index = RankingIndex()
+
+# === Class Statistics ===
+# Per-subject aggregates for a section and semester. Once per sheet stamp the
+# sheet's numeric block (the eight subjects after the name, Sum and Average) is
+# copied into one array('d') per column, blanks as NaN, and each column is
+# sorted once. Every aggregate is then read off the sorted column with
+# builtins and bisects (fsum, ends, middle, pass-mark and bin cut points)
+# rather than by looping over cells per request, and a student's standing in
+# a subject is one bisect.
+SUBJECT_NAMES = {
+    'en': ["Amharic", "English", "Arabic", "Maths", "E.S", "Moral Edu", "Art", "HPE"],
+    'am': ["አማርኛ", "እንግሊዝኛ", "አረብኛ", "ሒሳብ", "ኢ.ኤስ", "ሥነ ምግባር ትምህርት", "ሥነ ጥበብ", "ኤች.ፒ.ኢ"]
+}
+STATS_SUM, STATS_AVERAGE = len(SUBJECT_NAMES['en']), len(SUBJECT_NAMES['en']) + 1  # columns after the subjects
+STATS_BINS = (50, 60, 70, 80, 90)  # average histogram edges: <50, 50-59, ..., 90+
+
+def score_value(value):
+    try:
+        return float(value) if value is not None and value != '' else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+def summarise_scores(ordered):
+    # Aggregates of one sorted column; None if nobody has a score
+    n = len(ordered)
+    if not n:
+        return None
+    mid = n // 2
+    cuts = [bisect.bisect_left(ordered, edge) for edge in STATS_BINS]
+    return {
+        'count': n,
+        'mean': math.fsum(ordered) / n,
+        'median': ordered[mid] if n % 2 else (ordered[mid - 1] + ordered[mid]) / 2,
+        'min': ordered[0],
+        'max': ordered[-1],
+        'passed': n - bisect.bisect_left(ordered, PASS_MARK),
+        'histogram': [high - low for low, high in zip([0] + cuts, cuts + [n])]
+    }
+
+class ClassStats:
+    __slots__ = ('version', 'students', 'columns', 'ordered', 'summaries')
+
+    def __init__(self, version, students, columns):
+        self.version = version
+        self.students = students  # student_no -> position in every column
+        self.columns = columns
+        self.ordered = [sorted(filterfalse(math.isnan, column)) for column in columns]
+        self.summaries = [summarise_scores(ordered) for ordered in self.ordered]
+
+    def standing(self, student_no, column):
+        # (score, rank, count) with tied scores sharing the better rank; None without a score
+        position = self.students.get(str(student_no))
+        if position is None or math.isnan(self.columns[column][position]):
+            return None
+        score = self.columns[column][position]
+        ordered = self.ordered[column]
+        return score, len(ordered) - bisect.bisect_right(ordered, score) + 1, len(ordered)
+
+def build_class_stats(ws, semester):
+    name_col = 3 if is_term_sheet(semester) else 2
+    sum_col, avg_col = (15, 16) if is_term_sheet(semester) else (13, 14)
+    first = name_col + 3
+    cols = list(range(first, first + STATS_SUM)) + [sum_col, avg_col]
+    with perf.span('sheet_scan_seconds', 'stats'):
+        rows = [row for row in ws.rows if row[1] and row[name_col]]
+        students = {}
+        for position, row in enumerate(rows):
+            students.setdefault(str(row[1]).strip(), position)
+        columns = [array('d', [score_value(row[col]) for row in rows]) for col in cols]
+        return ClassStats(ws.stamp, students, columns)
+
+class ClassStatsIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # (grade_section, semester) -> ClassStats
+        self.builds = 0
+
+    def sheet_stats(self, grade_section, semester, ws):
+        with self._lock:
+            stats = self._stats.get((grade_section, semester))
+            if stats is not None and stats.version == ws.stamp:
+                return stats
+        stats = build_class_stats(ws, semester)
+        with self._lock:
+            self._stats[(grade_section, semester)] = stats
+            self.builds += 1
+        return stats
+
+    def warm(self):
+        for grade_section in section_catalog.sections:
+            for semester in section_catalog.semesters_of(grade_section):
+                try:
+                    ws = load_sheet(grade_section, semester)
+                except (FileNotFoundError, KeyError):
+                    continue
+                if validate_excel_structure(ws, semester):
+                    self.sheet_stats(grade_section, semester, ws)
+
+    def stats(self):
+        with self._lock:
+            return {'sheets': len(self._stats), 'builds': self.builds}
+
+class_stats_index = ClassStatsIndex()
+
 def get_loading_message(chat_id, message_id):
     dots = ["⏳", "⏳.", "⏳..", "⏳..."]
     for i in range(4):
@@ -150,34 +936,37 @@ def get_loading_message(chat_id, message_id):
         time.sleep(0.5)
     return bot.edit_message_text(chat_id=chat_id, message_id=message_id, text="⏳ Processing...")
 
-def generate_unique_pin(identifiers):
+def generate_unique_pin(store):
     max_attempts = 100
     for _ in range(max_attempts):
         pin = f"{random.randint(0, 999999):06d}"  # Generate 6-digit PIN
-        if pin not in identifiers:
+        if not store.pin_exists(pin):
             return pin
     raise ValueError("Could not generate unique PIN after maximum attempts.")
 
-def get_user_language(user_id):
-    user_mapping = load_user_mapping()
-    return user_mapping.get(user_id, {}).get('language', 'en')
-
-def cleanup_temp_registration(user_id):
-    if user_id in temp_registrations:
-        del temp_registrations[user_id]
-        logging.info(f"Cleaned up temp registration for user {user_id}")
+def register_with_unique_pin(store, user_id, grade_section, student_no, lang):
+    # A PIN can be claimed between generate_unique_pin and the insert; draw
+    # another then. StudentTaken passes through. Returns the PIN registered.
+    max_attempts = 5
+    for _ in range(max_attempts):
+        pin = generate_unique_pin(store)
+        try:
+            store.register(user_id, grade_section, student_no, pin, lang)
+            return pin
+        except PinTaken:
+            logging.warning(f"PIN collision while registering {user_id}; drawing another")
+    raise ValueError("Could not register a unique PIN after repeated collisions.")
 
-def schedule_registration_cleanup(user_id):
-    timer = Timer(REGISTRATION_TIMEOUT, cleanup_temp_registration, args=[user_id])
-    timer.start()
-    return timer
+def get_user_language(user_id):
+    return user_store.get_language(user_id)
 
 # === Admin Notification Functions ===
 def notify_admin(message_text):
     if ADMIN_ID:
         try:
-            bot.send_message(ADMIN_ID, message_text, parse_mode="Markdown")
-            logging.info(f"Admin notified: {message_text}")
+            with ratelimit.outbound_lane('admin'):
+                bot.send_message(ADMIN_ID, message_text, parse_mode="Markdown")
+            logging.info(f"Admin notified: {message_text.splitlines()[0]}")
         except telebot.apihelper.ApiException as e:
             logging.error(f"Failed to notify admin: {str(e)}")
 
@@ -186,22 +975,97 @@ def notify_admin_on_restart():
     notify_admin(f"🔔 *Bot Restarted* at {timestamp}")
 
 def notify_admin_on_result_view(user_id, username, grade_section, semester, student_no, result_text):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S EAT')
-    username_str = f"@{username}" if username else "No username"
-    notify_admin(
-        f"📊 *Student Result Viewed*\n"
-        f"--------------------------------\n"
-        f"👤 *User ID:* {user_id}\n"
-        f"👤 *Username:* {username_str}\n"
-        f"📋 *Grade/Section:* {grade_section}\n"
-        f"📅 *Semester:* {semester}\n"
-        f"🔢 *Student No:* {student_no}\n"
-        f"🕒 *Time:* {timestamp}\n"
-        f"--------------------------------\n"
-        f"{result_text}"
+    # Result views are batched into periodic digests; see AdminDigest
+    audit_log.record('result_view', user_id=user_id, username=username, grade_section=grade_section,
+                     semester=semester, student_no=str(student_no))
+    admin_digest.record(grade_section, semester, student_no, user_id)
+
+# === Admin Result-View Digest ===
+# Handlers only enqueue result views. While views are waiting, a flush is
+# scheduled every ADMIN_DIGEST_INTERVAL seconds ('admin digest' in /tasks) and
+# sends one compact summary from a handler thread, so release day costs the
+# admin chat one message per interval instead of one per tap. The flush stops
+# re-arming once a round finds nothing new.
+DIGEST_MAX_CHARS = 3500  # stay below Telegram's 4096-character message limit
+
+class AdminDigest:
+    def __init__(self, interval):
+        self.interval = interval
+        self._queue = queue.SimpleQueue()
+        self._task = None  # the scheduled flush, while views are waiting
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.events = 0
+
+    def record(self, grade_section, semester, student_no, user_id):
+        if not ADMIN_ID:
+            return
+        self._queue.put((grade_section, semester, str(student_no), user_id))
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = scheduler.call_later(self.interval, self._due, name='admin digest')
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _due(self):
+        # On the scheduler thread: re-arm while there is something to send,
+        # and leave the sending to a handler thread
+        with self._lock:
+            if self._queue.empty():
+                self._task = None
+                return
+            self._task = scheduler.call_later(self.interval, self._due, name='admin digest')
+        run_on_handler_thread(self.flush)
+
+    def drain(self):
+        views = {}
+        while True:
+            try:
+                grade_section, semester, student_no, user_id = self._queue.get_nowait()
+            except queue.Empty:
+                return views
+            entry = views.setdefault((grade_section, semester), {'views': 0, 'students': set(), 'users': set()})
+            entry['views'] += 1
+            entry['students'].add(student_no)
+            entry['users'].add(user_id)
+
+    def flush(self):
+        views = self.drain()
+        if not views:
+            return
+        total = sum(v['views'] for v in views.values())
+        self.events += total
+        for text in render_digest(views, total, self.interval):
+            notify_admin(text)
+            self.sent += 1
+
+def render_digest(views, total, interval):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M EAT')
+    header = (
+        f"📊 *Results Viewed* - {total} in the last {interval}s\n"
+        f"🕒 {timestamp}\n"
     )
+    lines = [f"{'Sheet':<8}{'Views':>6}{'Students':>9}  Student Nos"]
+    for (grade_section, semester), entry in sorted(views.items()):
+        numbers = sorted(entry['students'], key=lambda n: (len(n), n))
+        shown = ','.join(numbers[:12]) + (f",+{len(numbers) - 12}" if len(numbers) > 12 else '')
+        lines.append(f"{grade_section + '/' + semester:<8}{entry['views']:>6}{len(numbers):>9}  {shown}")
+    # Split long tables across messages, repeating the column header
+    messages, chunk = [], [lines[0]]
+    for line in lines[1:]:
+        if sum(len(l) + 1 for l in chunk) + len(line) > DIGEST_MAX_CHARS:
+            messages.append(chunk)
+            chunk = [lines[0]]
+        chunk.append(line)
+    messages.append(chunk)
+    return [header + "```\n" + "\n".join(chunk) + "\n```" for chunk in messages]
+
+admin_digest = AdminDigest(ADMIN_DIGEST_INTERVAL)
 
 def notify_admin_on_registration(user_id, username, grade_section, student_no, pin):
+    audit_log.record('registration', user_id=user_id, username=username, grade_section=grade_section, student_no=str(student_no))
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S EAT')
     username_str = f"@{username}" if username else "No username"
     notify_admin(
@@ -215,275 +1079,736 @@ def notify_admin_on_registration(user_id, username, grade_section, student_no, p
         f"🕒 *Time:* {timestamp}"
     )
 
-# === Load and Save Mappings ===
-def load_user_mapping():
-    try:
-        with open(USER_MAPPING_FILE, 'r') as f:
-            return json.load(f).get('users', {})
-    except (FileNotFoundError, json.JSONDecodeError):
-        logging.error(f"Error loading {USER_MAPPING_FILE}. Returning empty mapping.")
-        return {}
-
-def load_student_identifiers():
-    try:
-        with open(STUDENT_IDENTIFIERS_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        logging.error(f"Error loading {STUDENT_IDENTIFIERS_FILE}. Returning empty mapping.")
-        return {}
+# === User Store ===
+# Users and PINs are kept in SQLite or in an append-only event journal (see
+# user_store.py); the legacy JSON files are imported once on first start.
+user_store = open_user_store(USER_STORE, USER_DB_FILE, USER_JOURNAL_FILE, USER_STATE_FILE, USER_JOURNAL_COMPACT_BYTES)
+user_store.migrate_json(USER_MAPPING_FILE, STUDENT_IDENTIFIERS_FILE)
+perf.instrument_methods(user_store, [
+    'get_user', 'get_language', 'get_pin', 'pin_exists', 'student_taken', 'counts',
+    'register', 'login', 'set_language'
+], 'store_seconds')
+
+def get_registered_user(user_id):
+    user = user_store.get_user(user_id)
+    return user if user and user['grade_section'] else None
+
+# === Results Broadcast ===
+# /broadcast diffs the live gradebook against the fingerprints saved at the
+# last broadcast and pushes each affected registered student their changed
+# results in their language, as a throttled, resumable background job (see
+# broadcast.py).
+def current_fingerprints():
+    sheets = []
+    for grade_section in section_catalog.sections:
+        for semester in section_catalog.semesters_of(grade_section):
+            try:
+                sheets.append((grade_section, semester, load_sheet(grade_section, semester)))
+            except (FileNotFoundError, KeyError):
+                continue
+    return broadcast.fingerprint_rows(sheets)
+
+def ensure_broadcast_baseline():
+    # The data live at first deployment counts as already seen by everyone
+    if broadcast.load_fingerprints(BROADCAST_BASELINE_FILE) is None:
+        broadcast.save_fingerprints(BROADCAST_BASELINE_FILE, current_fingerprints())
+        logging.info(f"Recorded broadcast baseline in {BROADCAST_BASELINE_FILE}")
+
+def plan_broadcast():
+    current = current_fingerprints()
+    changed = broadcast.changed_students(broadcast.load_fingerprints(BROADCAST_BASELINE_FILE) or {}, current)
+    recipients = []
+    for user in user_store.registered_users():
+        semesters = changed.get((user['grade_section'], user['student_no']))
+        if semesters:
+            recipients.append({
+                'telegram_id': user['telegram_id'],
+                'grade_section': user['grade_section'],
+                'student_no': user['student_no'],
+                'language': user['language'],
+                'semesters': sorted(semesters, key=semester_order)
+            })
+    return current, changed, recipients
+
+def send_broadcast_result(recipient):
+    grade_section, student_no, lang = recipient['grade_section'], recipient['student_no'], recipient['language']
+    for semester in recipient['semesters']:
+        result_text = rendered_result(load_sheet(grade_section, semester), grade_section, semester, student_no, lang)
+        if result_text is None:
+            continue
+        with ratelimit.outbound_lane('broadcast'):
+            bot.send_message(recipient['telegram_id'], f"{MESSAGES[lang]['results_published']}\n\n{result_text}", parse_mode="Markdown")
+
+def broadcast_status_text(status):
+    if status is None:
+        return "📢 *Results Broadcast*\n--------------------------------\nNo broadcast has been run yet."
+    done = status['next']
+    total = status['total']
+    failures = "\n".join(f"{telegram_id}: {error}" for telegram_id, error in list(status['failed'].items())[:5])
+    return (
+        f"📢 *Results Broadcast*\n"
+        f"--------------------------------\n"
+        f"Status: {status['status']}\n"
+        f"Created: {status['created']}\n"
+        f"Progress: {done}/{total} ({done / total if total else 1:.0%})\n"
+        f"Sent: {status['sent']}\n"
+        f"Failed: {len(status['failed'])}"
+        + (f"\n--------------------------------\n```\n{failures}\n```" if failures else "")
+    )
 
-def save_user_mapping(user_mapping):
-    with open(USER_MAPPING_FILE, 'w') as f:
-        json.dump({'users': user_mapping}, f, indent=2)
+def broadcast_command_text(action):
+    if action in ('', 'preview'):
+        if broadcast_job.running():
+            return broadcast_status_text(broadcast_job.status())
+        _, changed, recipients = plan_broadcast()
+        sections = sorted({grade_section for grade_section, _ in changed})
+        return (
+            f"📢 *Results Broadcast Preview*\n"
+            f"--------------------------------\n"
+            f"Students with changed results: {len(changed)}\n"
+            f"Sections: {', '.join(sections) or 'None'}\n"
+            f"Registered recipients: {len(recipients)}\n"
+            f"--------------------------------\n"
+            f"Send with /broadcast start, or check progress with /broadcast status."
+        )
+    if action == 'start':
+        if broadcast_job.running():
+            return "⚠️ A broadcast is already running.\n\n" + broadcast_status_text(broadcast_job.status())
+        current, changed, recipients = plan_broadcast()
+        # The new data version becomes the baseline even if nobody is registered for it
+        broadcast.save_fingerprints(BROADCAST_BASELINE_FILE, current)
+        if not recipients:
+            return f"📢 No registered students to notify ({len(changed)} changed). Baseline updated."
+        broadcast_job.create(recipients)
+        broadcast_job.start()
+        return broadcast_status_text(broadcast_job.status())
+    if action == 'status':
+        return broadcast_status_text(broadcast_job.status())
+    if action == 'cancel':
+        broadcast_job.cancel()
+        return broadcast_status_text(broadcast_job.status())
+    return "Usage: /broadcast [preview|start|status|cancel]"
+
+def notify_broadcast_progress(status):
+    notify_admin(broadcast_status_text(status))
+
+broadcast_job = broadcast.BroadcastJob(BROADCAST_PLAN_FILE, BROADCAST_PROGRESS_FILE, send_broadcast_result,
+                                       BROADCAST_RATE, on_progress=notify_broadcast_progress)
+
+def resume_broadcast():
+    if broadcast_job.load():
+        logging.info("Resuming interrupted results broadcast")
+        broadcast_job.start()
+
+# === Replies ===
+# Handler logic is shared by both runtimes: a *_replies function parses and
+# validates the request, does its store and sheet work and returns the Replies
+# to send. bot.py's handlers and async_bot.py's coroutines differ only in how
+# they send them (send_replies here, its coroutine twin in async_bot.py).
+class Reply:
+    # how: 'reply' to the message (for a callback, to the tapped message),
+    # 'edit' the tapped message, 'in_place' (edit it, then answer the callback;
+    # see respond_in_place), 'answer' the callback with an optional toast,
+    # 'send' to chat_id (default: the request's chat), or 'welcome' (a reply
+    # retried with backoff; see show_welcome_message).
+    # If sending fails with an API error and `fallback` is set, the fallback is
+    # sent to the request's chat instead and the remaining replies are dropped;
+    # a 'welcome' reply sends it after its last attempt.
+    __slots__ = ('how', 'text', 'markup', 'markdown', 'chat_id', 'fallback')
+
+    def __init__(self, how, text=None, markup=None, markdown=True, chat_id=None, fallback=None):
+        self.how = how
+        self.text = text
+        self.markup = markup
+        self.markdown = markdown
+        self.chat_id = chat_id
+        self.fallback = fallback
+
+def send_replies(request, replies):
+    call = request if isinstance(request, types.CallbackQuery) else None
+    message = call.message if call else request
+    for reply in replies:
+        try:
+            send_reply(call, message, reply)
+        except telebot.apihelper.ApiException as e:
+            if reply.fallback is None:
+                raise
+            logging.error(f"Sending to {reply.chat_id or message.chat.id} failed: {str(e)}")
+            bot.send_message(message.chat.id, reply.fallback, parse_mode="Markdown")
+            return
 
-def save_student_identifiers(identifiers):
-    with open(STUDENT_IDENTIFIERS_FILE, 'w') as f:
-        json.dump(identifiers, f, indent=2)
+def send_reply(call, message, reply):
+    parse_mode = "Markdown" if reply.markdown else None
+    if reply.how == 'reply':
+        bot.reply_to(message, reply.text, reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'edit':
+        bot.edit_message_text(chat_id=message.chat.id, message_id=message.message_id, text=reply.text,
+                              reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'in_place':
+        respond_in_place(call, reply.text, reply.markup)
+    elif reply.how == 'answer':
+        bot.answer_callback_query(call.id, reply.text)
+    elif reply.how == 'send':
+        bot.send_message(reply.chat_id or message.chat.id, reply.text, reply_markup=reply.markup, parse_mode=parse_mode)
+    elif reply.how == 'welcome':
+        show_welcome_message(message, reply)
+
+# === Admission at Ingress ===
+# Expensive requests are admitted as updates arrive, before telebot queues them
+# for a handler thread. An admitted update waits in the admission queue and is
+# handed to telebot once one of ADMISSION_SLOTS is free, highest priority
+# first, so telebot's own queue never holds more than ADMISSION_SLOTS of them;
+# only a burst that overflows the admission queue is shed. A refused request
+# is answered from a handler thread (one toast, no sheet work); an admitted one
+# frees its slot when its handler returns. Shard workers call admit_update
+# themselves with a dispatch that puts the update on its lane.
+def admission_kind(request):
+    # Message or CallbackQuery -> its admission kind, or None if it is not gated
+    if isinstance(request, types.Message):
+        text = request.text
+        if text and telebot.util.extract_command(text) == 'register' and len(text.split()) == 3:
+            return 'register'
+        return None
+    data = request.data
+    if not data or data.endswith('_back'):
+        return None
+    if data.startswith('semester_'):
+        return 'results'
+    if data.startswith('top3_'):
+        return 'top3'
+    parse = parse_ranking_callback if data.startswith('rank_') else parse_stats_callback if data.startswith('stats_') else None
+    parsed = parse(data) if parse else None
+    if parsed is not None and parsed[1] is not None:
+        return 'top3'
+    return None
+
+def admit_update(update, dispatch):
+    # Calls dispatch(update) now or once the admission queue reaches it and
+    # returns None, or returns the verdict the update was refused with
+    request = update.message or update.callback_query
+    kind = admission_kind(request) if request is not None else None
+    if kind is None:
+        dispatch(update)
+        return None
+
+    def start():
+        request.admitted = True
+        dispatch(update)
+
+    verdict = request_admission.submit(str(request.from_user.id), kind, start)
+    return None if verdict == admission.ADMITTED else verdict
+
+def refusal_replies(request, verdict):
+    lang = get_user_language(str(request.from_user.id))
+    if isinstance(request, types.CallbackQuery):
+        return [Reply('answer', MESSAGES[lang][verdict])]
+    return [Reply('reply', MESSAGES[lang][verdict], markdown=False)]
+
+def refuse_request(request, verdict):
+    send_replies(request, refusal_replies(request, verdict))
+
+def admit_updates(updates):
+    for update in updates:
+        verdict = admit_update(update, lambda admitted: dispatch_updates([admitted]))
+        if verdict is not None:
+            bot.worker_pool.put(refuse_request, update.message or update.callback_query, verdict)
+
+def releases_admission(handler):
+    @functools.wraps(handler)
+    def handle(request, *args, **kwargs):
+        try:
+            return handler(request, *args, **kwargs)
+        finally:
+            if getattr(request, 'admitted', False):
+                request_admission.release()
+    return handle
+
+if not BOT_SHARD:
+    dispatch_updates = bot.process_new_updates
+    bot.process_new_updates = admit_updates
+
+# === Update Recording ===
+# In worker mode the supervisor records at its ingress instead of every shard.
+# Attached after admission so refused updates are recorded too.
+update_recorder = replay.UpdateRecorder(UPDATE_RECORD_FILE, ADMIN_ID) if UPDATE_RECORD_FILE and not BOT_SHARD else None
+if update_recorder:
+    update_recorder.attach(bot)
+    logging.info(f"Recording anonymised updates to {UPDATE_RECORD_FILE}")
 
 # === Registration with Language Selection ===
-@bot.message_handler(commands=['register'])
-def register_user(message):
+def register_replies(message):
     user_id = str(message.from_user.id)
     lang = get_user_language(user_id)
     args = message.text.split()
-    
+
     if len(args) != 3:
-        bot.reply_to(message, MESSAGES[lang]['register_usage'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[lang]['register_usage'])]
 
     grade_section, student_no = args[1], args[2]
     username = message.from_user.username
-    user_mapping = load_user_mapping()
-    student_identifiers = load_student_identifiers()
 
     # Validate grade_section
-    valid_sections = ['1A', '1B', '1C', '2A', '2B', '2C', '3A', '3B', '4A', '4B', '5A', '5B', '6A', '6B']
-    if grade_section not in valid_sections:
-        bot.reply_to(message, MESSAGES[lang]['invalid_grade_section'].format(sections=', '.join(valid_sections)), parse_mode="Markdown")
-        return
+    if not section_catalog.has_section(grade_section):
+        return [Reply('reply', MESSAGES[lang]['invalid_grade_section'].format(sections=', '.join(section_catalog.sections)))]
 
     # Validate student_no
     if not student_no.isdigit() or not (1 <= int(student_no) <= 60):
-        bot.reply_to(message, MESSAGES[lang]['invalid_student_no'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[lang]['invalid_student_no'])]
 
     # Check if user is already registered
-    if user_id in user_mapping:
-        bot.reply_to(message, MESSAGES[lang]['already_registered'].format(
-            grade_section=user_mapping[user_id]['grade_section'],
-            student_no=user_mapping[user_id]['student_no']
-        ), parse_mode="Markdown")
-        return
+    user = get_registered_user(user_id)
+    if user:
+        return [Reply('reply', MESSAGES[lang]['already_registered'].format(
+            grade_section=user['grade_section'],
+            student_no=user['student_no']
+        ))]
 
     # Check if student is already registered by another user
-    for pin, data in student_identifiers.items():
-        if data['grade_section'] == grade_section and data['student_no'] == student_no:
-            bot.reply_to(message, MESSAGES[lang]['student_taken'].format(
-                student_no=student_no,
-                grade_section=grade_section
-            ), parse_mode="Markdown")
-            return
+    if user_store.student_taken(grade_section, student_no):
+        return [Reply('reply', MESSAGES[lang]['student_taken'].format(
+            student_no=student_no,
+            grade_section=grade_section
+        ))]
 
-    # Store temporary registration data
-    temp_registrations[user_id] = {
-        'grade_section': grade_section,
-        'student_no': student_no,
-        'username': username,
-        'message_id': message.message_id,
-        'timer': schedule_registration_cleanup(user_id)
-    }
+    # Store temporary registration data, replacing any pending one
+    temp_registrations.put(user_id, PendingRegistration(grade_section, student_no, username, message.message_id))
 
     # Prompt for language selection
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        types.InlineKeyboardButton("English 🇬🇧", callback_data=f'reg_lang_en_{grade_section}_{student_no}'),
-        types.InlineKeyboardButton("Amharic 🇪🇹", callback_data=f'reg_lang_am_{grade_section}_{student_no}')
-    )
-    
-    bot.reply_to(message, 
-        MESSAGES[lang]['language_selection'],
-        reply_markup=markup
-    )
+    return [Reply('reply', MESSAGES[lang]['language_selection'],
+                  get_registration_language_markup(grade_section, student_no), markdown=False)]
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('reg_lang_'))
-def handle_registration_language(call):
+@bot.message_handler(commands=['register'])
+@releases_admission
+def register_user(message):
+    send_replies(message, register_replies(message))
+
+def registration_language_replies(call):
     user_id = str(call.from_user.id)
     _, _, lang, grade_section, student_no = call.data.split('_', 4)
-    
-    if user_id not in temp_registrations:
-        bot.answer_callback_query(call.id, MESSAGES['en']['registration_timeout'])
-        return
 
-    registration_data = temp_registrations[user_id]
-    registration_data['timer'].cancel()  # Cancel the cleanup timer
-    
-    username = registration_data['username']
-    user_mapping = load_user_mapping()
-    student_identifiers = load_student_identifiers()
+    registration = temp_registrations.get(user_id)
+    if registration is None:
+        return [Reply('answer', MESSAGES['en']['registration_timeout'])]
 
-    # Generate unique 6-digit PIN
+    # Generate a unique 6-digit PIN and store it with the user's language preference in one transaction
     try:
-        pin = generate_unique_pin(student_identifiers)
+        pin = register_with_unique_pin(user_store, user_id, grade_section, student_no, lang)
+    except StudentTaken:
+        temp_registrations.pop(user_id)
+        return [Reply('send', MESSAGES[lang]['student_taken'].format(
+            student_no=student_no,
+            grade_section=grade_section
+        ))]
     except ValueError as e:
-        bot.send_message(call.message.chat.id, MESSAGES[lang]['pin_error'].format(error=str(e)), parse_mode="Markdown")
-        return
-
-    # Store student data with Telegram ID
-    student_identifiers[pin] = {
-        'grade_section': grade_section,
-        'student_no': student_no,
-        'telegram_id': user_id
-    }
-    save_student_identifiers(student_identifiers)
-
-    # Store user mapping with language preference
-    user_mapping[user_id] = {
-        'grade_section': grade_section,
-        'student_no': student_no,
-        'pin': pin,
-        'language': lang
-    }
-    save_user_mapping(user_mapping)
+        return [Reply('send', MESSAGES[lang]['pin_error'].format(error=str(e)))]
 
     # Clean up temporary data
-    del temp_registrations[user_id]
+    temp_registrations.pop(user_id)
+    notify_admin_on_registration(user_id, registration.username, grade_section, student_no, pin)
 
-    # Send confirmation
-    try:
-        bot.send_message(user_id, MESSAGES[lang]['register_success'].format(
+    # Send the PIN privately, close the language prompt, then welcome in the chosen language
+    pin_failed = MESSAGES[lang]['pin_failed']
+    return [
+        Reply('send', MESSAGES[lang]['register_success'].format(
             pin=pin,
             grade_section=grade_section,
             student_no=student_no
-        ), parse_mode="Markdown")
-        
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=MESSAGES[lang]['registration_complete'],
-            reply_markup=None
-        )
-        
-        notify_admin_on_registration(user_id, username, grade_section, student_no, pin)
-        show_welcome_message(call.message)  # Show welcome message in selected language
-        
-    except telebot.apihelper.ApiException as e:
-        bot.send_message(call.message.chat.id, MESSAGES[lang]['pin_failed'], parse_mode="Markdown")
-        logging.error(f"Failed to send PIN to {user_id}: {str(e)}")
+        ), chat_id=user_id, fallback=pin_failed),
+        Reply('edit', MESSAGES[lang]['registration_complete'], markdown=False, fallback=pin_failed),
+        welcome_reply(lang)
+    ]
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('reg_lang_'))
+def handle_registration_language(call):
+    send_replies(call, registration_language_replies(call))
 
 # === /login Command Handler ===
-@bot.message_handler(commands=['login'])
-def login_user(message):
+def login_replies(message):
     user_id = str(message.from_user.id)
     lang = get_user_language(user_id)
     args = message.text.split()
     if len(args) != 2:
-        bot.reply_to(message, MESSAGES[lang]['login_usage'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[lang]['login_usage'])]
 
     pin = args[1]
-    username = message.from_user.username
-    user_mapping = load_user_mapping()
-    student_identifiers = load_student_identifiers()
-
-    if pin not in student_identifiers:
-        bot.reply_to(message, MESSAGES[lang]['invalid_pin'], parse_mode="Markdown")
-        return
+    student_data = user_store.get_pin(pin)
+    if student_data is None:
+        return [Reply('reply', MESSAGES[lang]['invalid_pin'])]
 
-    student_data = student_identifiers[pin]
     if student_data['telegram_id'] != user_id:
-        bot.reply_to(message, MESSAGES[lang]['pin_not_owned'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[lang]['pin_not_owned'])]
+
+    # Update user record, preserving the existing language
+    user_store.login(user_id, student_data, lang)
+    audit_log.record('login', user_id=user_id, username=message.from_user.username,
+                     grade_section=student_data['grade_section'], student_no=student_data['student_no'])
+    return [
+        Reply('reply', MESSAGES[lang]['login_success'].format(
+            grade_section=student_data['grade_section'],
+            student_no=student_data['student_no']
+        )),
+        welcome_reply(lang)  # Show welcome message after successful login
+    ]
 
-    # Update user mapping
-    user_mapping[user_id] = {
-        'grade_section': student_data['grade_section'],
-        'student_no': student_data['student_no'],
-        'pin': pin,
-        'language': lang  # Preserve existing language
-    }
-    save_user_mapping(user_mapping)
-    bot.reply_to(message, MESSAGES[lang]['login_success'].format(
-        grade_section=student_data['grade_section'],
-        student_no=student_data['student_no']
-    ), parse_mode="Markdown")
-    show_welcome_message(message)  # Show welcome message after successful login
+@bot.message_handler(commands=['login'])
+def login_user(message):
+    send_replies(message, login_replies(message))
 
 # === /start Command Handler ===
-@bot.message_handler(commands=['start'])
-def send_welcome(message):
+def start_replies(message):
     user_id = str(message.from_user.id)
     lang = get_user_language(user_id)
-    user_mapping = load_user_mapping()
 
-    if user_id in user_mapping:
-        show_welcome_message(message)
-    else:
-        bot.reply_to(message, MESSAGES[lang]['not_authenticated'], parse_mode="Markdown")
+    if get_registered_user(user_id):
+        return [welcome_reply(lang)]
+    return [Reply('reply', MESSAGES[lang]['not_authenticated'])]
+
+@bot.message_handler(commands=['start'])
+def send_welcome(message):
+    send_replies(message, start_replies(message))
 
 # === Show Welcome Message ===
-def show_welcome_message(message):
-    user_id = str(message.from_user.id)
-    lang = get_user_language(user_id)
+def welcome_reply(lang):
+    return Reply('welcome', MESSAGES[lang]['welcome'], get_welcome_markup(lang),
+                 fallback=MESSAGES[lang]['unexpected_error'].format(error="Unable to connect to Telegram"))
+
+def show_welcome_message(message, reply, attempt=0):
     max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton(MESSAGES[lang]['check_my_results'], callback_data='results'))
-            markup.add(types.InlineKeyboardButton(MESSAGES[lang]['view_top3'], callback_data='top3'))
-            bot.reply_to(message, MESSAGES[lang]['welcome'], parse_mode="Markdown", reply_markup=markup)
-            break
-        except telebot.apihelper.ApiException as e:
-            logging.error(f"Attempt {attempt + 1} failed: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-            else:
-                bot.reply_to(message, MESSAGES[lang]['unexpected_error'].format(error="Unable to connect to Telegram"), parse_mode="Markdown")
+    try:
+        bot.reply_to(message, reply.text, parse_mode="Markdown", reply_markup=reply.markup)
+    except telebot.apihelper.ApiException as e:
+        logging.error(f"Attempt {attempt + 1} failed: {str(e)}")
+        if attempt < max_retries - 1:
+            # Back off on the scheduler instead of sleeping in the handler thread
+            scheduler.call_later(2 ** attempt, run_on_handler_thread, show_welcome_message, message, reply, attempt + 1,
+                                 name='welcome retry')
+        else:
+            bot.reply_to(message, reply.fallback, parse_mode="Markdown")
 
 # === /help Command Handler ===
+def help_replies(message):
+    lang = get_user_language(str(message.from_user.id))
+    return [Reply('reply', MESSAGES[lang]['help'])]
+
 @bot.message_handler(commands=['help'])
 def send_help(message):
-    user_id = str(message.from_user.id)
-    lang = get_user_language(user_id)
-    bot.reply_to(message, MESSAGES[lang]['help'], parse_mode="Markdown")
+    send_replies(message, help_replies(message))
 
 # === /lang Command Handler ===
-@bot.message_handler(commands=['lang'])
-def set_language(message):
+def language_replies(message):
     user_id = str(message.from_user.id)
     current_lang = get_user_language(user_id)
     args = message.text.split()
-    
+
     if len(args) != 2:
-        bot.reply_to(message, MESSAGES[current_lang]['language_selection'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[current_lang]['language_selection'])]
 
     lang = args[1].lower()
     if lang not in ['am', 'en']:
-        bot.reply_to(message, MESSAGES[current_lang]['invalid_lang'], parse_mode="Markdown")
-        return
+        return [Reply('reply', MESSAGES[current_lang]['invalid_lang'])]
+
+    user_store.set_language(user_id, lang)
+    audit_log.record('language', user_id=user_id, language=lang)
 
-    user_mapping = load_user_mapping()
-    if user_id in user_mapping:
-        user_mapping[user_id]['language'] = lang
-    else:
-        user_mapping[user_id] = {'language': lang}
-    
-    save_user_mapping(user_mapping)
-    
     lang_name = "Amharic" if lang == "am" else "English"
-    bot.reply_to(message, MESSAGES[lang]['language_set'].format(language=lang_name), parse_mode="Markdown")
+    return [Reply('reply', MESSAGES[lang]['language_set'].format(language=lang_name))]
+
+@bot.message_handler(commands=['lang'])
+def set_language(message):
+    send_replies(message, language_replies(message))
+
+# === Admin Commands ===
+# Each command's text comes from its *_text function below; ADMIN_COMMANDS
+# (after them) maps the commands to those and is served by one handler per
+# runtime. Non-admins get the invalid-command reply.
+def cache_stats_text():
+    stats = gradebook_cache.stats()
+    render = render_cache.stats()
+    rankings = ranking_index.stats()
+    class_stats = class_stats_index.stats()
+    catalog = section_catalog.stats()
+    return (
+        f"🗃️ *Gradebook Cache*\n"
+        f"--------------------------------\n"
+        f"Entries: {stats['entries']} ({format_size(stats['bytes'])} of {format_size(stats['max_bytes'])})\n"
+        f"Hits: {stats['hits']}\n"
+        f"Misses: {stats['misses']}\n"
+        f"Coalesced: {stats['coalesced']} ({stats['in_flight']} loading now)\n"
+        f"Evictions: {stats['evictions']}\n"
+        f"Hit rate: {stats['hit_rate']:.1%}\n"
+        f"--------------------------------\n"
+        f"🧾 *Rendered Responses*\n"
+        f"Entries: {render['entries']}/{render['max_entries']}\n"
+        f"Hits: {render['hits']}\n"
+        f"Misses: {render['misses']} ({render['stale']} stale)\n"
+        f"Hit rate: {render['hit_rate']:.1%}\n"
+        f"--------------------------------\n"
+        f"🏆 *Rankings*\n"
+        f"Cached: {rankings['rankings']}\n"
+        f"Builds: {rankings['builds']}\n"
+        f"--------------------------------\n"
+        f"📊 *Class Statistics*\n"
+        f"Sheets: {class_stats['sheets']}\n"
+        f"Builds: {class_stats['builds']}\n"
+        f"--------------------------------\n"
+        f"📚 *Section Catalog* (v{catalog['version']})\n"
+        f"Sections: {catalog['sections']} in {catalog['grades']} grades\n"
+        f"Semesters: {', '.join(section_catalog.semesters)}\n"
+        f"Scans: {catalog['scans']} ({catalog['opened']} workbooks opened)"
+    )
+
+def scheduled_tasks_text():
+    by_name = scheduler.pending_by_name()
+    lines = "\n".join(f"{name}: {n}" for name, n in sorted(by_name.items())) or "None"
+    return (
+        f"⏱️ *Scheduled Tasks*\n"
+        f"--------------------------------\n"
+        f"Pending: {sum(by_name.values())}\n"
+        f"Executed: {scheduler.executed}\n"
+        f"Failed: {scheduler.failed}\n"
+        f"--------------------------------\n"
+        f"{lines}"
+    )
+
+def outbound_stats_text():
+    stats = outbound_limiter.stats()
+    lanes = "\n".join(
+        f"{lane}: {stats['calls'][lane]} sent, {stats['throttled'][lane]} throttled, {stats['waiting'][lane]} waiting"
+        for lane in ratelimit.LANES
+    )
+    return (
+        f"🚦 *Outbound Telegram Calls*\n"
+        f"--------------------------------\n"
+        f"{lanes}\n"
+        f"--------------------------------\n"
+        f"Retried after 429: {stats['retried']}\n"
+        f"Failed after retries: {stats['failed']}\n"
+        f"Tracked chats: {stats['chats']}"
+    )
+
+def admission_stats_text():
+    stats = request_admission.stats()
+    kinds = "\n".join(
+        f"{kind}: {counts['admitted']} admitted, {counts['throttled']} throttled, {counts['shed']} shed, "
+        f"{stats['queued'][kind]}/{stats['queue_limits'][kind]} waiting"
+        for kind, counts in stats['counts'].items()
+    )
+    return (
+        f"🚪 *Admission Control*\n"
+        f"--------------------------------\n"
+        f"{kinds}\n"
+        f"--------------------------------\n"
+        f"In progress: {stats['active']}/{stats['slots']}\n"
+        f"Tracked users: {stats['users']}"
+    )
+
+def reload_gradebooks_text():
+    with _ingest_lock:
+        report, elapsed = ingest_workbooks(workbook_paths(), replace=True)
+    return ingest_report_text("Gradebook Reload", report, elapsed)
+
+def audit_report_text(days=None):
+    since = time.time() - days * 86400 if days else None
+    views, totals = audit.aggregate(audit_log.events(since))
+    lines = [f"{'Section':<8}{'Sem':<5}{'Views':>7}{'Students':>10}{'Users':>7}"]
+    for (grade_section, semester), entry in sorted(views.items()):
+        lines.append(f"{grade_section:<8}{semester:<5}{entry['views']:>7}{len(entry['students']):>10}{len(entry['users']):>7}")
+    return (
+        f"🧾 *Audit Trail* ({f'last {days} day(s)' if days else 'all time'})\n"
+        f"--------------------------------\n"
+        f"Result views: {totals.get('result_view', 0)}\n"
+        f"Registrations: {totals.get('registration', 0)}\n"
+        f"Logins: {totals.get('login', 0)}\n"
+        f"Language changes: {totals.get('language', 0)}\n"
+        f"Dropped (queue full): {audit_log.dropped}\n"
+        f"--------------------------------\n"
+        + ("```\n" + "\n".join(lines) + "\n```" if views else "No result views recorded.")
+    )
+
+def perf_summary_text(minutes):
+    rows, truncated = perf.summary(minutes * 60)
+    lines = [f"{'Span':<28}{'n':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}"]
+    family = None
+    for r in rows:
+        if r['name'] != family:
+            family = r['name']
+            lines.append(f"{family.replace('_seconds', '')}:")
+        lines.append(f"  {r['label'][:26]:<26}{r['count']:>6}" + "".join(
+            f"{r[k] * 1000:>8.1f}" for k in ('p50', 'p95', 'p99', 'max')
+        ))
+    note = "\n⚠️ Older samples were dropped; the window is partial." if truncated else ""
+    return (
+        f"📈 *Performance, last {minutes} min* (ms)\n"
+        f"--------------------------------\n"
+        + ("```\n" + "\n".join(lines) + "\n```" if rows else "No samples yet.")
+        + note
+    )
+
+def perf_counters():
+    cache = gradebook_cache.stats()
+    render = render_cache.stats()
+    outbound = outbound_limiter.stats()
+    admission_stats = request_admission.stats()
+    return [
+        ('gradebook_cache_lookups_total', "Gradebook cache lookups",
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses']),
+          ({'result': 'coalesced'}, cache['coalesced'])]),
+        ('render_cache_lookups_total', "Rendered response cache lookups",
+         [({'result': 'hit'}, render['hits']), ({'result': 'miss'}, render['misses'])]),
+        ('outbound_calls_total', "Bot API calls made, by lane",
+         [({'lane': lane}, n) for lane, n in outbound['calls'].items()]),
+        ('outbound_throttled_total', "Bot API calls that waited for a token, by lane",
+         [({'lane': lane}, n) for lane, n in outbound['throttled'].items()]),
+        ('outbound_retried_total', "Bot API calls retried after a 429", [({}, outbound['retried'])]),
+        ('admission_requests_total', "Expensive requests by kind and admission verdict",
+         [({'kind': kind, 'verdict': verdict}, n) for kind, counts in admission_stats['counts'].items()
+          for verdict, n in counts.items()]),
+        ('scheduled_tasks_total', "Delayed tasks run by the scheduler",
+         [({'outcome': 'executed'}, scheduler.executed), ({'outcome': 'failed'}, scheduler.failed)])
+    ]
+
+perf.add_collector(perf_counters)
+
+# === Memory Accounting ===
+# /mem reports RSS, the size of every bounded in-memory structure and, while
+# tracemalloc is tracing, the top allocation sites. Tracing slows every
+# allocation, so it only runs between /mem start and /mem stop (or from boot
+# with PYTHONTRACEMALLOC=<frames>).
+MEM_TOP_SITES = 10
+
+def memory_command_text(args):
+    action = args[0].lower() if args else ''
+    if action == 'start':
+        frames = int(args[1]) if len(args) > 1 and args[1].isdigit() and int(args[1]) > 0 else 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logging.info(f"tracemalloc started ({frames} frames)")
+        return "🔬 Allocation tracing is on; /mem shows the top sites, /mem stop ends it."
+    if action == 'stop':
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logging.info("tracemalloc stopped")
+        return "🔬 Allocation tracing is off."
+    return memory_report_text()
+
+def format_size(n):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+def process_memory():
+    # (rss, peak rss) in bytes, or (None, None) where /proc is not available
+    try:
+        with open('/proc/self/status', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def allocation_sites_text(limit=MEM_TOP_SITES):
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    lines = []
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{format_size(stat.size):>10}{stat.count:>8}  {os.path.basename(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines)
+
+def memory_report_text():
+    rss, peak = process_memory()
+    callbacks = PROCESSED_CALLBACKS.stats()
+    pending = temp_registrations.stats()
+    cache = gradebook_cache.stats()
+    render = render_cache.stats()
+    structures = (
+        f"Callback dedupe: {callbacks['entries']}/{callbacks['max_entries']} ({callbacks['ttl']}s TTL, {callbacks['evicted']} evicted early)\n"
+        f"Pending registrations: {pending['entries']}/{pending['max_entries']} ({pending['expired']} expired)\n"
+        f"Gradebook sheets: {cache['entries']} ({format_size(cache['bytes'])} of {format_size(cache['max_bytes'])})\n"
+        f"Rendered responses: {render['entries']}/{render['max_entries']}\n"
+        f"Rankings: {ranking_index.stats()['rankings']}\n"
+        f"Admission users: {request_admission.stats()['users']}\n"
+        f"Outbound chats: {outbound_limiter.stats()['chats']}\n"
+        f"Scheduled tasks: {scheduler.pending()}"
+    )
+    if tracemalloc.is_tracing():
+        current, traced_peak = tracemalloc.get_traced_memory()
+        sites = allocation_sites_text()
+        tracing = (
+            f"Traced: {format_size(current)} (peak {format_size(traced_peak)})\n"
+            + (f"```\n{'size':>10}{'blocks':>8}  site\n{sites}\n```" if sites else "No allocations traced yet.")
+        )
+    else:
+        tracing = "Allocation tracing is off; /mem start turns it on."
+    return (
+        f"🧠 *Memory*\n"
+        f"--------------------------------\n"
+        f"RSS: {format_size(rss) if rss is not None else 'n/a'} (peak {format_size(peak) if peak is not None else 'n/a'})\n"
+        f"Threads: {threading.active_count()}\n"
+        f"--------------------------------\n"
+        f"{structures}\n"
+        f"--------------------------------\n"
+        f"{tracing}"
+    )
+
+# === Admin Command Dispatch ===
+def positive_int_arg(args, default=None):
+    return int(args[0]) if len(args) == 1 and args[0].isdigit() and int(args[0]) > 0 else default
+
+# command -> text of its reply, from the words after the command
+ADMIN_COMMANDS = {
+    'cache': lambda args: cache_stats_text(),
+    'tasks': lambda args: scheduled_tasks_text(),
+    'ratelimit': lambda args: outbound_stats_text(),
+    'admission': lambda args: admission_stats_text(),
+    'reload': lambda args: reload_gradebooks_text(),
+    'broadcast': lambda args: broadcast_command_text(args[0].lower() if args else ''),
+    'audit': lambda args: audit_report_text(positive_int_arg(args)),
+    'perf': lambda args: perf_summary_text(positive_int_arg(args, PERF_WINDOW_MINUTES)),
+    'mem': memory_command_text
+}
+
+def admin_replies(message):
+    if not is_admin(message.from_user.id):
+        return invalid_command_replies(message)
+    args = message.text.split()
+    return [Reply('reply', ADMIN_COMMANDS[telebot.util.extract_command(message.text)](args[1:]))]
+
+@bot.message_handler(commands=list(ADMIN_COMMANDS))
+def run_admin_command(message):
+    send_replies(message, admin_replies(message))
 
 # === Catch Unexpected Input ===
+def invalid_command_replies(message):
+    lang = get_user_language(str(message.from_user.id))
+    return [Reply('reply', MESSAGES[lang]['invalid_command'])]
+
 @bot.message_handler(func=lambda message: True)
 def handle_unexpected_input(message):
-    user_id = str(message.from_user.id)
-    lang = get_user_language(user_id)
-    bot.reply_to(message, MESSAGES[lang]['invalid_command'], parse_mode="Markdown")
+    send_replies(message, invalid_command_replies(message))
 
 # === Helper Functions for Markups ===
-def get_grade_section_markup(is_top3=False, lang='en'):
+def get_registration_language_markup(grade_section, student_no):
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton("English 🇬🇧", callback_data=f'reg_lang_en_{grade_section}_{student_no}'),
+        types.InlineKeyboardButton("Amharic 🇪🇹", callback_data=f'reg_lang_am_{grade_section}_{student_no}')
+    )
+    return markup
+
+def build_welcome_markup(lang):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(MESSAGES[lang]['check_my_results'], callback_data='results'))
+    markup.add(types.InlineKeyboardButton(MESSAGES[lang]['view_top3'], callback_data='top3'))
+    return markup
+
+def build_grade_section_markup(is_top3, lang):
     markup = types.InlineKeyboardMarkup(row_width=4)
-    sections = ['1A', '1B', '1C', '2A', '2B', '2C', '3A', '3B', '4A', '4B', '5A', '5B', '6A', '6B']
+    sections = section_catalog.sections
     for i in range(0, len(sections), 4):
         row = sections[i:i + 4]
         buttons = [types.InlineKeyboardButton(f"✅ {sec}", callback_data=f'grade_{"top3" if is_top3 else ""}{sec}') for sec in row]
@@ -492,25 +1817,110 @@ def get_grade_section_markup(is_top3=False, lang='en'):
         markup.row(*buttons[:4])
     return markup
 
-def get_semester_markup(grade_section, is_top3=False, lang='en'):
+def build_semester_markup(grade_section, is_top3, lang):
     markup = types.InlineKeyboardMarkup(row_width=4)
+    prefix = "semester_" if not is_top3 else "top3_"
     markup.add(
-        types.InlineKeyboardButton("✅ S1", callback_data=f'{"semester_" if not is_top3 else "top3_"}{grade_section}_S1'),
-        types.InlineKeyboardButton("✅ S2", callback_data=f'{"semester_" if not is_top3 else "top3_"}{grade_section}_S2'),
-        types.InlineKeyboardButton("✅ Ave", callback_data=f'{"semester_" if not is_top3 else "top3_"}{grade_section}_Ave'),
-        types.InlineKeyboardButton(MESSAGES[lang]['back_button'], callback_data=f'{"semester_" if not is_top3 else "top3_"}{grade_section}_back')
+        *[types.InlineKeyboardButton(f"✅ {semester}", callback_data=f'{prefix}{grade_section}_{semester}')
+          for semester in section_catalog.semesters_of(grade_section)],
+        types.InlineKeyboardButton(MESSAGES[lang]['back_button'], callback_data=f'{prefix}{grade_section}_back')
     )
+    markup.row(types.InlineKeyboardButton(MESSAGES[lang]['class_stats_button'], callback_data=f'stats_{grade_section}'))
+    grade = split_grade_section(grade_section)[0]
+    if is_top3 and grade in section_catalog.grades:
+        markup.row(
+            types.InlineKeyboardButton(MESSAGES[lang]['grade_top_button'].format(grade=grade, n=RANKING_TOP_N), callback_data=f'rank_{grade}'),
+            types.InlineKeyboardButton(MESSAGES[lang]['school_top_button'].format(n=RANKING_TOP_N), callback_data='rank_school')
+        )
     return markup
 
-def prompt_grade_section(message, is_top3=False):
-    user_id = str(message.from_user.id)
-    lang = get_user_language(user_id)
-    bot.reply_to(message,
+def build_ranking_markup(scope, lang):
+    markup = types.InlineKeyboardMarkup(row_width=4)
+    markup.add(*[types.InlineKeyboardButton(f"✅ {semester}", callback_data=f'rank_{scope}_{semester}') for semester in section_catalog.semesters],
+               types.InlineKeyboardButton(MESSAGES[lang]['back_button'], callback_data=f'rank_{scope}_back'))
+    return markup
+
+def build_stats_markup(grade_section, lang):
+    markup = types.InlineKeyboardMarkup(row_width=4)
+    markup.add(*[types.InlineKeyboardButton(f"✅ {semester}", callback_data=f'stats_{grade_section}_{semester}')
+                 for semester in section_catalog.semesters_of(grade_section)],
+               types.InlineKeyboardButton(MESSAGES[lang]['back_button'], callback_data=f'stats_{grade_section}_back'))
+    return markup
+
+# The menus are the same for every user of a language, so they are built and
+# serialised once at startup, and again whenever the section catalog changes;
+# telebot sends a JSON string reply_markup as is.
+
+def build_static_keyboards():
+    keyboards = {}
+    for lang in MESSAGES:
+        keyboards[('welcome', lang)] = build_welcome_markup(lang).to_json()
+        for is_top3 in (False, True):
+            keyboards[('grade', is_top3, lang)] = build_grade_section_markup(is_top3, lang).to_json()
+            for grade_section in section_catalog.sections:
+                keyboards[('semester', grade_section, is_top3, lang)] = build_semester_markup(grade_section, is_top3, lang).to_json()
+        for grade_section in section_catalog.sections:
+            keyboards[('stats', grade_section, lang)] = build_stats_markup(grade_section, lang).to_json()
+        for scope in ranking_scopes():
+            keyboards[('ranking', scope, lang)] = build_ranking_markup(scope, lang).to_json()
+    return keyboards
+
+STATIC_KEYBOARDS = build_static_keyboards()
+
+def refresh_section_catalog():
+    global STATIC_KEYBOARDS
+    if section_catalog.refresh():
+        STATIC_KEYBOARDS = build_static_keyboards()
+
+def get_welcome_markup(lang='en'):
+    return STATIC_KEYBOARDS[('welcome', lang)]
+
+def get_grade_section_markup(is_top3=False, lang='en'):
+    return STATIC_KEYBOARDS[('grade', is_top3, lang)]
+
+def get_semester_markup(grade_section, is_top3=False, lang='en'):
+    markup = STATIC_KEYBOARDS.get(('semester', grade_section, is_top3, lang))
+    # Sections outside the menu come from hand-typed callback data; don't cache them
+    return markup if markup is not None else build_semester_markup(grade_section, is_top3, lang)
+
+def get_ranking_markup(scope, lang='en'):
+    markup = STATIC_KEYBOARDS.get(('ranking', scope, lang))
+    return markup if markup is not None else build_ranking_markup(scope, lang)
+
+def get_stats_markup(grade_section, lang='en'):
+    markup = STATIC_KEYBOARDS.get(('stats', grade_section, lang))
+    return markup if markup is not None else build_stats_markup(grade_section, lang)
+
+def ranking_scope_title(scope, lang):
+    return MESSAGES[lang]['scope_school'] if scope == 'school' else MESSAGES[lang]['scope_grade'].format(grade=scope)
+
+def parse_ranking_callback(data):
+    # 'rank_<scope>[_<semester>|_back]' -> (scope, semester or 'back' or None), or None if invalid
+    scope, _, semester = data[len('rank_'):].partition('_')
+    if scope not in ranking_scopes() or semester not in section_catalog.semesters + ('back', ''):
+        return None
+    return scope, semester or None
+
+def parse_stats_callback(data):
+    # 'stats_<grade_section>[_<semester>|_back]' -> (grade_section, semester or 'back' or None), or None if invalid
+    grade_section, _, semester = data[len('stats_'):].partition('_')
+    if not section_catalog.has_section(grade_section) or semester not in section_catalog.semesters_of(grade_section) + ('back', ''):
+        return None
+    return grade_section, semester or None
+
+def grade_section_prompt(is_top3, lang):
+    return Reply('reply',
         MESSAGES[lang]['select_grade_section'] if not is_top3 else MESSAGES[lang]['select_top3_section'],
-        reply_markup=get_grade_section_markup(is_top3, lang),
-        parse_mode="Markdown"
+        get_grade_section_markup(is_top3, lang)
     )
 
+def selection_reply(grade_section, markup, lang):
+    return Reply('edit', selection_confirmed_text(grade_section, lang), markup)
+
+def selection_confirmed_text(grade_section, lang):
+    grade, section = split_grade_section(grade_section)
+    return MESSAGES[lang]['selection_confirmed'].format(grade=grade, section=section)
+
 def prompt_semester(grade_section, lang='en'):
     return get_semester_markup(grade_section, is_top3=False, lang=lang)
 
@@ -518,223 +1928,372 @@ def prompt_top3_semester(grade_section, lang='en'):
     return get_semester_markup(grade_section, is_top3=True, lang=lang)
 
 # === Handle Inline Keyboard Callbacks ===
-@bot.callback_query_handler(func=lambda call: True)
-def callback_handler(call):
-    global PROCESSED_CALLBACKS
-    if call.id in PROCESSED_CALLBACKS:
-        bot.answer_callback_query(call.id, "Request already processed.")
-        return
-    PROCESSED_CALLBACKS.add(call.id)
+def callback_replies(call):
+    if not PROCESSED_CALLBACKS.add(call.id):
+        return [Reply('answer', "Request already processed.")]
 
     user_id = str(call.from_user.id)
-    lang = get_user_language(user_id)
-    user_mapping = load_user_mapping()
+    user = user_store.get_user(user_id)
+    lang = user['language'] if user else 'en'
+    if user and not user['grade_section']:
+        user = None  # language preference only, not registered
+    answer = Reply('answer')
 
     if call.data == 'results':
-        bot.answer_callback_query(call.id)
-        if user_id not in user_mapping:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=MESSAGES[lang]['not_logged_in'],
-                parse_mode="Markdown"
-            )
-            return
-        grade_section = user_mapping[user_id]['grade_section']
-        bot.edit_message_text(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            text=MESSAGES[lang]['selection_confirmed'].format(grade=grade_section[0], section=grade_section[1]),
-            reply_markup=prompt_semester(grade_section, lang),
-            parse_mode="Markdown"
-        )
-    elif call.data == 'top3':
-        bot.answer_callback_query(call.id)
-        prompt_grade_section(call.message, is_top3=True)
-    elif call.data.startswith('grade_'):
-        bot.answer_callback_query(call.id)
+        if user is None:
+            return [answer, Reply('edit', MESSAGES[lang]['not_logged_in'])]
+        grade_section = user['grade_section']
+        return [answer, selection_reply(grade_section, prompt_semester(grade_section, lang), lang)]
+    if call.data == 'top3':
+        return [answer, grade_section_prompt(True, lang)]
+    if call.data.startswith('grade_'):
         grade_section = call.data.replace('grade_', '').replace('top3', '')
         if call.data.endswith('_back'):
-            prompt_grade_section(call.message, is_top3=call.data.startswith('grade_top3'))
-        else:
-            next_step = prompt_semester if not call.data.startswith('grade_top3') else prompt_top3_semester
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=MESSAGES[lang]['selection_confirmed'].format(grade=grade_section[0], section=grade_section[1]),
-                reply_markup=next_step(grade_section, lang),
-                parse_mode="Markdown"
-            )
-    elif call.data.startswith(('semester_', 'top3_')) and not call.data.endswith('_back'):
-        bot.answer_callback_query(call.id)
+            return [answer, grade_section_prompt(call.data.startswith('grade_top3'), lang)]
+        next_step = prompt_semester if not call.data.startswith('grade_top3') else prompt_top3_semester
+        return [answer, selection_reply(grade_section, next_step(grade_section, lang), lang)]
+    if call.data.startswith(('semester_', 'top3_')) and not call.data.endswith('_back'):
         if call.data.startswith('semester_'):
             grade_section, semester = call.data.replace('semester_', '').split('_')
-            if user_id not in user_mapping or user_mapping[user_id]['grade_section'] != grade_section:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=MESSAGES[lang]['unauthorized_results'],
-                    parse_mode="Markdown"
-                )
-                return
-            student_no = user_mapping[user_id]['student_no']
-            process_results(call.message, grade_section, semester, student_no, user_id, call.from_user.username, lang)
-        else:
-            section, semester = call.data.replace('top3_', '').split('_')
-            process_top3(call.message, section, semester, lang)
-    elif call.data.endswith('_back'):
-        bot.answer_callback_query(call.id)
+            if user is None or user['grade_section'] != grade_section:
+                return [Reply('in_place', MESSAGES[lang]['unauthorized_results'])]
+            return process_results(grade_section, semester, user['student_no'], user_id, call.from_user.username, lang)
+        section, semester = call.data.replace('top3_', '').split('_')
+        return process_top3(section, semester, lang)
+    if call.data.startswith('rank_'):
+        parsed = parse_ranking_callback(call.data)
+        if parsed is None:
+            return [answer]
+        scope, semester = parsed
+        if semester not in (None, 'back'):
+            return process_ranking(scope, semester, user, lang)
+        if semester is None:
+            return [answer, Reply('edit', MESSAGES[lang]['select_ranking_semester'].format(scope=ranking_scope_title(scope, lang)),
+                                  get_ranking_markup(scope, lang))]
+        return [answer, grade_section_prompt(True, lang)]
+    if call.data.startswith('stats_'):
+        parsed = parse_stats_callback(call.data)
+        if parsed is None:
+            return [answer]
+        grade_section, semester = parsed
+        if semester not in (None, 'back'):
+            return process_stats(grade_section, semester, user, lang)
+        if semester is None:
+            return [answer, Reply('edit', MESSAGES[lang]['select_stats_semester'].format(section=grade_section),
+                                  get_stats_markup(grade_section, lang))]
+        # Back to the viewer's own results menu, or to the top-3 menu of another section
+        own = user is not None and user['grade_section'] == grade_section
+        markup = prompt_semester(grade_section, lang) if own else prompt_top3_semester(grade_section, lang)
+        return [answer, selection_reply(grade_section, markup, lang)]
+    if call.data.endswith('_back'):
         if call.data.startswith('semester_'):
             grade_section = call.data.replace('semester__back', '').split('_')[0]
-            if user_id not in user_mapping or user_mapping[user_id]['grade_section'] != grade_section:
-                bot.edit_message_text(
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    text=MESSAGES[lang]['unauthorized_results'],
-                    parse_mode="Markdown"
-                )
-                return
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=MESSAGES[lang]['selection_confirmed'].format(grade=grade_section[0], section=grade_section[1]),
-                reply_markup=prompt_semester(grade_section, lang),
-                parse_mode="Markdown"
-            )
-        elif call.data.startswith('top3_'):
-            prompt_grade_section(call.message, is_top3=True)
+            if user is None or user['grade_section'] != grade_section:
+                return [answer, Reply('edit', MESSAGES[lang]['unauthorized_results'])]
+            return [answer, selection_reply(grade_section, prompt_semester(grade_section, lang), lang)]
+        if call.data.startswith('top3_'):
+            return [answer, grade_section_prompt(True, lang)]
+        return [answer]
+    return []
 
-# === Process Results ===
-def process_results(message, grade_section, semester, student_no, user_id, username, lang):
-    loading_msg = bot.reply_to(message, "⏳ Processing...")
-    try:
-        grade = int(grade_section[0])
-        section = grade_section[1]
-        valid_sections = ['A', 'B', 'C'] if grade in [1, 2] else ['A', 'B']
-        if section not in valid_sections:
-            bot.reply_to(message, MESSAGES[lang]['invalid_section'].format(sections=', '.join(valid_sections)), parse_mode="Markdown")
-            bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-            return
-
-        file_path = f"{BASE_PATH}{grade_section}.xlsx"
-        wb = load_workbook(file_path, data_only=True)
-        ws = wb[semester]
-
-        if not validate_excel_structure(ws, semester):
-            bot.reply_to(message, MESSAGES[lang]['invalid_excel'].format(grade_section=grade_section, semester=semester), parse_mode="Markdown")
-            bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-            return
+@bot.callback_query_handler(func=lambda call: True)
+@releases_admission
+def callback_handler(call):
+    send_replies(call, callback_replies(call))
 
-        name_index = 3 if semester in ['S1', 'S2'] else 2
-        max_col = 18 if semester in ['S1', 'S2'] else 17
+# === Result Rendering ===
+def render_result_text(row, semester, lang):
+    name_index = 3 if is_term_sheet(semester) else 2
+    subjects = SUBJECT_NAMES
 
-        subjects = {
-            'en': ["Amharic", "English", "Arabic", "Maths", "E.S", "Moral Edu", "Art", "HPE"],
-            'am': ["አማርኛ", "እንግሊዝኛ", "አረብኛ", "ሒሳብ", "ኢ.ኤስ", "ሥነ ምግባር ትምህርት", "ሥነ ጥበብ", "ኤች.ፒ.ኢ"]
-        }
+    return (
+        f"{MESSAGES[lang]['result_header'].format(semester=semester)}\n"
+        f"--------------------------------\n"
+        f"👤 *{'Student No' if lang == 'en' else 'የተማሪ ቁጥር'}:* {get_value(row[1])}\n"
+        f"👤 *{'Name' if lang == 'en' else 'ስም'}:* {get_value(row[name_index])}\n"
+        f"🔢 *{'Sex' if lang == 'en' else 'ፆታ'}:* {get_value(row[name_index + 1])}\n"
+        f"🎂 *{'Age' if lang == 'en' else 'ዕድሜ'}:* {get_value(row[name_index + 2])}\n"
+        f"📚 *{'Subjects' if lang == 'en' else 'ትምህርቶች'}:*\n"
+        f" - {subjects[lang][0]}: {get_value(row[name_index + 3])}\n"
+        f" - {subjects[lang][1]}: {get_value(row[name_index + 4])}\n"
+        f" - {subjects[lang][2]}: {get_value(row[name_index + 5])}\n"
+        f" - {subjects[lang][3]}: {get_value(row[name_index + 6])}\n"
+        f" - {subjects[lang][4]}: {get_value(row[name_index + 7])}\n"
+        f" - {subjects[lang][5]}: {get_value(row[name_index + 8])}\n"
+        f" - {subjects[lang][6]}: {get_value(row[name_index + 9])}\n"
+        f" - {subjects[lang][7]}: {get_value(row[name_index + 10])}\n"
+        f"💡 *{'Conduct' if lang == 'en' else 'ባህሪ'}:* {get_value(row[14]) if is_term_sheet(semester) else 'N/A'}\n"
+        f"🧮 *{'Sum' if lang == 'en' else 'ድምር'}:* {get_value(row[15]) if is_term_sheet(semester) else get_value(row[13])}\n"
+        f"📊 *{'Average' if lang == 'en' else 'አማካይ'}:* {get_value(row[16]) if is_term_sheet(semester) else get_value(row[14])}\n"
+        f"🏅 *{'Rank' if lang == 'en' else 'ደረጃ'}:* {get_value(row[17]) if is_term_sheet(semester) else get_value(row[15])}\n"
+        f"📝 *{'Remark' if lang == 'en' else 'አስተያየት'}:* {get_value(row[16]) if semester == SUMMARY_SHEET else 'N/A'}\n"
+        f"--------------------------------\n"
+        f"{MESSAGES[lang]['results_displayed']}"
+    )
 
-        for row in ws.iter_rows(min_row=DATA_START_ROW, max_row=DATA_END_ROW, max_col=max_col):
-            row_no = str(get_value(row[1])).strip()
-            if row_no == student_no:
-                result_text = (
-                    f"{MESSAGES[lang]['result_header'].format(semester=semester)}\n"
-                    f"--------------------------------\n"
-                    f"👤 *{'Student No' if lang == 'en' else 'የተማሪ ቁጥር'}:* {get_value(row[1])}\n"
-                    f"👤 *{'Name' if lang == 'en' else 'ስም'}:* {get_value(row[name_index])}\n"
-                    f"🔢 *{'Sex' if lang == 'en' else 'ፆታ'}:* {get_value(row[name_index + 1])}\n"
-                    f"🎂 *{'Age' if lang == 'en' else 'ዕድሜ'}:* {get_value(row[name_index + 2])}\n"
-                    f"📚 *{'Subjects' if lang == 'en' else 'ትምህርቶች'}:*\n"
-                    f" - {subjects[lang][0]}: {get_value(row[name_index + 3])}\n"
-                    f" - {subjects[lang][1]}: {get_value(row[name_index + 4])}\n"
-                    f" - {subjects[lang][2]}: {get_value(row[name_index + 5])}\n"
-                    f" - {subjects[lang][3]}: {get_value(row[name_index + 6])}\n"
-                    f" - {subjects[lang][4]}: {get_value(row[name_index + 7])}\n"
-                    f" - {subjects[lang][5]}: {get_value(row[name_index + 8])}\n"
-                    f" - {subjects[lang][6]}: {get_value(row[name_index + 9])}\n"
-                    f" - {subjects[lang][7]}: {get_value(row[name_index + 10])}\n"
-                    f"💡 *{'Conduct' if lang == 'en' else 'ባህሪ'}:* {get_value(row[14]) if semester in ['S1', 'S2'] else 'N/A'}\n"
-                    f"🧮 *{'Sum' if lang == 'en' else 'ድምር'}:* {get_value(row[15]) if semester in ['S1', 'S2'] else get_value(row[13])}\n"
-                    f"📊 *{'Average' if lang == 'en' else 'አማካይ'}:* {get_value(row[16]) if semester in ['S1', 'S2'] else get_value(row[14])}\n"
-                    f"🏅 *{'Rank' if lang == 'en' else 'ደረጃ'}:* {get_value(row[17]) if semester in ['S1', 'S2'] else get_value(row[15])}\n"
-                    f"📝 *{'Remark' if lang == 'en' else 'አስተያየት'}:* {get_value(row[16]) if semester == 'Ave' else 'N/A'}\n"
-                    f"--------------------------------\n"
-                    f"{MESSAGES[lang]['results_displayed']}"
-                )
-                bot.reply_to(message, result_text, parse_mode="Markdown")
-                notify_admin_on_result_view(user_id, username, grade_section, semester, student_no, result_text)
-                time.sleep(1)
-                bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-                return
+def top3_students(section, semester):
+    return [{'no': no, 'name': name, 'average': -key} for key, _, _, no, name in ranking_index.ranking(section, semester).top(3)]
+
+def rendered_result(ws, grade_section, semester, student_no, lang):
+    # Result text for student_no, or None if the sheet has no such student
+    def render():
+        row = ws.find_student(student_no)
+        return render_result_text(row, semester, lang) if row is not None else None
+    return render_cache.get_or_render(('result', grade_section, semester, student_no, lang), ws.stamp, render)
+
+def rendered_top3(ws, section, semester, lang):
+    # Top-3 text for the sheet, or None if no student has a numeric average
+    def render():
+        top3 = top3_students(section, semester)
+        return render_top3_text(section, semester, top3, lang) if top3 else None
+    return render_cache.get_or_render(('top3', section, semester, None, lang), ws.stamp, render)
+
+def render_top3_text(section, semester, top3, lang):
+    return f"{MESSAGES[lang]['top3_header'].format(section=section, semester=semester)}\n" + "\n".join([
+        f"--------------------------------\n"
+        f"{i+1}. 👤 *{'Name' if lang == 'en' else 'ስም'}:* {s['name']} ({'No' if lang == 'en' else 'ቁጥር'}: {s['no']}, 📊 *{'Avg' if lang == 'en' else 'አማካይ'}:* {s['average']:.1f})"
+        for i, s in enumerate(top3)
+    ]) + f"\n--------------------------------\n{MESSAGES[lang]['results_displayed']}"
 
-        bot.reply_to(message, MESSAGES[lang]['student_not_found'].format(
-            student_no=student_no,
-            grade_section=grade_section,
-            semester=semester
-        ), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+def render_ranking_text(scope, semester, entries, lang):
+    # Header and list only; the viewer's own rank and the footer are added per user
+    return f"{MESSAGES[lang]['ranking_header'].format(n=len(entries), scope=ranking_scope_title(scope, lang), semester=semester)}\n" + "\n".join([
+        f"--------------------------------\n"
+        f"{i+1}. 👤 *{'Name' if lang == 'en' else 'ስም'}:* {name} ({grade_section}, {'No' if lang == 'en' else 'ቁጥር'}: {no}, 📊 *{'Avg' if lang == 'en' else 'አማካይ'}:* {-key:.1f})"
+        for i, (key, grade_section, _, no, name) in enumerate(entries)
+    ])
+
+def ranking_text(scope, semester, user, lang):
+    # Top-N text for a grade or the school, with the viewer's rank when they are
+    # part of it; None if nobody in scope has a numeric average
+    ranking = ranking_index.ranking(scope, semester)
+    if not ranking.entries:
+        return None
+    text = render_cache.get_or_render(('rank', scope, semester, None, lang), ranking.version,
+                                      lambda: render_ranking_text(scope, semester, ranking.top(RANKING_TOP_N), lang))
+    position = ranking.position(user['grade_section'], user['student_no']) if user else None
+    if position:
+        rank, total, percentile = position
+        text += f"\n--------------------------------\n" + MESSAGES[lang]['your_rank'].format(rank=rank, total=total, percentile=percentile)
+    return text + f"\n--------------------------------\n{MESSAGES[lang]['results_displayed']}"
+
+def stats_bin_labels():
+    edges = list(STATS_BINS)
+    return [f"<{edges[0]}"] + [f"{low}-{high - 1}" for low, high in zip(edges, edges[1:])] + [f"{edges[-1]}+"]
+
+def render_class_stats_text(section, semester, stats, lang):
+    overall = stats.summaries[STATS_AVERAGE]
+    lines = [
+        MESSAGES[lang]['stats_header'].format(section=section, semester=semester),
+        "--------------------------------",
+        f"👥 *{'Students' if lang == 'en' else 'ተማሪዎች'}:* {overall['count']}",
+        f"📊 *{'Average' if lang == 'en' else 'አማካይ'}:* {overall['mean']:.1f} "
+        f"({'median' if lang == 'en' else 'መካከለኛ'} {overall['median']:.1f}, {overall['min']:.4g}-{overall['max']:.4g})",
+        f"✅ *{'Pass rate' if lang == 'en' else 'የማለፍ መጠን'}:* {overall['passed'] / overall['count']:.0%} "
+        f"({overall['passed']}/{overall['count']}, {'pass mark' if lang == 'en' else 'የማለፊያ ነጥብ'} {PASS_MARK:g})",
+        f"📚 *{'Subjects' if lang == 'en' else 'ትምህርቶች'}* ({'average, range, pass rate' if lang == 'en' else 'አማካይ፣ ክልል፣ የማለፍ መጠን'}):"
+    ]
+    for column, subject in enumerate(SUBJECT_NAMES[lang]):
+        summary = stats.summaries[column]
+        if summary is None:
+            lines.append(f" - {subject}: N/A")
+            continue
+        lines.append(f" - {subject}: {summary['mean']:.1f}, {summary['min']:.4g}-{summary['max']:.4g}, {summary['passed'] / summary['count']:.0%}")
+    peak = max(overall['histogram'])
+    lines.append(f"📈 *{'Averages' if lang == 'en' else 'የአማካይ ስርጭት'}:*")
+    lines.append("```")
+    lines.extend(f"{label:>6} {'█' * round(20 * n / peak)} {n}" for label, n in zip(stats_bin_labels(), overall['histogram']))
+    lines.append("```")
+    return "\n".join(lines)
+
+def class_standing_text(stats, student_no, lang):
+    lines = []
+    names = SUBJECT_NAMES[lang] + ['Average' if lang == 'en' else 'አማካይ']
+    for column, name in zip(list(range(STATS_SUM)) + [STATS_AVERAGE], names):
+        standing = stats.standing(student_no, column)
+        if standing is not None:
+            score, rank, count = standing
+            lines.append(f" - {name}: {score:.4g}, {rank}/{count}, {score - stats.summaries[column]['mean']:+.1f}")
+    return MESSAGES[lang]['your_standing'] + "\n" + "\n".join(lines) if lines else None
+
+def class_stats_text(grade_section, semester, ws, user, lang):
+    # Class statistics for the sheet, with the viewer's standing when it is
+    # their own section; None if nobody has a numeric average
+    stats = class_stats_index.sheet_stats(grade_section, semester, ws)
+    if stats.summaries[STATS_AVERAGE] is None:
+        return None
+    text = render_cache.get_or_render(('stats', grade_section, semester, None, lang), stats.version,
+                                      lambda: render_class_stats_text(grade_section, semester, stats, lang))
+    if user and user['grade_section'] == grade_section:
+        standing = class_standing_text(stats, user['student_no'], lang)
+        if standing:
+            text += f"\n--------------------------------\n{standing}"
+    return text + f"\n--------------------------------\n{MESSAGES[lang]['results_displayed']}"
+
+# === Response Pipeline ===
+# A lookup started from an inline button is answered by editing the tapped
+# message into the result, with its navigation keyboard attached, so the next
+# semester is one tap away. The callback query is answered right after the
+# edit: until then Telegram spins the tapped button itself, which replaces
+# the old "⏳ Processing..." reply and its delayed delete. Every error is the
+# same single edit with the error text.
+
+def respond_in_place(call, text, markup=None):
+    try:
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text,
+            reply_markup=markup,
+            parse_mode="Markdown"
+        )
+    except telebot.apihelper.ApiTelegramException as e:
+        # Tapping the semester already shown changes nothing
+        if 'message is not modified' not in e.description:
+            logging.warning(f"Editing message {call.message.message_id} in {call.message.chat.id} failed, sending instead: {str(e)}")
+            bot.send_message(call.message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
+    finally:
+        bot.answer_callback_query(call.id)
 
+# === Process Results ===
+def catalog_error_text(grade_section, semester, lang):
+    # Requests the catalog already rules out are answered without opening a file
+    if not section_catalog.has_section(grade_section):
+        return MESSAGES[lang]['invalid_section'].format(sections=', '.join(section_catalog.sections))
+    if not section_catalog.has_sheet(grade_section, semester):
+        return MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=grade_section)
+    return None
+
+def results_response(grade_section, semester, student_no, user_id, username, lang):
+    # The result text, or the one error message that replaces it
+    catalog_error = catalog_error_text(grade_section, semester, lang)
+    if catalog_error:
+        return catalog_error
+    try:
+        ws = load_sheet(grade_section, semester)
+        if not validate_excel_structure(ws, semester):
+            return MESSAGES[lang]['invalid_excel'].format(grade_section=grade_section, semester=semester)
+        result_text = rendered_result(ws, grade_section, semester, student_no, lang)
+        if result_text is None:
+            return MESSAGES[lang]['student_not_found'].format(
+                student_no=student_no,
+                grade_section=grade_section,
+                semester=semester
+            )
+        notify_admin_on_result_view(user_id, username, grade_section, semester, student_no, result_text)
+        return result_text
     except FileNotFoundError:
-        bot.reply_to(message, MESSAGES[lang]['file_not_found'].format(grade_section=grade_section), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['file_not_found'].format(grade_section=grade_section)
     except KeyError:
-        bot.reply_to(message, MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=grade_section), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=grade_section)
     except Exception as e:
         logging.exception("Unexpected error in /results")
-        bot.reply_to(message, MESSAGES[lang]['unexpected_error'].format(error=str(e)), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['unexpected_error'].format(error=str(e))
+
+@perf.timed('handler_seconds')
+def process_results(grade_section, semester, student_no, user_id, username, lang):
+    text = results_response(grade_section, semester, student_no, user_id, username, lang)
+    return [Reply('in_place', text, prompt_semester(grade_section, lang))]
 
 # === Process Top 3 ===
-def process_top3(message, section, semester, lang):
-    loading_msg = bot.reply_to(message, "⏳ Processing...")
+def top3_response(section, semester, lang):
+    catalog_error = catalog_error_text(section, semester, lang)
+    if catalog_error:
+        return catalog_error
     try:
-        grade = int(section[0])
-        sec_code = section[1]
-        valid_sections = ['A', 'B', 'C'] if grade in [1, 2] else ['A', 'B']
-        if sec_code not in valid_sections:
-            bot.reply_to(message, MESSAGES[lang]['invalid_section'].format(sections=', '.join(valid_sections)), parse_mode="Markdown")
-            bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-            return
-        file_path = f"{BASE_PATH}{section}.xlsx"
-        wb = load_workbook(file_path, data_only=True)
-        ws = wb[semester]
-
+        ws = load_sheet(section, semester)
         if not validate_excel_structure(ws, semester):
-            bot.reply_to(message, MESSAGES[lang]['invalid_excel'].format(grade_section=section, semester=semester), parse_mode="Markdown")
-            bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-            return
-
-        students = []
-        for row in ws.iter_rows(min_row=DATA_START_ROW, max_row=DATA_END_ROW, max_col=18):
-            no, name, avg = row[1].value, row[3].value, row[16].value
-            if no and avg and is_number(avg):
-                students.append({'no': no, 'name': name, 'average': float(avg)})
-        if not students:
-            bot.reply_to(message, MESSAGES[lang]['no_averages'].format(section=section, semester=semester), parse_mode="Markdown")
-            bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
-            return
-        top3 = sorted(students, key=lambda x: x['average'], reverse=True)[:3]
-        response = f"{MESSAGES[lang]['top3_header'].format(section=section, semester=semester)}\n" + "\n".join([
-            f"--------------------------------\n"
-            f"{i+1}. 👤 *{'Name' if lang == 'en' else 'ስም'}:* {s['name']} ({'No' if lang == 'en' else 'ቁጥር'}: {s['no']}, 📊 *{'Avg' if lang == 'en' else 'አማካይ'}:* {s['average']:.1f})"
-            for i, s in enumerate(top3)
-        ]) + f"\n--------------------------------\n{MESSAGES[lang]['results_displayed']}"
-        bot.reply_to(message, response, parse_mode="Markdown")
-        time.sleep(1)
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+            return MESSAGES[lang]['invalid_excel'].format(grade_section=section, semester=semester)
+        response = rendered_top3(ws, section, semester, lang)
+        if response is None:
+            return MESSAGES[lang]['no_averages'].format(section=section, semester=semester)
+        return response
     except FileNotFoundError:
-        bot.reply_to(message, MESSAGES[lang]['file_not_found'].format(grade_section=section), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['file_not_found'].format(grade_section=section)
     except KeyError:
-        bot.reply_to(message, MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=section), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=section)
     except Exception as e:
         logging.exception("Error in /top3")
-        bot.reply_to(message, MESSAGES[lang]['unexpected_error'].format(error=str(e)), parse_mode="Markdown")
-        bot.delete_message(chat_id=loading_msg.chat.id, message_id=loading_msg.message_id)
+        return MESSAGES[lang]['unexpected_error'].format(error=str(e))
+
+@perf.timed('handler_seconds')
+def process_top3(section, semester, lang):
+    return [Reply('in_place', top3_response(section, semester, lang), prompt_top3_semester(section, lang))]
+
+# === Process Grade and School Rankings ===
+def ranking_response(scope, semester, user, lang):
+    try:
+        response = ranking_text(scope, semester, user, lang)
+        if response is None:
+            return MESSAGES[lang]['no_averages'].format(section=ranking_scope_title(scope, lang), semester=semester)
+        return response
+    except Exception as e:
+        logging.exception("Error in ranking")
+        return MESSAGES[lang]['unexpected_error'].format(error=str(e))
+
+@perf.timed('handler_seconds')
+def process_ranking(scope, semester, user, lang):
+    return [Reply('in_place', ranking_response(scope, semester, user, lang), get_ranking_markup(scope, lang))]
+
+# === Process Class Statistics ===
+def stats_response(grade_section, semester, user, lang):
+    catalog_error = catalog_error_text(grade_section, semester, lang)
+    if catalog_error:
+        return catalog_error
+    try:
+        ws = load_sheet(grade_section, semester)
+        if not validate_excel_structure(ws, semester):
+            return MESSAGES[lang]['invalid_excel'].format(grade_section=grade_section, semester=semester)
+        response = class_stats_text(grade_section, semester, ws, user, lang)
+        if response is None:
+            return MESSAGES[lang]['no_averages'].format(section=grade_section, semester=semester)
+        return response
+    except FileNotFoundError:
+        return MESSAGES[lang]['file_not_found'].format(grade_section=grade_section)
+    except KeyError:
+        return MESSAGES[lang]['sheet_not_found'].format(semester=semester, grade_section=grade_section)
+    except Exception as e:
+        logging.exception("Error in class statistics")
+        return MESSAGES[lang]['unexpected_error'].format(error=str(e))
+
+@perf.timed('handler_seconds')
+def process_stats(grade_section, semester, user, lang):
+    return [Reply('in_place', stats_response(grade_section, semester, user, lang), get_stats_markup(grade_section, lang))]
 
 # === Run Bot ===
+perf.instrument_handlers(bot)
+
+def owns_chat(chat_id):
+    # Same routing as workers.shard_of
+    return int(chat_id) % SHARD_COUNT == SHARD_INDEX
+
+def startup():
+    scheduler.start()
+    if METRICS_PORT:
+        metrics.MetricsServer(METRICS_HOST, METRICS_PORT + SHARD_INDEX, perf).start()
+    if BOT_SHARD:
+        # The supervisor has compiled the snapshot and keeps it fresh; sheets
+        # are decoded from it on first use. The broadcast job lives in the
+        # worker that receives the admin's /broadcast commands.
+        if ADMIN_ID and owns_chat(ADMIN_ID):
+            ensure_broadcast_baseline()
+            resume_broadcast()
+        schedule_catalog_refresh()
+        return
+    notify_admin_on_restart()
+    prewarm_gradebooks()
+    ensure_broadcast_baseline()
+    resume_broadcast()
+    schedule_reingest()
+
 if __name__ == '__main__':
     logging.info("📡 Bot is running...")
-    notify_admin_on_restart()
-    bot.polling()
\ No newline at end of file
+    startup()
+    if UPDATE_MODE == 'webhook':
+        from webhook import WebhookServer, register_webhook
+        server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                               lambda update: bot.process_new_updates([update]))
+        register_webhook(bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET)
+        server.serve_forever()
+    else:
+        bot.polling()
\ No newline at end of file
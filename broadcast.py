@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from user_store import write_json_atomic
+
+# === Results Broadcast ===
+# Pushes updated results to registered students after new workbooks are
+# published, instead of every student polling the bot at once.
+# - Row fingerprints of the last broadcast data version are kept on disk; a
+#   diff against the live gradebook finds the students whose rows changed.
+# - A job's recipient plan is written once. Its progress file (next recipient,
+#   counts, failures) is rewritten after every recipient, so a restarted bot
+#   resumes where it stopped and re-sends at most the recipient in flight.
+# - The job thread paces itself at `rate` recipients/s on top of the outbound
+#   limiter, whose lowest-priority lane keeps student replies ahead of it.
+
+PROGRESS_MILESTONES = (0.25, 0.5, 0.75)
+
+def row_digest(row):
+    return hashlib.blake2b(repr(row).encode('utf-8'), digest_size=8).hexdigest()
+
+def fingerprint_rows(sheets):
+    # [(grade_section, semester, sheet), ...] -> {"<grade_section>/<semester>/<student_no>": digest}
+    fingerprints = {}
+    for grade_section, semester, sheet in sheets:
+        for student_no, offset in sheet.index.items():
+            if student_no and student_no != 'N/A':
+                fingerprints[f"{grade_section}/{semester}/{student_no}"] = row_digest(sheet.rows[offset])
+    return fingerprints
+
+def changed_students(old, new):
+    # {(grade_section, student_no): [semesters whose row is new or different]}
+    changed = {}
+    for key, digest in new.items():
+        if old.get(key) != digest:
+            grade_section, semester, student_no = key.split('/', 2)
+            changed.setdefault((grade_section, student_no), []).append(semester)
+    return changed
+
+def load_fingerprints(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['rows']
+
+def save_fingerprints(path, fingerprints):
+    write_json_atomic(path, {'saved': datetime.now().isoformat(timespec='seconds'), 'rows': fingerprints})
+
+class BroadcastJob:
+    def __init__(self, plan_path, progress_path, send, rate, on_progress=None):
+        self.plan_path = plan_path
+        self.progress_path = progress_path
+        self.send = send  # send(recipient); raises to mark the recipient failed
+        self.rate = rate
+        self.on_progress = on_progress  # on_progress(status) at milestones and on finish
+        self.recipients = []
+        self.progress = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancelled = threading.Event()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def create(self, recipients):
+        if self.running():
+            raise RuntimeError("A broadcast is already running")
+        with self._lock:
+            self.recipients = recipients
+            self.progress = {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'status': 'running',
+                'next': 0,
+                'sent': 0,
+                'failed': {},
+                'total': len(recipients)
+            }
+            write_json_atomic(self.plan_path, {'recipients': recipients})
+            self._checkpoint()
+
+    def load(self):
+        # Reads a saved job; returns True if it was interrupted mid-run
+        if not (os.path.exists(self.plan_path) and os.path.exists(self.progress_path)):
+            return False
+        try:
+            with open(self.plan_path, 'r', encoding='utf-8') as f:
+                recipients = json.load(f)['recipients']
+            with open(self.progress_path, 'r', encoding='utf-8') as f:
+                progress = json.load(f)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Ignoring unreadable broadcast state: {str(e)}")
+            return False
+        with self._lock:
+            self.recipients = recipients
+            self.progress = progress
+        return progress['status'] == 'running'
+
+    def start(self):
+        if self.running():
+            return
+        self._cancelled.clear()
+        self._thread = threading.Thread(target=self._run, name='results-broadcast', daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            if self.progress and self.progress['status'] == 'running' and not self.running():
+                self.progress['status'] = 'cancelled'
+                self._checkpoint()
+
+    def status(self):
+        with self._lock:
+            if self.progress is None:
+                return None
+            return dict(self.progress, failed=dict(self.progress['failed']))
+
+    def _checkpoint(self):
+        write_json_atomic(self.progress_path, self.progress)
+
+    def _run(self):
+        interval = 1.0 / self.rate if self.rate > 0 else 0
+        total = len(self.recipients)
+        milestones = [m for m in PROGRESS_MILESTONES if m * total > self.progress['next']]
+        logging.info(f"Broadcast started at recipient {self.progress['next']} of {total}")
+        while self.progress['next'] < total:
+            if self._cancelled.is_set():
+                with self._lock:
+                    self.progress['status'] = 'cancelled'
+                    self._checkpoint()
+                logging.info(f"Broadcast cancelled at recipient {self.progress['next']} of {total}")
+                self._report()
+                return
+            started = time.monotonic()
+            recipient = self.recipients[self.progress['next']]
+            try:
+                self.send(recipient)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e)}"[:200]
+                logging.warning(f"Broadcast to {recipient['telegram_id']} failed: {error}")
+            with self._lock:
+                if error:
+                    self.progress['failed'][recipient['telegram_id']] = error
+                else:
+                    self.progress['sent'] += 1
+                self.progress['next'] += 1
+                self._checkpoint()
+            if milestones and self.progress['next'] >= milestones[0] * total:
+                milestones.pop(0)
+                self._report()
+            self._cancelled.wait(max(0.0, interval - (time.monotonic() - started)))
+        with self._lock:
+            self.progress['status'] = 'done'
+            self._checkpoint()
+        logging.info(f"Broadcast finished: {self.progress['sent']} sent, {len(self.progress['failed'])} failed")
+        self._report()
+
+    def _report(self):
+        if self.on_progress:
+            try:
+                self.on_progress(self.status())
+            except Exception:
+                logging.exception("Broadcast progress report failed")
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import argparse
+
+from dotenv import load_dotenv
+
+import xlsx_reader
+import gradebook
+
+# === Compile Section Workbooks into a Gradebook Snapshot ===
+# Usage:
+#   python compile_data.py            # rebuild data/gradebook.snap from data/*.xlsx
+#   python compile_data.py --check    # exit 1 if the snapshot is missing or stale
+#
+# Only gradebook.py and xlsx_reader are loaded, never bot.py, so this is safe to
+# run from cron next to a live bot: no TeleBot, user store or log listeners.
+
+def compile_snapshot(output):
+    sheets = {}
+    sources = {}
+    for grade_section, path in gradebook.section_workbooks().items():
+        st = os.stat(path)
+        sources[grade_section] = {
+            'sha256': gradebook.file_sha256(path),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns
+        }
+        semesters = gradebook.result_sheets(xlsx_reader.sheet_names(path))
+        for semester, sheet in gradebook.read_sheets(path, semesters).items():
+            sheets[(grade_section, semester)] = sheet
+    return gradebook.write_snapshot(output, sheets, sources)
+
+def snapshot_problem(path):
+    # None if the snapshot matches data/*.xlsx, else a one-line reason
+    try:
+        snapshot = gradebook.GradebookSnapshot(path)
+    except FileNotFoundError:
+        return f"{path} does not exist"
+    except ValueError as e:
+        return str(e)
+    stale = snapshot.stale_sections()
+    missing = sorted(gs for gs in gradebook.section_workbooks() if gs not in snapshot.header['sources'])
+    snapshot.close()
+    if stale or missing:
+        return f"{path} is stale. Changed: {', '.join(stale) or '-'}; not compiled: {', '.join(missing) or '-'}"
+    return None
+
+def check_snapshot(path):
+    problem = snapshot_problem(path)
+    if problem:
+        print(problem)
+        return 1
+    snapshot = gradebook.GradebookSnapshot(path)
+    print(f"{path} is up to date ({snapshot.header['checksum'][:12]})")
+    snapshot.close()
+    return 0
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compile data/<section>.xlsx workbooks into a gradebook snapshot.")
+    parser.add_argument('--output', default=os.getenv('SNAPSHOT_FILE', gradebook.DEFAULT_SNAPSHOT_FILE), help="snapshot file to write (default: %(default)s)")
+    parser.add_argument('--check', action='store_true', help="only verify that the snapshot matches the workbooks")
+    args = parser.parse_args()
+
+    if args.check:
+        return check_snapshot(args.output)
+
+    started = time.perf_counter()
+    header = compile_snapshot(args.output)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Wrote {args.output}: {len(header['sources'])} workbooks, {len(header['sheets'])} sheets, "
+        f"{os.path.getsize(args.output)} bytes in {elapsed:.2f}s (checksum {header['checksum'][:12]})"
+    )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
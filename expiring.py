@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+
+# === Bounded Expiring State ===
+# Per-request memory that must not grow for the life of the process: the
+# callback dedupe set and pending registrations. Entries live for a fixed
+# `ttl`, so insertion order is expiry order; every insert drops expired entries
+# from the old end, and past `max_items` the oldest live ones go too. Nothing
+# is scheduled per entry, and reads treat an expired entry as absent.
+
+class ExpiringDict:
+    def __init__(self, ttl, max_items):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (expires, value)
+
+    def _prune(self, now):
+        while self._items:
+            key, (expires, _) = next(iter(self._items.items()))
+            if expires > now and len(self._items) <= self.max_items:
+                return
+            del self._items[key]
+            if expires > now:
+                self.evicted += 1
+            else:
+                self.expired += 1
+
+    def put(self, key, value):
+        now = time.monotonic()
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (now + self.ttl, value)
+            self._prune(now)
+
+    def add_new(self, key, value=True):
+        # Stores key unless it is already live; True if it was stored
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] > now:
+                return False
+            self._items.pop(key, None)
+            self._items[key] = (now + self.ttl, value)
+            self._prune(now)
+            return True
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._items.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._items.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return len(self._items)
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return {'entries': len(self._items), 'max_entries': self.max_items, 'ttl': self.ttl,
+                    'expired': self.expired, 'evicted': self.evicted}
+
+class ExpiringSet(ExpiringDict):
+    def add(self, key):
+        return self.add_new(key)
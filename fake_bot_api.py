@@ -0,0 +1,138 @@
+import json
+import time
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# === Local Fake Telegram Bot API ===
+# A stand-in for api.telegram.org used by the load tests: it accepts
+# /bot<token>/<method> calls, answers with minimal valid payloads after an
+# optional simulated latency, and records every call so a test can wait for
+# the responses it expects. Point the bot at it with TELEGRAM_API_URL.
+
+class FakeApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # async bursts open many connections at once
+
+class FakeBotApi:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.flood_responses = 0  # upcoming message calls to answer with 429
+        self.flood_retry_after = 1
+        self.calls = []
+        self.counts = Counter()
+        self._cond = threading.Condition()
+        self._message_ids = iter(range(1000, 10 ** 9))
+        self._server = FakeApiServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._cond:
+            self.calls.clear()
+            self.counts.clear()
+
+    def record(self, method, params):
+        with self._cond:
+            self.calls.append((time.perf_counter(), method, params))
+            self.counts[method] += 1
+            self._cond.notify_all()
+
+    def wait_for(self, predicate, timeout=60):
+        # Blocks until predicate(calls) is true; returns False on timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not predicate(self.calls):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def take_flood(self, method):
+        with self._cond:
+            if self.flood_responses and method in ('sendMessage', 'editMessageText', 'deleteMessage'):
+                self.flood_responses -= 1
+                self.counts['429'] += 1
+                return True
+        return False
+
+    def respond(self, method, params):
+        chat_id = params.get('chat_id', 0)
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, 'type': 'private'},
+            'text': params.get('text', '')
+        }
+        if method in ('sendMessage', 'editMessageText'):
+            return message
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getUpdates':
+            time.sleep(min(float(params.get('timeout', 0) or 0), 1.0))
+            return []
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.handle_call()
+
+            def do_GET(self):
+                self.handle_call()
+
+            def handle_call(self):
+                method = self.path.rsplit('/', 1)[-1].split('?', 1)[0]
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params = {}
+                if '?' in self.path:
+                    params.update({k: v[0] for k, v in parse_qs(self.path.split('?', 1)[1]).items()})
+                content_type = self.headers.get('Content-Type', '')
+                if body and 'json' in content_type:
+                    params.update(json.loads(body))
+                elif body and 'multipart' not in content_type:
+                    params.update({k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()})
+                if api.latency:
+                    time.sleep(api.latency)
+                if api.take_flood(method):
+                    status = 429
+                    payload = json.dumps({
+                        'ok': False, 'error_code': 429,
+                        'description': f"Too Many Requests: retry after {api.flood_retry_after}",
+                        'parameters': {'retry_after': api.flood_retry_after}
+                    }).encode('utf-8')
+                else:
+                    status = 200
+                    result = api.respond(method, params)
+                    api.record(method, params)
+                    payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
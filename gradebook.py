@@ -0,0 +1,188 @@
+import os
+import re
+import glob
+import json
+import mmap
+import zlib
+import struct
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+import xlsx_reader
+
+# === Gradebook Files ===
+# Where the section workbooks live, the row window the bot reads from each
+# result sheet, and the compiled snapshot of them. Shared by bot.py and the
+# offline compile_data.py, so this module imports nothing from bot.py:
+# compiling a snapshot never builds a TeleBot or opens the user store.
+BASE_PATH = 'data/'
+DATA_START_ROW = 5
+DATA_END_ROW = 64
+DATA_MAX_COL = 18
+DEFAULT_SNAPSHOT_FILE = 'data/gradebook.snap'
+
+SECTION_NAME = re.compile(r'^(\d+)([A-Za-z]+)$')
+TERM_SHEET = re.compile(r'^S(\d+)$')
+SUMMARY_SHEET = 'Ave'
+
+def split_grade_section(grade_section):
+    # '10C' -> ('10', 'C'); (None, None) if it is not a section name
+    match = SECTION_NAME.match(grade_section)
+    return match.groups() if match else (None, None)
+
+def is_term_sheet(semester):
+    return TERM_SHEET.match(semester) is not None
+
+def semester_order(semester):
+    # Terms by number, then the summary
+    match = TERM_SHEET.match(semester)
+    return (0, int(match.group(1))) if match else (1, 0)
+
+def result_sheets(names):
+    # A workbook's sheet names -> its result sheets, terms first
+    return tuple(sorted((n for n in names if is_term_sheet(n) or n == SUMMARY_SHEET), key=semester_order))
+
+def section_workbooks(base_path=BASE_PATH):
+    # grade_section -> workbook path, for every <grade><section>.xlsx
+    workbooks = {}
+    for path in sorted(glob.glob(f"{base_path}*.xlsx")):
+        grade_section = os.path.splitext(os.path.basename(path))[0]
+        if split_grade_section(grade_section)[0] is not None:
+            workbooks[grade_section] = path
+    return workbooks
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_sheets(file_path, semesters):
+    return xlsx_reader.read_sheets(file_path, semesters, DATA_START_ROW, DATA_END_ROW, DATA_MAX_COL)
+
+def row_index(rows):
+    # student_no -> offset of its first row
+    index = {}
+    for offset, row in enumerate(rows):
+        index.setdefault(str(row[1] if row[1] is not None else 'N/A').strip(), offset)
+    return index
+
+# === Gradebook Snapshot ===
+# compile_data.py writes every section's result rows into one file: a fixed
+# prefix, a JSON header (sources with checksums, per-sheet offsets and
+# student_no -> row offset index), then one zlib-compressed block per sheet
+# holding its columns as JSON lists. Cells must be JSON scalars (what
+# xlsx_reader returns); anything else fails the compile rather than being
+# stored as a string. The bot mmaps the file and decodes blocks on demand.
+SNAPSHOT_MAGIC = b'SELAMGB\0'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct('<8sHI')
+
+def write_snapshot(path, sheets, sources):
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'rows': [DATA_START_ROW, DATA_END_ROW],
+        'max_col': DATA_MAX_COL,
+        'sources': sources,
+        'checksum': hashlib.sha256(''.join(sources[s]['sha256'] for s in sorted(sources)).encode()).hexdigest(),
+        'sheets': {}
+    }
+    blocks = []
+    offset = 0
+    for (grade_section, semester), (title, max_column, rows) in sorted(sheets.items()):
+        columns = [list(column) for column in zip(*rows)]
+        try:
+            encoded = json.dumps(columns, ensure_ascii=False).encode('utf-8')
+        except TypeError as e:
+            raise ValueError(f"{grade_section}/{semester}: {str(e)}") from e
+        block = zlib.compress(encoded, 9)
+        header['sheets'][f"{grade_section}/{semester}"] = {
+            'title': title,
+            'max_column': max_column,
+            'offset': offset,
+            'length': len(block),
+            'index': row_index(rows)
+        }
+        blocks.append(block)
+        offset += len(block)
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+    return header
+
+class GradebookSnapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = SNAPSHOT_PREFIX.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a gradebook snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has snapshot version {version}, expected {SNAPSHOT_VERSION}")
+        self.header = json.loads(self._mm[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + header_len].decode('utf-8'))
+        if self.header['rows'] != [DATA_START_ROW, DATA_END_ROW] or self.header['max_col'] != DATA_MAX_COL:
+            raise ValueError(f"{path} was compiled for a different row/column layout")
+        self._body = SNAPSHOT_PREFIX.size + header_len
+        self._verified = {}
+        self._lock = threading.Lock()  # close() waits out reads in progress
+
+    def is_fresh(self, grade_section, stamp):
+        source = self.header['sources'].get(grade_section)
+        if source is None:
+            return False
+        if (source['mtime_ns'], source['size']) == stamp:
+            return True
+        verified = self._verified.get(grade_section)
+        if verified and verified[0] == stamp:
+            return verified[1]
+        # mtime moved (e.g. file copied) - fall back to comparing content checksums
+        fresh = source['size'] == stamp[1] and file_sha256(f"{BASE_PATH}{grade_section}.xlsx") == source['sha256']
+        self._verified[grade_section] = (stamp, fresh)
+        if not fresh:
+            logging.warning(f"Snapshot {self.path} is stale for {grade_section}; reading the workbook instead")
+        return fresh
+
+    def get(self, grade_section, semester, stamp):
+        # (title, max_column, rows, index) of a sheet, or None if its workbook changed since the
+        # compile or the snapshot has been closed
+        if not self.is_fresh(grade_section, stamp):
+            return None
+        entry = self.header['sheets'].get(f"{grade_section}/{semester}")
+        if entry is None:
+            raise KeyError(semester)
+        start = self._body + entry['offset']
+        with self._lock:
+            if self._mm is None:
+                return None
+            block = self._mm[start:start + entry['length']]
+        columns = json.loads(zlib.decompress(block).decode('utf-8'))
+        return entry['title'], entry['max_column'], tuple(zip(*columns)), entry['index']
+
+    def stale_sections(self):
+        stale = []
+        for grade_section in self.header['sources']:
+            try:
+                st = os.stat(f"{BASE_PATH}{grade_section}.xlsx")
+            except FileNotFoundError:
+                stale.append(grade_section)
+                continue
+            if not self.is_fresh(grade_section, (st.st_mtime_ns, st.st_size)):
+                stale.append(grade_section)
+        return stale
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
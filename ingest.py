@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import pickle
+import logging
+import zipfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree.ElementTree import ParseError
+
+import xlsx_reader
+
+# === Parallel Workbook Ingest ===
+# Worker side of the gradebook pre-warm: each section workbook is streamed by
+# xlsx_reader in its own process and sent back as plain tuples. This module
+# deliberately imports nothing from bot.py so workers stay cheap to start.
+#
+# The pool is not started from the bot process: spawned and forkserver
+# children re-run their parent's entry script (as __mp_main__) before taking a
+# task, and with `python bot.py` that would build a whole bot in every worker.
+# read_workbooks runs ingest_pool.py instead, a small entry script whose
+# children re-run nothing but imports of this module, and reads the results
+# back from its stdout.
+
+def read_workbook(path, semesters, min_row, max_row, max_col):
+    started = time.perf_counter()
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    try:
+        sheets = xlsx_reader.read_sheets(path, semesters, min_row, max_row, max_col)
+        error = None
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile, ParseError) as e:
+        sheets = {}
+        error = f"{type(e).__name__}: {str(e)}"
+    return {
+        'path': path,
+        'stamp': stamp,
+        'sheets': sheets,
+        'error': error,
+        'seconds': time.perf_counter() - started
+    }
+
+def pool_context():
+    # Never fork the bot itself: by now it runs log, audit, scheduler and
+    # webhook threads, and a child could inherit a lock one of them held.
+    # A forkserver forks workers from a fresh single-threaded process that has
+    # only this module loaded.
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['ingest'])
+    return context
+
+def failed_read(path, error):
+    return {
+        'path': path,
+        'stamp': None,
+        'sheets': {},
+        'error': error,
+        'seconds': 0.0
+    }
+
+def pool_results(paths, semesters, min_row, max_row, max_col, workers):
+    # Yields read_workbook() results as pool workers finish them; run from ingest_pool.py
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+        futures = {pool.submit(read_workbook, path, semesters, min_row, max_row, max_col): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield failed_read(futures[future], f"{type(e).__name__}: {str(e)}")
+
+def read_workbooks(paths, semesters, min_row, max_row, max_col, workers=None):
+    # Yields read_workbook() results as workers finish them
+    if not paths:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers == 1:
+        for path in paths:
+            yield read_workbook(path, semesters, min_row, max_row, max_col)
+        return
+    entry = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest_pool.py')
+    pool = subprocess.Popen([sys.executable, entry], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    pending = set(paths)
+    try:
+        pickle.dump((paths, semesters, min_row, max_row, max_col, workers), pool.stdin)
+        pool.stdin.close()
+        while pending:
+            try:
+                result = pickle.load(pool.stdout)
+            except EOFError:
+                break
+            pending.discard(result['path'])
+            yield result
+    finally:
+        pool.stdout.close()
+        if pool.wait() != 0 or pending:
+            logging.error(f"Ingest pool exited with status {pool.returncode}, {len(pending)} workbooks unread")
+    for path in sorted(pending):
+        yield failed_read(path, f"ingest pool exited with status {pool.returncode}")
@@ -0,0 +1,21 @@
+import sys
+import pickle
+
+import ingest
+
+# === Ingest Pool Entry ===
+# Started by ingest.read_workbooks: reads the job from stdin and writes each
+# workbook's read_workbook() result to stdout as a pickle as soon as a worker
+# finishes it. Pool workers re-run this script as __mp_main__, which only
+# imports ingest, so nothing of the bot is rebuilt in them.
+
+def main():
+    paths, semesters, min_row, max_row, max_col, workers = pickle.load(sys.stdin.buffer)
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr  # keep stray prints out of the result stream
+    for result in ingest.pool_results(paths, semesters, min_row, max_row, max_col, workers):
+        pickle.dump(result, out)
+        out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import functools
+from collections import defaultdict
+
+from fake_bot_api import FakeBotApi
+
+# === Load Test and Benchmark Suite ===
+# Runs bot.py's handlers (sync TeleBot) and async_bot.py's coroutines against a
+# local fake Bot API and drives synthetic traffic:
+#   registration  /register bursts followed by the language-choice callbacks
+#   section       every student of one section opening S1, S2 and Ave
+#   top3          a storm of top-3 lookups across sections and semesters
+#   ranking       grade-wide and school-wide top-N lookups from registered students
+#   stats         class statistics of every section, viewed by its own students
+#   mixed         result and top-3 callbacks from students in all sections
+# For each scenario and runtime it reports throughput plus count and
+# p50/p95/p99/max latency per handler (registered handlers and the
+# process_results / process_top3 / store calls they make), and the Bot API
+# calls the run made per update, by method.
+# With --admission the bot's admission control stays on and each run also
+# reports, per kind, how many expensive requests were admitted, throttled and
+# shed. The exit status is 1 if a kind shed requests from a burst that fits its
+# admission queue, or shed nothing from one larger than ADMISSION_SLOTS plus
+# its queue.
+# Usage: python loadtest.py [--scenario all] [--runtime both] [--users 300]
+#        [--section 4A] [--latency 0.05] [--store sqlite|journal] [--global-rate 30]
+#        [--admission]
+
+SCENARIOS = ['registration', 'section', 'top3', 'ranking', 'stats', 'mixed']
+
+def setup_environment(args, workdir):
+    os.environ['BOT_TOKEN'] = '123456:LOADTEST'
+    os.environ['TELEGRAM_API_URL'] = args.api_url
+    os.environ['USER_STORE'] = args.store
+    os.environ['USER_DB_FILE'] = os.path.join(workdir, 'users.db')
+    os.environ['USER_JOURNAL_FILE'] = os.path.join(workdir, 'user_events.jsonl')
+    os.environ['USER_STATE_FILE'] = os.path.join(workdir, 'user_state.json')
+    os.environ['OUTBOUND_GLOBAL_RATE'] = str(args.global_rate)
+    os.environ['INGEST_INTERVAL'] = '0'
+    if not args.admission:
+        # Measure the handlers themselves; --admission keeps the bot's own limits
+        os.environ['ADMISSION_SLOTS'] = '1000000'
+        os.environ['ADMISSION_USER_BURST'] = '1000000'
+    os.environ.pop('ADMIN_ID', None)
+
+# === Handler Timing ===
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.completed = 0
+        self._cond = threading.Condition()
+
+    def reset(self):
+        with self._cond:
+            self.samples.clear()
+            self.completed = 0
+
+    def add(self, name, seconds, top):
+        with self._cond:
+            self.samples[name].append(seconds)
+            if top:
+                self.completed += 1
+                self._cond.notify_all()
+
+    def wait(self, expected, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.completed < expected:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def wrap(self, fn, name, top=False):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.add(name, time.perf_counter() - started, top)
+            return timed_async
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - started, top)
+        return timed
+
+def instrument(recorder, telebot_instance):
+    # Registered handlers count as completed updates
+    for handlers in (telebot_instance.message_handlers, telebot_instance.callback_query_handlers):
+        for handler in handlers:
+            fn = handler['function']
+            handler['function'] = recorder.wrap(fn, fn.__name__, top=True)
+
+def instrument_core(recorder, core, inner_names):
+    # bot.py's lookups, shared by both runtimes, are timed only
+    for name in inner_names:
+        setattr(core, name, recorder.wrap(getattr(core, name), name))
+    # Sync requests refused at ingress never reach a handler; their toast completes the update
+    core.refuse_request = recorder.wrap(core.refuse_request, 'refuse_request', top=True)
+
+def instrument_store(recorder, store):
+    for name in ('register', 'login', 'set_language', 'get_user', 'get_pin', 'student_taken'):
+        setattr(store, name, recorder.wrap(getattr(store, name), f"store.{name}"))
+
+# === Synthetic Updates ===
+class UpdateFactory:
+    def __init__(self):
+        self._ids = iter(range(1, 10 ** 9))
+
+    def message(self, user_id, text):
+        update_id = next(self._ids)
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+                'text': text,
+                'entities': entities
+            }
+        }
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': f"cb-{update_id}",
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+                    'text': 'menu'
+                }
+            }
+        }
+
+def seed_students(store, sections, per_section, first_id):
+    # Registers per_section students in each section directly in the store
+    users = []
+    for s, grade_section in enumerate(sections):
+        for n in range(1, per_section + 1):
+            telegram_id = first_id + s * 100 + n
+            if not store.student_taken(grade_section, str(n)):
+                store.register(str(telegram_id), grade_section, str(n), f"{telegram_id % 1000000:06d}", 'en')
+            users.append((telegram_id, grade_section))
+    return users
+
+def scenario_phases(name, factory, args, run):
+    # Returns a list of update batches; each batch is dispatched and awaited in turn
+    semesters = ['S1', 'S2', 'Ave']
+    if name == 'registration':
+        # Fresh users claim students 31..60 so the seeded 1..30 stay untouched
+        base = 700000 + run * 10000
+        claims = [(base + i, gs, no) for i, (gs, no) in zip(range(args.users), args.unclaimed)]
+        return [
+            [factory.message(uid, f"/register {gs} {no}") for uid, gs, no in claims],
+            [factory.callback(uid, f"reg_lang_en_{gs}_{no}") for uid, gs, no in claims]
+        ]
+    if name == 'section':
+        students = [(uid, gs) for uid, gs in args.seeded if gs == args.section]
+        return [[factory.callback(uid, f"semester_{gs}_{sem}") for uid, gs in students for sem in semesters]]
+    if name == 'top3':
+        return [[factory.callback(args.seeded[i % len(args.seeded)][0], f"top3_{args.sections[i % len(args.sections)]}_{semesters[i % 3]}")
+                 for i in range(args.users)]]
+    if name == 'ranking':
+        scopes = list(args.grades) + ['school']
+        return [[factory.callback(args.seeded[i % len(args.seeded)][0], f"rank_{scopes[i % len(scopes)]}_{semesters[i % 3]}")
+                 for i in range(args.users)]]
+    if name == 'stats':
+        return [[factory.callback(args.seeded[i % len(args.seeded)][0], f"stats_{args.seeded[i % len(args.seeded)][1]}_{semesters[i % 3]}")
+                 for i in range(args.users)]]
+    updates = []
+    for i in range(args.users):
+        uid, gs = args.seeded[i % len(args.seeded)]
+        updates.append(factory.callback(uid, f"top3_{gs}_{semesters[i % 3]}" if i % 4 == 3 else f"semester_{gs}_{semesters[i % 3]}"))
+    return [updates]
+
+# === Runtimes ===
+def run_sync(core, recorder, phases, timeout):
+    from telebot import types
+    results = []
+    for batch in phases:
+        recorder.completed = 0
+        started = time.perf_counter()
+        core.bot.process_new_updates([types.Update.de_json(u) for u in batch])
+        done = recorder.wait(len(batch), timeout)
+        results.append((len(batch), time.perf_counter() - started, done))
+    return results
+
+async def run_async(recorder, phases, timeout):
+    import async_bot
+    from telebot import types
+    results = []
+    for batch in phases:
+        recorder.completed = 0
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(async_bot.abot.process_new_updates([types.Update.de_json(u) for u in batch]), timeout)
+            done = True
+        except asyncio.TimeoutError:
+            done = False
+        results.append((len(batch), time.perf_counter() - started, done))
+    return results
+
+async def drain_async():
+    # Lets pending tasks finish, then closes the shared aiohttp session
+    import async_bot
+    pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    if pending:
+        await asyncio.wait(pending, timeout=5)
+    session = async_bot.asyncio_helper.session_manager.session
+    if session is not None:
+        await session.close()
+
+# === Reporting ===
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def admission_counts(core):
+    return core.request_admission.stats()['counts']
+
+def print_admission(before, after, stats):
+    # False if a kind shed requests although the run fitted its queue, or shed
+    # nothing although more were admitted than its slots and queue can hold
+    ok = True
+    for kind, counts in after.items():
+        delta = {verdict: n - before[kind][verdict] for verdict, n in counts.items()}
+        if not any(delta.values()):
+            continue
+        print(f"  admission {kind}: " + ", ".join(f"{n} {verdict}" for verdict, n in delta.items()))
+        limit = stats['queue_limits'][kind]
+        if delta['shed'] and sum(delta.values()) <= limit:
+            print(f"  admission check FAILED: {delta['shed']} {kind} requests shed although {sum(delta.values())} fit a {limit}-request queue")
+            ok = False
+        elif not delta['shed'] and delta['admitted'] > limit + stats['slots']:
+            print(f"  admission check FAILED: {delta['admitted']} {kind} requests admitted past {stats['slots']} slots and a {limit}-request queue")
+            ok = False
+    return ok
+
+def print_api_calls(api, updates):
+    counts = sorted(api.counts.items(), key=lambda item: -item[1])
+    total = sum(n for _, n in counts)
+    print(f"  api calls: {total} ({total / updates if updates else 0:.2f} per update): "
+          + ", ".join(f"{method} {n}" for method, n in counts))
+
+def print_report(scenario, runtime, results, recorder):
+    updates = sum(r[0] for r in results)
+    elapsed = sum(r[1] for r in results)
+    complete = all(r[2] for r in results)
+    print(f"\n{scenario} / {runtime}: {updates} updates in {elapsed:.2f}s = {updates / elapsed if elapsed else 0:.1f} updates/s"
+          f"{'' if complete else '  (TIMEOUT - some handlers did not finish)'}")
+    print(f"  {'handler':<30}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, samples in sorted(recorder.samples.items()):
+        values = sorted(samples)
+        print(f"  {name:<30}{len(values):>7}{percentile(values, 0.5) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot's handlers against a local fake Bot API.")
+    parser.add_argument('--scenario', choices=SCENARIOS + ['all'], default='all')
+    parser.add_argument('--runtime', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--users', type=int, default=300, help="updates per burst scenario (default: %(default)s)")
+    parser.add_argument('--section', default='4A', help="section used by the section scenario (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated Bot API latency in seconds (default: %(default)s)")
+    parser.add_argument('--store', choices=['sqlite', 'journal'], default='sqlite', help="user store backend (default: %(default)s)")
+    parser.add_argument('--global-rate', type=float, default=30, help="outbound messages/s across all chats (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for each burst (default: %(default)s)")
+    parser.add_argument('--admission', action='store_true', help="keep admission control on and report its verdicts")
+    args = parser.parse_args()
+
+    api = FakeBotApi(latency=args.latency).start()
+    args.api_url = api.url
+    workdir = tempfile.mkdtemp(prefix='selam-loadtest-')
+    setup_environment(args, workdir)
+    import bot as core
+
+    args.sections = list(core.section_catalog.sections)
+    args.grades = core.section_catalog.grades
+    args.seeded = seed_students(core.user_store, args.sections, 30, 100000)
+    args.unclaimed = iter([(gs, no) for no in range(31, 61) for gs in args.sections])
+    core.prewarm_gradebooks()
+
+    recorder = Recorder()
+    instrument_store(recorder, core.user_store)
+    runtimes = ['sync', 'async'] if args.runtime == 'both' else [args.runtime]
+    instrument_core(recorder, core, ['process_results', 'process_top3', 'process_ranking', 'process_stats'])
+    if 'sync' in runtimes:
+        instrument(recorder, core.bot)
+    if 'async' in runtimes:
+        import async_bot
+        instrument(recorder, async_bot.abot)
+
+    print(f"fake Bot API {api.url}, latency {args.latency * 1000:.0f} ms, store {args.store}, "
+          f"global rate {args.global_rate:.0f}/s, {core.BOT_WORKER_THREADS} sync workers, "
+          f"{core.ASYNC_EXECUTOR_WORKERS} async executor workers")
+    factory = UpdateFactory()
+    scenarios = SCENARIOS if args.scenario == 'all' else [args.scenario]
+    runs = list(enumerate((s, r) for r in runtimes for s in scenarios))
+    admission_ok = True
+
+    for run, (scenario, runtime) in runs:
+        if runtime == 'sync':
+            phases = scenario_phases(scenario, factory, args, run)
+            recorder.reset()
+            api.reset()
+            before = admission_counts(core)
+            results = run_sync(core, recorder, phases, args.timeout)
+            print_report(scenario, runtime, results, recorder)
+            print_api_calls(api, sum(r[0] for r in results))
+            if args.admission:
+                admission_ok &= print_admission(before, admission_counts(core), core.request_admission.stats())
+
+    async def async_runs():
+        # One event loop for every async scenario: aiohttp's session is bound to it
+        nonlocal admission_ok
+        for run, (scenario, runtime) in runs:
+            if runtime == 'async':
+                phases = scenario_phases(scenario, factory, args, run)
+                recorder.reset()
+                api.reset()
+                before = admission_counts(core)
+                results = await run_async(recorder, phases, args.timeout)
+                print_report(scenario, runtime, results, recorder)
+                print_api_calls(api, sum(r[0] for r in results))
+                if args.admission:
+                    admission_ok &= print_admission(before, admission_counts(core), core.request_admission.stats())
+        await drain_async()
+
+    if 'async' in runtimes:
+        asyncio.run(async_runs())
+    api.stop()
+    return 0 if admission_ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import time
+import asyncio
+import bisect
+import logging
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper, asyncio_helper
+
+# === Hot-Path Metrics ===
+# Timing spans around sheet loads and row scans, user-store calls, Bot API
+# round trips and handlers. Each span feeds a cumulative histogram per
+# (family, label) for the Prometheus /metrics endpoint, and a bounded ring of
+# recent samples from which the admin /perf command computes exact
+# percentiles over the last N minutes.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_SAMPLES = 50000
+PREFIX = 'selam_'
+
+class Histogram:
+    __slots__ = ('buckets', 'sum', 'count', 'errors')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, ok):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if not ok:
+            self.errors += 1
+
+class Metrics:
+    def __init__(self, recent=RECENT_SAMPLES):
+        self._lock = threading.Lock()
+        self._families = {}  # name -> (help, label key)
+        self._series = {}  # (name, label) -> Histogram
+        self._recent = deque(maxlen=recent)  # (monotonic, name, label, seconds)
+        self._collectors = []
+        self.started = time.monotonic()
+
+    def describe(self, name, help_text, label):
+        self._families[name] = (help_text, label)
+
+    def add_collector(self, collect):
+        # collect() returns [(name, help, [(labels dict, value), ...]), ...] of counters
+        self._collectors.append(collect)
+
+    def observe(self, name, seconds, label='', ok=True):
+        with self._lock:
+            series = self._series.get((name, label))
+            if series is None:
+                series = self._series[(name, label)] = Histogram()
+            series.observe(seconds, ok)
+            self._recent.append((time.monotonic(), name, label, seconds))
+
+    @contextmanager
+    def span(self, name, label=''):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(name, time.perf_counter() - started, label, ok)
+
+    def wrap(self, fn, name, label=None):
+        label = label or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_async(*args, **kwargs):
+                started = time.perf_counter()
+                ok = False
+                try:
+                    result = await fn(*args, **kwargs)
+                    ok = True
+                    return result
+                finally:
+                    self.observe(name, time.perf_counter() - started, label, ok)
+            return timed_async
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self.observe(name, time.perf_counter() - started, label, ok)
+        return timed
+
+    def timed(self, name, label=None):
+        return lambda fn: self.wrap(fn, name, label)
+
+    def instrument_methods(self, obj, method_names, name):
+        for method_name in method_names:
+            setattr(obj, method_name, self.wrap(getattr(obj, method_name), name, method_name))
+
+    def instrument_handlers(self, bot, name='handler_seconds'):
+        # Wraps every registered handler of a TeleBot/AsyncTeleBot in place
+        for handlers in (bot.message_handlers, bot.callback_query_handlers):
+            for handler in handlers:
+                handler['function'] = self.wrap(handler['function'], name)
+
+    def summary(self, window):
+        # Exact percentiles per (family, label) over the last `window` seconds
+        cutoff = time.monotonic() - window
+        with self._lock:
+            recent = [s for s in self._recent if s[0] >= cutoff]
+            oldest = self._recent[0][0] if self._recent else None
+        grouped = {}
+        for _, name, label, seconds in recent:
+            grouped.setdefault((name, label), []).append(seconds)
+        rows = []
+        for (name, label), values in sorted(grouped.items()):
+            values.sort()
+            rows.append({
+                'name': name,
+                'label': label,
+                'count': len(values),
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+                'max': values[-1]
+            })
+        # True when the ring buffer dropped samples that were inside the window
+        truncated = oldest is not None and oldest > cutoff and len(self._recent) == self._recent.maxlen
+        return rows, truncated
+
+    def render_prometheus(self):
+        with self._lock:
+            series = {key: (list(h.buckets), h.sum, h.count, h.errors) for key, h in self._series.items()}
+        lines = []
+        for name, (help_text, label_key) in sorted(self._families.items()):
+            metric = PREFIX + name
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            errors = []
+            for (series_name, label), (buckets, total, count, failed) in sorted(series.items()):
+                if series_name != name:
+                    continue
+                labels = f'{label_key}="{escape_label(label)}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"{metric}_sum{{{labels}}} {total:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {count}")
+                errors.append((labels, failed))
+            lines.append(f"# HELP {metric}_errors_total Spans of {metric} that raised")
+            lines.append(f"# TYPE {metric}_errors_total counter")
+            lines.extend(f"{metric}_errors_total{{{labels}}} {failed}" for labels, failed in errors)
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception:
+                logging.exception("Metrics collector failed")
+                continue
+            for name, help_text, samples in families:
+                metric = PREFIX + name
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in samples:
+                    label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+                    lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        lines.append(f"# HELP {PREFIX}uptime_seconds Seconds since the bot started")
+        lines.append(f"# TYPE {PREFIX}uptime_seconds gauge")
+        lines.append(f"{PREFIX}uptime_seconds {time.monotonic() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# === Bot API Round Trips ===
+# Installed before the rate limiter so spans cover the HTTP call itself, not
+# the time spent waiting for a token.
+def install(metrics, name='api_call_seconds'):
+    original = apihelper._make_request
+
+    def timed_request(token, method_name, method='get', params=None, files=None):
+        with metrics.span(name, method_name):
+            return original(token, method_name, method=method, params=params, files=files)
+
+    apihelper._make_request = timed_request
+
+def install_async(metrics, name='api_call_seconds'):
+    original = asyncio_helper._process_request
+
+    async def timed_request(token, url, method='get', params=None, files=None, **kwargs):
+        with metrics.span(name, url):
+            return await original(token, url, method=method, params=params, files=files, **kwargs)
+
+    asyncio_helper._process_request = timed_request
+
+# === /metrics Endpoint ===
+class MetricsServer:
+    def __init__(self, host, port, metrics):
+        self.metrics = metrics
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        host, port = self.address
+        logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+        thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server.metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
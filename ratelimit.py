@@ -0,0 +1,243 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from telebot import apihelper, asyncio_helper
+
+# === Outbound Telegram Rate Limiter ===
+# Every Bot API call made by either runtime passes through one limiter:
+# - a global token bucket (Telegram allows ~30 messages/s per bot) and a
+#   per-chat bucket (~1 message/s sustained) pace the message-producing methods;
+# - callers waiting for a global token are served by lane: student replies
+#   first, then admin notices, then cosmetic deletes, then results broadcasts.
+#   Only a wait on the global bucket holds lower lanes back; a reply held by
+#   its own chat's bucket or 429 pause does not delay sends to other chats;
+# - a 429 reply is retried after its retry_after, which also pauses that
+#   chat (or every chat) for the other callers.
+# install()/install_async() wrap telebot's request functions, so handler code
+# keeps calling bot.send_message etc. unchanged.
+
+LANES = ('reply', 'admin', 'cosmetic', 'broadcast')
+RATE_LIMITED_METHODS = {
+    'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'deleteMessage',
+    'sendPhoto', 'sendDocument', 'forwardMessage', 'copyMessage'
+}
+MIN_WAIT = 0.005
+
+_lane = contextvars.ContextVar('outbound_lane', default=None)
+
+@contextmanager
+def outbound_lane(lane):
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def lane_for(method_name):
+    lane = _lane.get()
+    if lane is not None:
+        return lane
+    return 'cosmetic' if method_name == 'deleteMessage' else 'reply'
+
+def chat_key(params):
+    chat_id = (params or {}).get('chat_id')
+    return str(chat_id) if chat_id is not None else None
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self):
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class OutboundLimiter:
+    def __init__(self, global_rate=30, chat_rate=1.0, chat_burst=3, max_retries=3, max_chats=10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}
+        self._paused = {}  # chat_id (None = all chats) -> monotonic time a 429 pause ends
+        self._waiting = dict.fromkeys(LANES, 0)
+        self.calls = dict.fromkeys(LANES, 0)
+        self.throttled = dict.fromkeys(LANES, 0)
+        self.retried = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Forget idle chats; a refilled bucket carries no state worth keeping
+                for key in [k for k, b in self._chats.items() if now - b.stamp > self.chat_burst / self.chat_rate]:
+                    del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def try_acquire(self, chat_id, lane, waiting=False):
+        # Takes a global and a per-chat token and returns (0, False), or returns
+        # (seconds to wait before trying again, whether the wait is on the global
+        # bucket). `waiting` says whether the caller is already counted as a
+        # global waiter of its lane; the count follows the returned flag.
+        now = time.monotonic()
+        with self._lock:
+            wait, on_global = self._wait_for(chat_id, lane, now)
+            if not wait:
+                self._global.tokens -= 1
+                if chat_id is not None:
+                    self._chats[chat_id].tokens -= 1
+            if on_global != waiting:
+                self._waiting[lane] += 1 if on_global else -1
+            return wait, on_global
+
+    def _wait_for(self, chat_id, lane, now):
+        # The chat's own limits come first: a reply stuck on them is not a
+        # priority waiter and must not hold back other lanes' chats
+        pause = max(self._paused.get(None, 0), self._paused.get(chat_id, 0)) - now
+        if pause > 0:
+            return pause, False
+        if chat_id is not None:
+            wait = self._chat_bucket(chat_id, now).wait_time()
+            if wait > 0:
+                return max(wait, MIN_WAIT), False
+        rank = LANES.index(lane)
+        if any(self._waiting[higher] for higher in LANES[:rank]):
+            return MIN_WAIT * 2, True
+        self._global.refill(now)
+        wait = self._global.wait_time()
+        if wait > 0:
+            return max(wait, MIN_WAIT), True
+        return 0.0, False
+
+    def _throttled(self, lane):
+        with self._lock:
+            self.throttled[lane] += 1
+
+    def _give_up_waiting(self, lane, waiting):
+        if waiting:
+            with self._lock:
+                self._waiting[lane] -= 1
+
+    def acquire(self, chat_id, lane):
+        wait, waiting = self.try_acquire(chat_id, lane)
+        if not wait:
+            return
+        self._throttled(lane)
+        try:
+            while wait:
+                time.sleep(wait)
+                wait, waiting = self.try_acquire(chat_id, lane, waiting)
+        finally:
+            self._give_up_waiting(lane, waiting)
+
+    async def acquire_async(self, chat_id, lane):
+        wait, waiting = self.try_acquire(chat_id, lane)
+        if not wait:
+            return
+        self._throttled(lane)
+        try:
+            while wait:
+                await asyncio.sleep(wait)
+                wait, waiting = self.try_acquire(chat_id, lane, waiting)
+        finally:
+            self._give_up_waiting(lane, waiting)
+
+    def _retry_delay(self, error, chat_id, attempt):
+        # Returns seconds to wait before retrying a 429, or None to give up
+        if getattr(error, 'error_code', None) != 429 or attempt >= self.max_retries:
+            if getattr(error, 'error_code', None) == 429:
+                with self._lock:
+                    self.failed += 1
+            return None
+        retry_after = (error.result_json.get('parameters') or {}).get('retry_after', 1)
+        now = time.monotonic()
+        with self._lock:
+            self.retried += 1
+            for key in [k for k, until in self._paused.items() if until <= now]:
+                del self._paused[key]
+            self._paused[chat_id] = max(self._paused.get(chat_id, 0), now + retry_after)
+        logging.warning(f"Telegram 429 for chat {chat_id}; retrying in {retry_after}s (attempt {attempt + 1})")
+        return retry_after
+
+    def call(self, method_name, params, send):
+        chat_id = chat_key(params)
+        lane = lane_for(method_name)
+        limited = method_name in RATE_LIMITED_METHODS
+        attempt = 0
+        while True:
+            if limited:
+                self.acquire(chat_id, lane)
+            with self._lock:
+                self.calls[lane] += 1
+            try:
+                return send()
+            except apihelper.ApiTelegramException as e:
+                delay = self._retry_delay(e, chat_id, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(self, method_name, params, send):
+        chat_id = chat_key(params)
+        lane = lane_for(method_name)
+        limited = method_name in RATE_LIMITED_METHODS
+        attempt = 0
+        while True:
+            if limited:
+                await self.acquire_async(chat_id, lane)
+            with self._lock:
+                self.calls[lane] += 1
+            try:
+                return await send()
+            except asyncio_helper.ApiTelegramException as e:
+                delay = self._retry_delay(e, chat_id, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'throttled': dict(self.throttled),
+                'waiting': dict(self._waiting),
+                'retried': self.retried,
+                'failed': self.failed,
+                'chats': len(self._chats)
+            }
+
+def install(limiter):
+    original = apihelper._make_request
+
+    def limited_request(token, method_name, method='get', params=None, files=None):
+        return limiter.call(method_name, params, lambda: original(token, method_name, method=method, params=params, files=files))
+
+    apihelper._make_request = limited_request
+
+def install_async(limiter):
+    original = asyncio_helper._process_request
+
+    async def limited_request(token, url, method='get', params=None, files=None, **kwargs):
+        return await limiter.call_async(url, params, lambda: original(token, url, method=method, params=params, files=files, **kwargs))
+
+    asyncio_helper._process_request = limited_request
@@ -0,0 +1,473 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter, deque
+from logging.handlers import QueueListener
+
+from audit import DroppingQueueHandler
+
+# === Update Recording ===
+# With UPDATE_RECORD_FILE set, every incoming update is appended to a JSONL
+# file, one {"ts": <arrival epoch seconds>, "update": {...}} per line, written
+# by a background listener like the audit trail. Updates are anonymised on the
+# way in: only the fields the handlers read are kept, user and chat ids become
+# pseudonyms that are stable within one recording (keyed by a random salt that
+# is never written), names are dropped, free text is blanked and /login PINs
+# are masked. Commands, their arguments and callback_data are kept verbatim.
+#
+# === Replay ===
+# Usage:
+#   python replay.py updates.jsonl [--speed 1|10|max] [--runtime sync|async]
+#                    [--save outcomes.json] [--compare outcomes.json]
+#
+# Feeds a recording back through bot.process_new_updates (or the async bot)
+# against the local fake Bot API, on the recorded schedule scaled by --speed.
+# A chat's next update is held until the bot has handled its previous one, as
+# a user waits for the reply before tapping again; time spent held shows up as
+# dispatch lag.
+# The bot runs in a scratch directory holding a copy of data/ and empty user
+# stores, so nothing of the real deployment is read or written; users whose
+# first recorded action is a result lookup were registered before the
+# recording started and are registered in the sandbox first. It reports the
+# same per-handler latency table as loadtest.py, and the bot's replies per
+# chat: --save writes them, --compare diffs a replay against saved ones (for
+# example the same recording replayed before a change). Replies are compared
+# per chat regardless of order, since one chat's updates may run concurrently;
+# the admin chat also gets timed digests, so its replies depend on timing.
+
+ADMIN_PSEUDONYM = 1  # the admin's id in recordings, and ADMIN_ID during a replay
+MASKED_PIN = '<pin>'
+BLANKED_TEXT = '<text>'
+SECRET_COMMANDS = ('/login',)
+PIN_PATTERN = re.compile(r'\b\d{6}\b')  # PINs are random per run
+TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}(:\d{2})?')
+
+def pseudonym(salt, real_id):
+    digest = hashlib.blake2b(str(real_id).encode('utf-8'), key=salt, digest_size=8).digest()
+    return 10 ** 9 + int.from_bytes(digest, 'big') % 10 ** 9
+
+class UpdateRecorder:
+    def __init__(self, path, admin_id=None, max_pending=10000):
+        self.path = path
+        self.admin_id = str(admin_id) if admin_id else None
+        self.recorded = 0
+        self._salt = os.urandom(16)
+        self._handler = DroppingQueueHandler(queue.Queue(max_pending))
+        self._logger = logging.getLogger('selam.updates')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(self._handler)
+        file_handler = logging.FileHandler(path, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        self._listener = QueueListener(self._handler.queue, file_handler)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+
+    @property
+    def dropped(self):
+        return self._handler.dropped
+
+    def _id(self, real_id):
+        if self.admin_id and str(real_id) == self.admin_id:
+            return ADMIN_PSEUDONYM
+        return pseudonym(self._salt, real_id)
+
+    def _user(self, user):
+        if user.is_bot:
+            return {'id': user.id, 'is_bot': True, 'first_name': user.first_name}
+        uid = self._id(user.id)
+        anonymised = {'id': uid, 'is_bot': False, 'first_name': f"User{uid}"}
+        if user.username:
+            anonymised['username'] = f"user{uid}"
+        return anonymised
+
+    def _message(self, message, ts, with_text=True):
+        anonymised = {
+            'message_id': message.message_id,
+            'date': int(ts),
+            'chat': {'id': self._id(message.chat.id), 'type': message.chat.type}
+        }
+        if message.from_user:
+            anonymised['from'] = self._user(message.from_user)
+        text = message.text
+        if text is not None and with_text:
+            command, _, rest = text.partition(' ')
+            if not command.startswith('/'):
+                text = BLANKED_TEXT
+            elif command.split('@')[0] in SECRET_COMMANDS and rest:
+                text = f"{command} {MASKED_PIN}"
+            anonymised['text'] = text
+            if text.startswith('/'):
+                anonymised['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return anonymised
+
+    def anonymise(self, update, ts):
+        # Update object -> the raw dict a replay feeds back, or None for kinds no handler takes
+        if update.message:
+            if update.message.text is None:
+                return None  # only text messages have handlers
+            return {'update_id': update.update_id, 'message': self._message(update.message, ts)}
+        call = update.callback_query
+        if call:
+            anonymised = {'id': call.id, 'from': self._user(call.from_user),
+                          'chat_instance': str(self._id(call.chat_instance)), 'data': call.data}
+            if call.message:
+                anonymised['message'] = self._message(call.message, ts, with_text=False)  # the bot's own text
+            return {'update_id': update.update_id, 'callback_query': anonymised}
+        return None
+
+    def record(self, updates):
+        ts = time.time()
+        for update in updates:
+            try:
+                anonymised = self.anonymise(update, ts)
+            except Exception:
+                logging.exception(f"Could not record update {update.update_id}")
+                continue
+            if anonymised is not None:
+                self.recorded += 1
+                self._logger.info(json.dumps({'ts': round(ts, 3), 'update': anonymised}, ensure_ascii=False))
+
+    def record_raw(self, raw):
+        from telebot import types
+        self.record([types.Update.de_json(raw)])
+
+    def attach(self, telebot_instance):
+        process = telebot_instance.process_new_updates
+
+        def recorded(updates):
+            self.record(updates)
+            return process(updates)
+        telebot_instance.process_new_updates = recorded
+
+    def wrap_raw(self, dispatch):
+        # For ingress that hands raw dicts on (workers.py's supervisor)
+        def recorded(raw):
+            self.record_raw(raw)
+            return dispatch(raw)
+        return recorded
+
+    def attach_async(self, async_telebot):
+        process = async_telebot.process_new_updates
+
+        async def recorded(updates):
+            self.record(updates)
+            return await process(updates)
+        async_telebot.process_new_updates = recorded
+
+# === Replay Side ===
+def load_recording(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line of a crashed write
+            entries.append((entry['ts'], entry['update']))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+def sender_of(update):
+    body = update.get('message') or update.get('callback_query')
+    return body['from']['id']
+
+def make_sandbox(repo):
+    # A copy of data/ and nothing else: user stores, broadcast state, audit
+    # trail and bot.log all start empty inside the scratch directory
+    sandbox = tempfile.mkdtemp(prefix='selam-replay-')
+    shutil.copytree(os.path.join(repo, 'data'), os.path.join(sandbox, 'data'))
+    return sandbox
+
+def setup_environment(args):
+    os.environ['BOT_TOKEN'] = '123456:REPLAY'
+    os.environ['TELEGRAM_API_URL'] = args.api_url
+    os.environ['ADMIN_ID'] = str(ADMIN_PSEUDONYM)
+    os.environ['INGEST_INTERVAL'] = '0'
+    for name in ('USER_DB_FILE', 'USER_JOURNAL_FILE', 'USER_STATE_FILE', 'SNAPSHOT_FILE', 'UPDATE_RECORD_FILE',
+                 'BROADCAST_BASELINE_FILE', 'BROADCAST_PLAN_FILE', 'BROADCAST_PROGRESS_FILE', 'AUDIT_LOG_FILE',
+                 'METRICS_PORT', 'BOT_SHARD'):
+        os.environ.pop(name, None)  # defaults resolve inside the sandbox
+
+def seed_registrations(core, entries):
+    # Users whose first result lookup comes before any /register or /login of
+    # theirs were registered before the recording; give them a sandbox account
+    seen = set()
+    next_no = Counter()
+    seeded = 0
+    for _, update in entries:
+        uid = sender_of(update)
+        if uid in seen:
+            continue
+        text = update.get('message', {}).get('text', '')
+        data = update.get('callback_query', {}).get('data', '')
+        if text.startswith(('/register', '/login')):
+            seen.add(uid)
+        elif data.startswith('semester_') and not data.endswith('_back'):
+            seen.add(uid)
+            grade_section = data[len('semester_'):].split('_')[0]
+            if not core.section_catalog.has_section(grade_section):
+                continue
+            next_no[grade_section] += 1
+            while core.user_store.student_taken(grade_section, str(next_no[grade_section])):
+                next_no[grade_section] += 1
+            core.user_store.register(str(uid), grade_section, str(next_no[grade_section]),
+                                     core.generate_unique_pin(core.user_store), 'en')
+            seeded += 1
+    return seeded
+
+def unmask(core, update):
+    # A masked /login gets the PIN the sandbox issued to that user, if any
+    message = update.get('message')
+    if message and message.get('text', '').endswith(f" {MASKED_PIN}"):
+        user = core.user_store.get_user(str(message['from']['id']))
+        if user and user['pin']:
+            message = dict(message, text=message['text'][:-len(MASKED_PIN)] + user['pin'])
+            return dict(update, message=message)
+    return update
+
+def chat_of(update):
+    message = update.get('message') or (update['callback_query'].get('message'))
+    return message['chat']['id'] if message else update['callback_query']['from']['id']
+
+def handled_chat(arg):
+    # Handler argument (Message or CallbackQuery) -> the chat_of() its update had
+    if hasattr(arg, 'data'):
+        return arg.message.chat.id if arg.message else arg.from_user.id
+    return arg.chat.id
+
+class ChatSequencer:
+    def __init__(self, dispatch, on_skip):
+        self.dispatch = dispatch
+        self.on_skip = on_skip  # called for an update that could not be dispatched
+        self.lags = []
+        self._lock = threading.Lock()
+        self._busy = set()
+        self._held = {}
+
+    def submit(self, update, due):
+        chat = chat_of(update)
+        with self._lock:
+            if chat in self._busy:
+                self._held.setdefault(chat, deque()).append((update, due))
+                return
+            self._busy.add(chat)
+        self._send(update, due)
+
+    def done(self, chat):
+        with self._lock:
+            held = self._held.get(chat)
+            if not held:
+                self._held.pop(chat, None)
+                self._busy.discard(chat)
+                return
+            update, due = held.popleft()
+        self._send(update, due)
+
+    def _send(self, update, due):
+        self.lags.append(max(0.0, time.perf_counter() - due))
+        try:
+            self.dispatch(update)
+        except Exception:
+            # No handler will report this chat done, so release it here
+            logging.exception(f"Skipped update {update.get('update_id')} of chat {chat_of(update)}")
+            self.on_skip()
+            self.done(chat_of(update))
+
+    def track(self, telebot_instance, core):
+        # Every registered handler reports its chat as done when it returns, and
+        # so does core.refuse_request, which answers the requests a runtime
+        # refuses before any handler runs
+        for handlers in (telebot_instance.message_handlers, telebot_instance.callback_query_handlers):
+            for handler in handlers:
+                handler['function'] = self.track_call(handler['function'])
+        core.refuse_request = self.track_call(core.refuse_request)
+
+    def track_call(self, fn):
+        if asyncio.iscoroutinefunction(fn):
+            async def tracked_async(arg, *args, **kwargs):
+                try:
+                    return await fn(arg, *args, **kwargs)
+                finally:
+                    self.done(handled_chat(arg))
+            return tracked_async
+
+        def tracked(arg, *args, **kwargs):
+            try:
+                return fn(arg, *args, **kwargs)
+            finally:
+                self.done(handled_chat(arg))
+        return tracked
+
+def schedule(entries, speed):
+    # (seconds after the start of the replay, raw update); speed 0 means no waiting
+    first = entries[0][0] if entries else 0
+    return [((ts - first) / speed if speed else 0.0, update) for ts, update in entries]
+
+def replay_sync(core, recorder, entries, speed, timeout):
+    from telebot import types
+    sequencer = ChatSequencer(lambda update: core.bot.process_new_updates([types.Update.de_json(unmask(core, update))]),
+                              lambda: recorder.add('skipped', 0.0, top=True))
+    sequencer.track(core.bot, core)
+    recorder.completed = 0
+    started = time.perf_counter()
+    for due, update in schedule(entries, speed):
+        delay = due - (time.perf_counter() - started)
+        if delay > 0:
+            time.sleep(delay)
+        sequencer.submit(update, started + due)
+    done = recorder.wait(len(entries), timeout)
+    return [(len(entries), time.perf_counter() - started, done)], sequencer.lags
+
+async def replay_async(core, recorder, entries, speed, timeout):
+    import async_bot
+    from telebot import types
+    sequencer = ChatSequencer(lambda update: asyncio.ensure_future(
+        async_bot.abot.process_new_updates([types.Update.de_json(unmask(core, update))])),
+        lambda: recorder.add('skipped', 0.0, top=True))
+    sequencer.track(async_bot.abot, core)
+    recorder.completed = 0
+    started = time.perf_counter()
+    for due, update in schedule(entries, speed):
+        delay = due - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sequencer.submit(update, started + due)
+    deadline = time.monotonic() + timeout
+    while recorder.completed < len(entries) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return [(len(entries), time.perf_counter() - started, recorder.completed >= len(entries))], sequencer.lags
+
+def reply_signature(method, params):
+    text = TIME_PATTERN.sub('<time>', PIN_PATTERN.sub(MASKED_PIN, params.get('text', '')))
+    digest = hashlib.blake2b(f"{text}\0{params.get('reply_markup', '')}".encode('utf-8'), digest_size=6).hexdigest()
+    preview = ' '.join(text.split())[:40]
+    return f"{method} {digest} {preview}".rstrip()
+
+def replies_by_chat(calls, entries):
+    # {chat_id: Counter(signature)} of what the bot sent while replaying
+    callback_chats = {}
+    for _, update in entries:
+        call = update.get('callback_query')
+        if call and 'id' in call:
+            callback_chats[call['id']] = (call.get('message') or {}).get('chat', {}).get('id', call['from']['id'])
+    replies = {}
+    for _, method, params in calls:
+        if method in ('getMe', 'getUpdates'):
+            continue
+        chat = params.get('chat_id') or callback_chats.get(params.get('callback_query_id'), 'unknown')
+        replies.setdefault(str(chat), Counter())[reply_signature(method, params)] += 1
+    return replies
+
+def compare_replies(expected, actual, limit=20):
+    differences = []
+    for chat in sorted(set(expected) | set(actual)):
+        missing = Counter(expected.get(chat, {})) - Counter(actual.get(chat, {}))
+        extra = Counter(actual.get(chat, {})) - Counter(expected.get(chat, {}))
+        if missing or extra:
+            differences.append((chat, missing, extra))
+    print(f"\nbehaviour: {len(differences)} of {len(set(expected) | set(actual))} chats differ from the saved replies")
+    for chat, missing, extra in differences[:limit]:
+        print(f"  chat {chat}:")
+        for signature, n in missing.items():
+            print(f"    - {n}x {signature}")
+        for signature, n in extra.items():
+            print(f"    + {n}x {signature}")
+    if len(differences) > limit:
+        print(f"  ... and {len(differences) - limit} more chats")
+    return not differences
+
+def print_lags(lags):
+    if lags:
+        values = sorted(lags)
+        print(f"  dispatch lag behind schedule: p50 {values[len(values) // 2] * 1000:.1f} ms, max {values[-1] * 1000:.1f} ms")
+
+def parse_speed(value):
+    if value == 'max':
+        return 0.0
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded update file against the bot and a local fake Bot API.")
+    parser.add_argument('recording', help="JSONL file written with UPDATE_RECORD_FILE")
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help="1, N (times faster) or max (default: 1)")
+    parser.add_argument('--runtime', choices=['sync', 'async'], default='sync')
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated Bot API latency in seconds (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for handlers after the last update (default: %(default)s)")
+    parser.add_argument('--save', help="write the bot's replies per chat to this file")
+    parser.add_argument('--compare', help="diff the bot's replies per chat against this saved file")
+    args = parser.parse_args()
+
+    from fake_bot_api import FakeBotApi
+    import loadtest
+
+    args.recording = os.path.abspath(args.recording)
+    entries = load_recording(args.recording)
+    expected = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            expected = json.load(f)['replies']
+    args.save = os.path.abspath(args.save) if args.save else None
+
+    api = FakeBotApi(latency=args.latency).start()
+    args.api_url = api.url
+    repo = os.path.dirname(os.path.abspath(__file__))
+    sandbox = make_sandbox(repo)
+    setup_environment(args)
+    os.chdir(sandbox)
+    import bot as core
+
+    seeded = seed_registrations(core, entries)
+    core.prewarm_gradebooks()
+    recorder = loadtest.Recorder()
+    loadtest.instrument_store(recorder, core.user_store)
+    loadtest.instrument_core(recorder, core, ['process_results', 'process_top3', 'process_ranking', 'process_stats'])
+    if args.runtime == 'sync':
+        loadtest.instrument(recorder, core.bot)
+    else:
+        import async_bot
+        loadtest.instrument(recorder, async_bot.abot)
+
+    span = entries[-1][0] - entries[0][0] if entries else 0
+    print(f"replaying {len(entries)} updates from {len(set(sender_of(u) for _, u in entries))} users "
+          f"({span:.0f}s recorded) at {'max speed' if not args.speed else f'{args.speed:g}x'}, "
+          f"fake Bot API latency {args.latency * 1000:.0f} ms, sandbox {sandbox}, {seeded} users pre-registered")
+    api.reset()
+    if args.runtime == 'sync':
+        results, lags = replay_sync(core, recorder, entries, args.speed, args.timeout)
+    else:
+        async def run():
+            outcome = await replay_async(core, recorder, entries, args.speed, args.timeout)
+            await loadtest.drain_async()
+            return outcome
+        results, lags = asyncio.run(run())
+    loadtest.print_report('replay', args.runtime, results, recorder)
+    print_lags(lags)
+    loadtest.print_api_calls(api, len(entries))
+
+    replies = replies_by_chat(list(api.calls), entries)
+    api.stop()
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'recording': args.recording, 'replies': replies}, f, ensure_ascii=False, indent=1)
+        print(f"\nsaved replies of {len(replies)} chats to {args.save}")
+    if expected is not None and not compare_replies(expected, replies):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import heapq
+import logging
+import threading
+import time
+from itertools import count
+
+# === Delayed-Task Scheduler ===
+# One daemon thread runs every delayed job (gradebook reingest, catalog
+# refreshes, retry backoff) from a heap ordered by due time, so handler
+# threads never sleep and no per-job OS threads are created. Jobs should be
+# short; a job that raises is logged and dropped.
+
+class ScheduledTask:
+    __slots__ = ('due', 'seq', 'fn', 'args', 'name', 'cancelled')
+
+    def __init__(self, due, seq, fn, args, name):
+        self.due = due
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.name = name
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._heap = []
+        self._seq = count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.executed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def call_later(self, delay, fn, *args, name=None):
+        task = ScheduledTask(time.monotonic() + delay, next(self._seq), fn, args, name or getattr(fn, '__name__', 'task'))
+        with self._cond:
+            heapq.heappush(self._heap, task)
+            if self._heap[0] is task:
+                self._cond.notify()
+        self.start()
+        return task
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for task in self._heap if not task.cancelled)
+
+    def pending_by_name(self):
+        counts = {}
+        with self._cond:
+            for task in self._heap:
+                if not task.cancelled:
+                    counts[task.name] = counts.get(task.name, 0) + 1
+        return counts
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    # Drop cancelled heads eagerly so they don't pin the wait time
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0].due <= time.monotonic():
+                        break
+                    self._cond.wait(self._heap[0].due - time.monotonic() if self._heap else None)
+                if self._stopped:
+                    return
+                task = heapq.heappop(self._heap)
+            try:
+                task.fn(*task.args)
+                self.executed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception(f"Scheduled task {task.name} failed")
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# The modules under test live at the repository root, next to data/
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+@pytest.fixture
+def in_repo(monkeypatch):
+    # gradebook paths are relative to the repository root, as when the bot runs
+    monkeypatch.chdir(REPO)
+    return REPO
+
+@pytest.fixture(scope='session')
+def core(tmp_path_factory):
+    # bot.py configures itself from the environment when imported: point every
+    # file it writes at a scratch directory and leave the timers off
+    work = tmp_path_factory.mktemp('bot')
+    os.environ.update({
+        'BOT_TOKEN': '123456:TEST',
+        'USER_STORE': 'sqlite',
+        'USER_DB_FILE': str(work / 'users.db'),
+        'USER_JOURNAL_FILE': str(work / 'user_events.jsonl'),
+        'USER_STATE_FILE': str(work / 'user_state.json'),
+        'SNAPSHOT_FILE': str(work / 'gradebook.snap'),
+        'AUDIT_LOG_FILE': str(work / 'audit.jsonl'),
+        'BROADCAST_BASELINE_FILE': str(work / 'broadcast_baseline.json'),
+        'BROADCAST_PLAN_FILE': str(work / 'broadcast_plan.json'),
+        'BROADCAST_PROGRESS_FILE': str(work / 'broadcast_progress.json'),
+        'INGEST_INTERVAL': '0'
+    })
+    os.environ.pop('ADMIN_ID', None)
+    cwd = os.getcwd()
+    os.chdir(REPO)  # the section catalog scans data/ on import
+    try:
+        import bot
+    finally:
+        os.chdir(cwd)
+    return bot
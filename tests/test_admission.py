@@ -0,0 +1,75 @@
+from admission import ADMITTED, SHED, THROTTLED, Admission
+
+def started(log, name):
+    return lambda: log.append(name)
+
+def test_admitted_requests_start_while_slots_are_free():
+    gate = Admission(slots=2, queue_size=10, user_rate=1, user_burst=10)
+    log = []
+    assert gate.submit('u1', 'results', started(log, 'a')) == ADMITTED
+    assert gate.submit('u2', 'results', started(log, 'b')) == ADMITTED
+    assert log == ['a', 'b']
+    assert gate.stats()['active'] == 2
+
+def test_full_slots_queue_until_release():
+    gate = Admission(slots=1, queue_size=10, user_rate=1, user_burst=10)
+    log = []
+    gate.submit('u1', 'results', started(log, 'a'))
+    assert gate.submit('u2', 'results', started(log, 'b')) == ADMITTED
+    assert log == ['a']
+    assert gate.stats()['queued']['results'] == 1
+    gate.release()
+    assert log == ['a', 'b']
+    assert gate.stats()['queued']['results'] == 0
+    gate.release()
+    assert gate.stats()['active'] == 0
+
+def test_queued_requests_start_in_priority_order():
+    gate = Admission(slots=1, queue_size=10, user_rate=1, user_burst=10)
+    log = []
+    gate.submit('u0', 'results', started(log, 'running'))
+    gate.submit('u1', 'top3', started(log, 'top3'))
+    gate.submit('u2', 'register', started(log, 'register'))
+    gate.submit('u3', 'results', started(log, 'results'))
+    for _ in range(3):
+        gate.release()
+    assert log == ['running', 'results', 'register', 'top3']
+
+def test_shed_only_when_the_kinds_queue_is_full():
+    gate = Admission(slots=1, queue_size=10, user_rate=1, user_burst=10)
+    assert gate.queue_limits == {'results': 10, 'register': 8, 'top3': 6}
+    gate.submit('u0', 'results', lambda: None)
+    verdicts = [gate.submit(f"u{i}", 'top3', lambda: None) for i in range(1, 9)]
+    assert verdicts == [ADMITTED] * 6 + [SHED] * 2
+    # Other kinds still have room of their own
+    assert gate.submit('u9', 'results', lambda: None) == ADMITTED
+    assert gate.stats()['counts']['top3'] == {ADMITTED: 6, THROTTLED: 0, SHED: 2}
+
+def test_burst_within_capacity_sheds_nothing():
+    gate = Admission(slots=4, queue_size=20, user_rate=1, user_burst=1)
+    verdicts = [gate.submit(f"u{i}", 'results', lambda: None) for i in range(4 + 20)]
+    assert set(verdicts) == {ADMITTED}
+
+def test_one_user_is_throttled_past_their_burst():
+    gate = Admission(slots=10, queue_size=10, user_rate=0.001, user_burst=2)
+    assert [gate.submit('u1', 'results', lambda: None) for _ in range(3)] == [ADMITTED, ADMITTED, THROTTLED]
+    assert gate.submit('u2', 'results', lambda: None) == ADMITTED
+
+def test_refused_requests_never_start():
+    gate = Admission(slots=1, queue_size=1, user_rate=0.001, user_burst=1)
+    log = []
+    gate.submit('u1', 'results', started(log, 'first'))
+    assert gate.submit('u1', 'results', started(log, 'throttled')) == THROTTLED
+    gate.submit('u2', 'results', started(log, 'queued'))
+    assert gate.submit('u3', 'results', started(log, 'shed')) == SHED
+    gate.release()
+    gate.release()
+    assert log == ['first', 'queued']
+
+def test_forgets_least_recently_seen_users():
+    gate = Admission(slots=10, queue_size=10, user_rate=0.001, user_burst=1, max_users=2)
+    gate.submit('u1', 'results', lambda: None)
+    gate.submit('u2', 'results', lambda: None)
+    gate.submit('u3', 'results', lambda: None)
+    assert gate.stats()['users'] == 2
+    assert gate.submit('u1', 'results', lambda: None) == ADMITTED  # a fresh bucket
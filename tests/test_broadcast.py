@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import broadcast
+
+def sheet(rows):
+    # The two SheetData attributes fingerprint_rows reads
+    return SimpleNamespace(rows=rows, index={str(row[1]): offset for offset, row in enumerate(rows)})
+
+ROWS_4A = (('1', '1', 'Abebe', 80), ('2', '2', 'Sara', 91), ('', 'N/A', None, None))
+
+def test_fingerprints_skip_rows_without_a_student():
+    fingerprints = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    assert sorted(fingerprints) == ['4A/S1/1', '4A/S1/2']
+
+def test_unchanged_rows_are_not_reported():
+    fingerprints = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    assert broadcast.changed_students(fingerprints, dict(fingerprints)) == {}
+
+def test_changed_and_new_rows_are_reported_per_student():
+    old = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    new = broadcast.fingerprint_rows([
+        ('4A', 'S1', sheet((('1', '1', 'Abebe', 85),) + ROWS_4A[1:])),  # student 1's S1 mark changed
+        ('4A', 'S2', sheet(ROWS_4A)),  # a new term for everyone
+        ('4B', 'S1', sheet((('1', '1', 'Lidya', 70),)))  # a new section
+    ])
+    changed = broadcast.changed_students(old, new)
+    assert {key: sorted(semesters) for key, semesters in changed.items()} == {
+        ('4A', '1'): ['S1', 'S2'],
+        ('4A', '2'): ['S2'],
+        ('4B', '1'): ['S1']
+    }
+
+def test_rows_that_disappear_are_not_reported():
+    old = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    new = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A[:1]))])
+    assert broadcast.changed_students(old, new) == {}
+
+def test_everyone_is_new_without_a_baseline():
+    new = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    assert broadcast.changed_students({}, new) == {('4A', '1'): ['S1'], ('4A', '2'): ['S1']}
+
+def test_fingerprints_round_trip(tmp_path):
+    path = str(tmp_path / 'broadcast_baseline.json')
+    assert broadcast.load_fingerprints(path) is None
+    fingerprints = broadcast.fingerprint_rows([('4A', 'S1', sheet(ROWS_4A))])
+    broadcast.save_fingerprints(path, fingerprints)
+    assert broadcast.load_fingerprints(path) == fingerprints
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import gradebook
+import xlsx_reader
+
+SECTION = '4A'
+
+@pytest.fixture
+def snapshot(in_repo, tmp_path):
+    # A snapshot compiled from one real workbook, as compile_data.py does it
+    path = gradebook.section_workbooks()[SECTION]
+    st = os.stat(path)
+    semesters = gradebook.result_sheets(xlsx_reader.sheet_names(path))
+    sheets = {(SECTION, semester): sheet for semester, sheet in gradebook.read_sheets(path, semesters).items()}
+    sources = {SECTION: {'sha256': gradebook.file_sha256(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}}
+    snapshot_path = str(tmp_path / 'gradebook.snap')
+    gradebook.write_snapshot(snapshot_path, sheets, sources)
+    snapshot = gradebook.GradebookSnapshot(snapshot_path)
+    yield snapshot, (st.st_mtime_ns, st.st_size), sheets
+    snapshot.close()
+
+def test_get_returns_the_compiled_rows(snapshot):
+    snap, stamp, sheets = snapshot
+    for (_, semester), (title, max_column, rows) in sheets.items():
+        got_title, got_max_column, got_rows, index = snap.get(SECTION, semester, stamp)
+        assert (got_title, got_max_column, got_rows) == (title, max_column, rows)
+        assert index == gradebook.row_index(rows)
+
+def test_get_unknown_semester(snapshot):
+    snap, stamp, _ = snapshot
+    with pytest.raises(KeyError):
+        snap.get(SECTION, 'S9', stamp)
+
+def test_is_fresh_for_the_compiled_stamp(snapshot):
+    snap, stamp, _ = snapshot
+    assert snap.is_fresh(SECTION, stamp)
+    assert not snap.is_fresh('9Z', stamp)  # never compiled
+
+def test_is_fresh_by_checksum_when_only_mtime_moved(snapshot):
+    snap, (mtime_ns, size), _ = snapshot
+    assert snap.is_fresh(SECTION, (mtime_ns + 1, size))
+
+def test_changed_workbook_is_stale(snapshot):
+    snap, (mtime_ns, size), sheets = snapshot
+    semester = next(iter(sheets))[1]
+    assert not snap.is_fresh(SECTION, (mtime_ns + 1, size + 1))
+    assert snap.get(SECTION, semester, (mtime_ns + 1, size + 1)) is None
+
+def test_closed_snapshot_reads_nothing(snapshot):
+    snap, stamp, sheets = snapshot
+    semester = next(iter(sheets))[1]
+    snap.close()
+    assert snap.get(SECTION, semester, stamp) is None
+    snap.close()  # closing twice is harmless
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.snap'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        gradebook.GradebookSnapshot(str(path))
+
+def test_result_sheets_terms_first():
+    assert gradebook.result_sheets(['Ave', 'S10', 'Notes', 'S2', 'S1']) == ('S1', 'S2', 'S10', 'Ave')
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+SHEETS = [('4A', 'S1'), ('4A', 'S2'), ('4B', 'S1'), ('4B', 'S2')]
+
+@pytest.fixture
+def sizes(core, in_repo):
+    # Approximate size of each test sheet, from a cache big enough for all of them
+    cache = core.GradebookCache(1 << 30)
+    return {key: cache.get(*key).size for key in SHEETS}
+
+def test_repeat_lookup_is_a_hit(core, in_repo):
+    cache = core.GradebookCache(1 << 30)
+    sheet = cache.get('4A', 'S1')
+    assert cache.get('4A', 'S1') is sheet
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    assert stats['bytes'] == sheet.size > 0
+
+def test_bounded_by_bytes_least_recently_used_first(core, in_repo, sizes):
+    # Room for three of the four sheets
+    cache = core.GradebookCache(sum(sizes.values()) - min(sizes.values()) // 2)
+    for key in SHEETS[:3]:
+        cache.get(*key)
+    cache.get(*SHEETS[0])  # touch the oldest, so the second is evicted next
+    cache.get(*SHEETS[3])
+    stats = cache.stats()
+    assert stats['bytes'] <= stats['max_bytes']
+    assert stats['evictions'] >= 1
+    assert stats['bytes'] == sum(sizes[key] for key in cache._entries)
+    assert SHEETS[1] not in cache._entries
+    assert SHEETS[0] in cache._entries and SHEETS[3] in cache._entries
+
+def test_newest_sheet_is_kept_even_over_the_bound(core, in_repo):
+    cache = core.GradebookCache(1)
+    cache.get('4A', 'S1')
+    cache.get('4A', 'S2')
+    assert list(cache._entries) == [('4A', 'S2')]
+    assert cache.stats()['evictions'] == 1
+
+def test_publish_grows_the_bound_to_fit_the_dataset(core, in_repo, sizes):
+    loaded = core.GradebookCache(1 << 30)
+    sheets = {key: loaded.get(*key) for key in SHEETS}
+    cache = core.GradebookCache(1)
+    cache.publish(sheets, replace=True)
+    stats = cache.stats()
+    assert stats['entries'] == len(SHEETS)
+    assert stats['bytes'] == stats['max_bytes'] == sum(sizes.values())
+    assert cache.get('4B', 'S2') is sheets[('4B', 'S2')]
+
+def test_concurrent_misses_load_once(core, in_repo):
+    cache = core.GradebookCache(1 << 30)
+    start = threading.Barrier(8)
+    loaded = []
+
+    def lookup():
+        start.wait()
+        loaded.append(cache.get('4A', 'Ave'))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] + stats['coalesced'] == 7
+    assert all(sheet is loaded[0] for sheet in loaded)
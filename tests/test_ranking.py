@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+def term_row(no, name, average):
+    row = [None] * 18
+    row[1], row[3], row[16] = no, name, average
+    return tuple(row)
+
+def summary_row(no, name, average):
+    row = [None] * 18
+    row[1], row[2], row[14] = no, name, average
+    return tuple(row)
+
+def test_term_sheet_ranks_by_its_average_column(core):
+    ws = SimpleNamespace(rows=(term_row(1, 'Abebe', 77.25), term_row(2, 'Sara', 91), term_row(3, 'Kebede', 66)))
+    assert core.rank_sheet(ws, '4A', 'S1') == [
+        (-91.0, '4A', 1, '2', 'Sara'),
+        (-77.25, '4A', 0, '1', 'Abebe'),
+        (-66.0, '4A', 2, '3', 'Kebede')
+    ]
+
+def test_summary_sheet_ranks_by_its_average_column(core):
+    ws = SimpleNamespace(rows=(summary_row(1, 'Abebe', 75.6875), summary_row(2, 'Sara', 62.3125)))
+    assert core.rank_sheet(ws, '4A', 'Ave') == [
+        (-75.6875, '4A', 0, '1', 'Abebe'),
+        (-62.3125, '4A', 1, '2', 'Sara')
+    ]
+
+def test_rows_without_a_number_or_average_are_unranked(core):
+    ws = SimpleNamespace(rows=(term_row(None, 'Empty', 80), term_row(2, 'Absent', None), term_row(3, 'Text', 'abs'),
+                               term_row(4, 'Ranked', '70')))
+    assert core.rank_sheet(ws, '4A', 'S2') == [(-70.0, '4A', 3, '4', 'Ranked')]
+
+@pytest.mark.parametrize('semester, name_col, avg_col', [('S1', 3, 16), ('S2', 3, 16), ('Ave', 2, 14)])
+def test_real_sheets_rank_by_the_right_columns(core, in_repo, semester, name_col, avg_col):
+    ws = core.load_sheet('4A', semester)
+    entries = core.rank_sheet(ws, '4A', semester)
+    assert entries
+    assert entries == sorted(entries)
+    for average, grade_section, offset, student_no, name in entries:
+        row = ws.rows[offset]
+        assert (-average, student_no, name) == (float(row[avg_col]), str(row[1]).strip(), row[name_col])
+
+def test_ranking_positions_share_tied_ranks(core):
+    ranking = core.Ranking(1, sorted([(-90.0, '4A', 0, '1', 'A'), (-90.0, '4B', 0, '1', 'B'), (-80.0, '4A', 1, '2', 'C')]))
+    assert ranking.position('4A', 1)[:2] == (1, 3)
+    assert ranking.position('4B', '1')[:2] == (1, 3)
+    assert ranking.position('4A', '2')[:2] == (3, 3)
+    assert ranking.position('4A', '9') is None
+    assert [e[4] for e in ranking.top(2)] == ['A', 'B']
@@ -0,0 +1,91 @@
+import pytest
+from telebot import apihelper
+
+import ratelimit
+from ratelimit import OutboundLimiter, TokenBucket
+
+def too_many_requests(retry_after):
+    return apihelper.ApiTelegramException('sendMessage', None, {
+        'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': retry_after}
+    })
+
+def test_token_bucket_starts_full_and_refills_to_capacity():
+    bucket = TokenBucket(2.0, 3, now=100.0)
+    assert bucket.tokens == 3
+    assert bucket.wait_time() == 0.0
+    bucket.tokens = 0
+    assert bucket.wait_time() == pytest.approx(0.5)
+    bucket.refill(100.25)
+    assert bucket.tokens == pytest.approx(0.5)
+    assert bucket.wait_time() == pytest.approx(0.25)
+    bucket.refill(200.0)
+    assert bucket.tokens == 3
+
+def test_chat_burst_then_chat_wait():
+    limiter = OutboundLimiter(global_rate=100, chat_rate=1.0, chat_burst=3)
+    for _ in range(3):
+        assert limiter.try_acquire('1', 'reply') == (0.0, False)
+    wait, on_global = limiter.try_acquire('1', 'reply')
+    assert 0 < wait <= 1.0
+    assert not on_global  # the chat's own limit, not a priority wait
+    assert limiter.try_acquire('2', 'reply') == (0.0, False)  # other chats are unaffected
+
+def test_global_wait_counts_the_lane_as_waiting():
+    limiter = OutboundLimiter(global_rate=2, chat_rate=100, chat_burst=100)
+    assert limiter.try_acquire('1', 'reply') == (0.0, False)
+    assert limiter.try_acquire('2', 'reply') == (0.0, False)
+    wait, on_global = limiter.try_acquire('3', 'reply')
+    assert wait > 0 and on_global
+    assert limiter.stats()['waiting']['reply'] == 1
+    limiter._give_up_waiting('reply', on_global)
+    assert limiter.stats()['waiting']['reply'] == 0
+
+def test_global_waiter_holds_back_lower_lanes():
+    limiter = OutboundLimiter(global_rate=2, chat_rate=100, chat_burst=100)
+    limiter.try_acquire('1', 'reply')
+    limiter.try_acquire('2', 'reply')
+    _, on_global = limiter.try_acquire('3', 'reply')
+    assert on_global
+    limiter._global.tokens = 2  # tokens are back, but a reply is still queued for one
+    wait, on_global = limiter.try_acquire('4', 'broadcast')
+    assert wait > 0 and on_global
+    # The reply waiter itself goes first and stops counting as waiting
+    assert limiter.try_acquire('3', 'reply', waiting=True) == (0.0, False)
+    assert limiter.stats()['waiting'] == {'reply': 0, 'admin': 0, 'cosmetic': 0, 'broadcast': 1}
+    assert limiter.try_acquire('4', 'broadcast', waiting=True) == (0.0, False)
+
+def test_chat_limited_reply_does_not_hold_back_lower_lanes():
+    limiter = OutboundLimiter(global_rate=100, chat_rate=1.0, chat_burst=1)
+    assert limiter.try_acquire('1', 'reply') == (0.0, False)
+    wait, on_global = limiter.try_acquire('1', 'reply')
+    assert wait > 0 and not on_global
+    assert limiter.try_acquire('2', 'broadcast') == (0.0, False)
+
+def test_429_pauses_only_that_chat():
+    limiter = OutboundLimiter(global_rate=100, chat_rate=100, chat_burst=100)
+    assert limiter._retry_delay(too_many_requests(5), '1', attempt=0) == 5
+    wait, on_global = limiter.try_acquire('1', 'reply')
+    assert 4 < wait <= 5 and not on_global
+    assert limiter.try_acquire('2', 'broadcast') == (0.0, False)
+    assert limiter.stats()['retried'] == 1
+
+def test_call_retries_429_then_gives_up(monkeypatch):
+    monkeypatch.setattr(ratelimit.time, 'sleep', lambda seconds: None)
+    limiter = OutboundLimiter(global_rate=100, chat_rate=100, chat_burst=100, max_retries=2)
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        raise too_many_requests(0)
+
+    with pytest.raises(apihelper.ApiTelegramException):
+        limiter.call('sendMessage', {'chat_id': 1}, send)
+    assert len(attempts) == 3
+    assert limiter.stats()['retried'] == 2
+    assert limiter.stats()['failed'] == 1
+
+def test_lane_for():
+    assert ratelimit.lane_for('sendMessage') == 'reply'
+    assert ratelimit.lane_for('deleteMessage') == 'cosmetic'
+    with ratelimit.outbound_lane('broadcast'):
+        assert ratelimit.lane_for('sendMessage') == 'broadcast'
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import Scheduler
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler('test-scheduler')
+    yield scheduler
+    scheduler.stop()
+
+def run_marker(scheduler, delay, ran, name):
+    done = threading.Event()
+    scheduler.call_later(delay, lambda: (ran.append(name), done.set()), name=name)
+    return done
+
+def test_runs_in_due_order(scheduler):
+    ran = []
+    last = run_marker(scheduler, 0.06, ran, 'late')
+    run_marker(scheduler, 0.02, ran, 'early')
+    run_marker(scheduler, 0.02, ran, 'early too')  # same due time: submission order
+    assert last.wait(2)
+    assert ran == ['early', 'early too', 'late']
+    assert scheduler.executed == 3
+
+def test_cancelled_task_never_runs(scheduler):
+    ran = []
+    task = scheduler.call_later(0.02, ran.append, 'cancelled', name='cancelled')
+    kept = run_marker(scheduler, 0.05, ran, 'kept')
+    assert scheduler.pending_by_name() == {'cancelled': 1, 'kept': 1}
+    task.cancel()
+    assert scheduler.pending() == 1
+    assert scheduler.pending_by_name() == {'kept': 1}
+    assert kept.wait(2)
+    time.sleep(0.05)
+    assert ran == ['kept']
+    assert scheduler.executed == 1
+
+def test_cancelled_head_does_not_hold_back_later_tasks(scheduler):
+    ran = []
+    scheduler.call_later(30, ran.append, 'far', name='far').cancel()
+    assert run_marker(scheduler, 0.02, ran, 'near').wait(2)
+    assert ran == ['near']
+
+def test_failing_task_is_counted_and_dropped(scheduler):
+    ran = []
+    scheduler.call_later(0.01, lambda: 1 / 0, name='broken')
+    assert run_marker(scheduler, 0.03, ran, 'after').wait(2)
+    assert scheduler.failed == 1
+    assert ran == ['after']
+    assert scheduler.pending() == 0
+
+def test_stopped_scheduler_runs_nothing_more(scheduler):
+    ran = []
+    scheduler.call_later(0.05, ran.append, 'late', name='late')
+    scheduler.stop()
+    time.sleep(0.1)
+    assert ran == []
@@ -0,0 +1,162 @@
+import json
+import os
+import time
+
+import pytest
+
+from user_store import JournalUserStore, PinTaken, StudentTaken, UserStore, open_user_store
+
+@pytest.fixture(params=['sqlite', 'journal'])
+def store(request, tmp_path):
+    store = open_user_store(request.param, str(tmp_path / 'users.db'), str(tmp_path / 'user_events.jsonl'),
+                            str(tmp_path / 'user_state.json'), 1 << 20)
+    yield store
+    store.close()
+
+def test_register_then_read_back(store):
+    store.register('100', '4A', '7', '123456', 'am')
+    user = store.get_user('100')
+    assert (user['grade_section'], user['student_no'], user['pin'], user['language']) == ('4A', '7', '123456', 'am')
+    assert store.get_pin('123456') == {'pin': '123456', 'grade_section': '4A', 'student_no': '7', 'telegram_id': '100'}
+    assert store.student_taken('4A', '7')
+    assert not store.student_taken('4A', '8')
+    assert store.pin_exists('123456')
+    assert store.get_language('100') == 'am'
+    assert store.counts() == {'users': 1, 'pins': 1}
+
+def test_register_taken_student(store):
+    store.register('100', '4A', '7', '123456', 'en')
+    with pytest.raises(StudentTaken):
+        store.register('200', '4A', '7', '654321', 'en')
+    assert store.get_user('200') is None
+    assert not store.pin_exists('654321')
+
+def test_register_taken_pin(store):
+    store.register('100', '4A', '7', '123456', 'en')
+    with pytest.raises(PinTaken):
+        store.register('200', '4A', '8', '123456', 'en')
+    assert not store.student_taken('4A', '8')
+    assert store.get_pin('123456')['telegram_id'] == '100'
+
+def test_taken_student_wins_over_taken_pin(store):
+    store.register('100', '4A', '7', '123456', 'en')
+    with pytest.raises(StudentTaken):
+        store.register('200', '4A', '7', '123456', 'en')
+
+def test_language_before_registration_is_kept_apart(store):
+    assert store.get_language('300') == 'en'
+    store.set_language('300', 'am')
+    assert store.get_language('300') == 'am'
+    assert store.get_user('300')['grade_section'] is None
+    assert store.registered_users() == []
+
+def test_login_takes_over_the_pin_owner(store):
+    store.register('100', '4A', '7', '123456', 'en')
+    store.login('200', store.get_pin('123456'), 'am')
+    user = store.get_user('200')
+    assert (user['grade_section'], user['student_no'], user['language']) == ('4A', '7', 'am')
+    assert sorted(u['telegram_id'] for u in store.registered_users()) == ['100', '200']
+
+def test_migrate_json_normalises_student_numbers(tmp_path):
+    mapping = tmp_path / 'user_mapping.json'
+    identifiers = tmp_path / 'student_identifiers.json'
+    mapping.write_text(json.dumps({'users': {'100': {'grade_section': '4A', 'student_no': 7, 'pin': '123456', 'language': 'am'}}}))
+    identifiers.write_text(json.dumps({'123456': {'grade_section': '4A', 'student_no': 7, 'telegram_id': 100}}))
+    store = UserStore(str(tmp_path / 'users.db'))
+    try:
+        assert store.migrate_json(str(mapping), str(identifiers)) == (1, 1)
+        assert store.student_taken('4A', '7')
+        assert store.get_user('100')['student_no'] == '7'
+        assert store.get_pin('123456')['telegram_id'] == '100'
+        assert store.migrate_json(str(mapping), str(identifiers)) is None  # only once
+    finally:
+        store.close()
+
+# --- Journal store ---
+def open_journal(tmp_path, compact_bytes=1 << 20):
+    return JournalUserStore(str(tmp_path / 'user_events.jsonl'), str(tmp_path / 'user_state.json'), compact_bytes)
+
+def wait_for_compaction(store, timeout=5):
+    deadline = time.monotonic() + timeout
+    while store._compacting:
+        assert time.monotonic() < deadline, "compaction did not finish"
+        time.sleep(0.01)
+
+def fill(store):
+    store.register('100', '4A', '7', '123456', 'en')
+    store.set_language('100', 'am')
+    store.set_language('300', 'am')
+    store.login('200', store.get_pin('123456'), 'en')
+
+def state(store):
+    return store.users, store.pins, store.students, store.seq
+
+def test_journal_replays_on_reopen(tmp_path):
+    store = open_journal(tmp_path)
+    fill(store)
+    expected = state(store)
+    store.close()
+    reopened = open_journal(tmp_path)
+    try:
+        assert state(reopened) == expected
+        with pytest.raises(StudentTaken):
+            reopened.register('400', '4A', '7', '111111', 'en')
+    finally:
+        reopened.close()
+
+def test_journal_skips_a_torn_final_line(tmp_path):
+    store = open_journal(tmp_path)
+    fill(store)
+    expected = state(store)
+    store.close()
+    with open(tmp_path / 'user_events.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"op": "register", "telegram_id": "5')
+    reopened = open_journal(tmp_path)
+    try:
+        assert state(reopened) == expected
+        reopened.set_language('500', 'am')  # appends after the dropped tail
+    finally:
+        reopened.close()
+    again = open_journal(tmp_path)
+    try:
+        assert again.get_language('500') == 'am'
+    finally:
+        again.close()
+
+def test_journal_compaction_then_replay(tmp_path):
+    store = open_journal(tmp_path, compact_bytes=200)
+    fill(store)  # crosses compact_bytes, so the journal is rotated and snapshotted
+    wait_for_compaction(store)
+    assert os.path.exists(tmp_path / 'user_state.json')
+    assert not os.path.exists(tmp_path / 'user_events.jsonl.compacting')
+    store.register('600', '4B', '3', '222222', 'am')  # lands in the fresh journal after the snapshot
+    wait_for_compaction(store)
+    expected = state(store)
+    store.close()
+
+    reopened = open_journal(tmp_path)
+    try:
+        assert state(reopened) == expected
+        assert reopened.get_user('600')['pin'] == '222222'
+    finally:
+        reopened.close()
+
+def test_journal_finishes_an_interrupted_compaction(tmp_path):
+    store = open_journal(tmp_path)
+    fill(store)
+    expected = state(store)
+    store.close()
+    # A crash after the rotation but before the snapshot was written
+    os.replace(tmp_path / 'user_events.jsonl', tmp_path / 'user_events.jsonl.compacting')
+    reopened = open_journal(tmp_path)
+    try:
+        wait_for_compaction(reopened)
+        assert state(reopened) == expected
+        assert not os.path.exists(tmp_path / 'user_events.jsonl.compacting')
+    finally:
+        reopened.close()
+    again = open_journal(tmp_path)
+    try:
+        assert state(again) == expected
+    finally:
+        again.close()
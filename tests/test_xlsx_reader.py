@@ -0,0 +1,54 @@
+import glob
+import os
+
+import openpyxl
+import pytest
+
+import gradebook
+import xlsx_reader
+from conftest import REPO
+
+WORKBOOKS = sorted(glob.glob(os.path.join(REPO, 'data', '*.xlsx')))
+
+def openpyxl_sheets(path, names):
+    # What the bot read before xlsx_reader: cached values of the same row window
+    wb = openpyxl.load_workbook(path, data_only=True)
+    try:
+        sheets = {}
+        for name in names:
+            ws = wb[name]
+            rows = tuple(ws.iter_rows(min_row=gradebook.DATA_START_ROW, max_row=gradebook.DATA_END_ROW,
+                                      max_col=gradebook.DATA_MAX_COL, values_only=True))
+            sheets[name] = (name, ws.max_column, rows)
+        return sheets
+    finally:
+        wb.close()
+
+@pytest.mark.parametrize('path', WORKBOOKS, ids=os.path.basename)
+def test_read_sheets_matches_openpyxl(path):
+    names = gradebook.result_sheets(xlsx_reader.sheet_names(path))
+    assert names
+    assert gradebook.read_sheets(path, names) == openpyxl_sheets(path, names)
+
+def test_sheet_names_in_workbook_order():
+    path = WORKBOOKS[0]
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        assert xlsx_reader.sheet_names(path) == wb.sheetnames
+    finally:
+        wb.close()
+
+def test_read_sheets_skips_missing_sheets():
+    sheets = xlsx_reader.read_sheets(WORKBOOKS[0], ['no such sheet'], 1, 2, 3)
+    assert sheets == {}
+
+def test_read_sheet_pads_the_window():
+    path = WORKBOOKS[0]
+    name = gradebook.result_sheets(xlsx_reader.sheet_names(path))[0]
+    # Rows past the end of the sheet come back as full-width rows of None
+    _, _, rows = xlsx_reader.read_sheets(path, [name], 10000, 10001, 4)[name]
+    assert rows == ((None,) * 4, (None,) * 4)
+
+@pytest.mark.parametrize('letters, index', [('A', 1), ('Z', 26), ('AA', 27), ('AZ', 52), ('XFD', 16384)])
+def test_column_index(letters, index):
+    assert xlsx_reader.column_index(letters) == index
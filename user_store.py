@@ -0,0 +1,422 @@
+import os
+import json
+import logging
+import sqlite3
+import threading
+
+# === User Store ===
+# Registered users and their PINs live in one SQLite database (WAL mode) instead
+# of user_mapping.json / student_identifiers.json. Users are keyed by telegram_id,
+# PINs by pin, and a unique index on (grade_section, student_no) guarantees a
+# student can only be claimed once. Every write is a single transaction, so
+# concurrent handlers can no longer interleave full-file rewrites.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    telegram_id   TEXT PRIMARY KEY,
+    grade_section TEXT,
+    student_no    TEXT,
+    pin           TEXT,
+    language      TEXT NOT NULL DEFAULT 'en'
+);
+CREATE TABLE IF NOT EXISTS pins (
+    pin           TEXT PRIMARY KEY,
+    grade_section TEXT NOT NULL,
+    student_no    TEXT NOT NULL,
+    telegram_id   TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS pins_student ON pins (grade_section, student_no);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class StudentTaken(ValueError):
+    pass
+
+class PinTaken(ValueError):
+    pass
+
+def student_key(student_no):
+    # Student numbers are stored as text; legacy JSON may hold them as numbers
+    return str(student_no) if student_no is not None else None
+
+class UserStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _one(self, sql, params):
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def _transaction(self, statements):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    # --- Reads ---
+    def get_user(self, telegram_id):
+        return self._one('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
+
+    def get_language(self, telegram_id):
+        user = self._one('SELECT language FROM users WHERE telegram_id = ?', (telegram_id,))
+        return user['language'] if user else 'en'
+
+    def get_pin(self, pin):
+        return self._one('SELECT * FROM pins WHERE pin = ?', (pin,))
+
+    def pin_exists(self, pin):
+        return self._one('SELECT 1 AS found FROM pins WHERE pin = ?', (pin,)) is not None
+
+    def student_taken(self, grade_section, student_no):
+        return self._one(
+            'SELECT 1 AS found FROM pins WHERE grade_section = ? AND student_no = ?',
+            (grade_section, student_no)
+        ) is not None
+
+    def registered_users(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM users WHERE grade_section IS NOT NULL').fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            users = self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            pins = self._conn.execute('SELECT COUNT(*) FROM pins').fetchone()[0]
+        return {'users': users, 'pins': pins}
+
+    # --- Writes ---
+    def register(self, telegram_id, grade_section, student_no, pin, language):
+        try:
+            self._transaction([
+                ('INSERT INTO pins (pin, grade_section, student_no, telegram_id) VALUES (?, ?, ?, ?)',
+                 (pin, grade_section, student_no, telegram_id)),
+                ('INSERT INTO users (telegram_id, grade_section, student_no, pin, language) VALUES (?, ?, ?, ?, ?) '
+                 'ON CONFLICT (telegram_id) DO UPDATE SET grade_section = excluded.grade_section, '
+                 'student_no = excluded.student_no, pin = excluded.pin, language = excluded.language',
+                 (telegram_id, grade_section, student_no, pin, language))
+            ])
+        except sqlite3.IntegrityError as e:
+            # Either unique key can collide; anything else is not ours to rename
+            if self.student_taken(grade_section, student_no):
+                raise StudentTaken(f"Student {student_no} in {grade_section} is already registered") from e
+            if self.pin_exists(pin):
+                raise PinTaken(f"PIN {pin} is already in use") from e
+            raise
+
+    def login(self, telegram_id, pin_data, language):
+        self._transaction([
+            ('INSERT INTO users (telegram_id, grade_section, student_no, pin, language) VALUES (?, ?, ?, ?, ?) '
+             'ON CONFLICT (telegram_id) DO UPDATE SET grade_section = excluded.grade_section, '
+             'student_no = excluded.student_no, pin = excluded.pin, language = excluded.language',
+             (telegram_id, pin_data['grade_section'], pin_data['student_no'], pin_data['pin'], language))
+        ])
+
+    def set_language(self, telegram_id, language):
+        self._transaction([
+            ('INSERT INTO users (telegram_id, language) VALUES (?, ?) '
+             'ON CONFLICT (telegram_id) DO UPDATE SET language = excluded.language',
+             (telegram_id, language))
+        ])
+
+    # --- One-shot JSON Migration ---
+    def migrate_json(self, user_mapping_file, identifiers_file):
+        # Imports the legacy JSON files once; later runs are no-ops even if the
+        # files are still on disk.
+        if self._one("SELECT value FROM meta WHERE key = 'json_migrated'", ()) is not None:
+            return None
+        users = load_json(user_mapping_file).get('users', {})
+        identifiers = load_json(identifiers_file)
+        statements = []
+        for pin, data in identifiers.items():
+            statements.append((
+                'INSERT OR IGNORE INTO pins (pin, grade_section, student_no, telegram_id) VALUES (?, ?, ?, ?)',
+                (pin, data['grade_section'], student_key(data['student_no']), str(data['telegram_id']))
+            ))
+        for telegram_id, data in users.items():
+            statements.append((
+                'INSERT OR REPLACE INTO users (telegram_id, grade_section, student_no, pin, language) VALUES (?, ?, ?, ?, ?)',
+                (telegram_id, data.get('grade_section'), student_key(data.get('student_no')), data.get('pin'), data.get('language', 'en'))
+            ))
+        statements.append(("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (f"{len(users)} users, {len(identifiers)} pins",)))
+        self._transaction(statements)
+        logging.info(f"Migrated {len(users)} users and {len(identifiers)} PINs from JSON into {self.path}")
+        return len(users), len(identifiers)
+
+# === Journal User Store ===
+# Lighter alternative to SQLite: registration, login and language changes are
+# appended as JSON lines to an event journal, and live state is kept in memory.
+# At startup the state is rebuilt from the last compacted snapshot plus every
+# journal event with a higher sequence number. Once the journal grows past
+# compact_bytes it is rotated aside and a background thread writes a new
+# snapshot (write-temp + rename) before discarding the rotated journal, so a
+# crash at any point leaves either the old or the new snapshot plus a journal
+# that replays on top of it.
+
+class JournalUserStore:
+    def __init__(self, journal_path, snapshot_path, compact_bytes=1 << 20):
+        self.path = journal_path
+        self.snapshot_path = snapshot_path
+        self.compact_bytes = compact_bytes
+        self._rotated_path = f"{journal_path}.compacting"
+        self._lock = threading.Lock()
+        self._compacting = False
+        self.users = {}
+        self.pins = {}
+        self.students = {}
+        self.meta = {}
+        self.seq = 0
+        self._load()
+        truncate_torn_tail(self.path)
+        self._journal = open(self.path, 'a', encoding='utf-8')
+        if os.path.exists(self._rotated_path):
+            self._start_compaction()  # finish a compaction interrupted by a crash
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+
+    # --- Recovery ---
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.seq = snapshot['seq']
+            self.users = snapshot['users']
+            self.pins = snapshot['pins']
+            self.meta = snapshot.get('meta', {})
+            for pin, data in self.pins.items():
+                self.students[(data['grade_section'], data['student_no'])] = pin
+        replayed = 0
+        for path in (self._rotated_path, self.path):
+            for event in read_events(path):
+                if event['seq'] > self.seq:
+                    self._apply(event)
+                    self.seq = event['seq']
+                    replayed += 1
+        logging.info(f"Loaded {len(self.users)} users and {len(self.pins)} PINs from {self.snapshot_path} + {replayed} journal events")
+
+    def _apply(self, event):
+        op = event['op']
+        telegram_id = event['telegram_id']
+        if op == 'register':
+            pin = event['pin']
+            self.pins[pin] = {
+                'grade_section': event['grade_section'],
+                'student_no': event['student_no'],
+                'telegram_id': telegram_id
+            }
+            self.students[(event['grade_section'], event['student_no'])] = pin
+            self.users[telegram_id] = {
+                'grade_section': event['grade_section'],
+                'student_no': event['student_no'],
+                'pin': pin,
+                'language': event['language']
+            }
+        elif op == 'login':
+            self.users[telegram_id] = {
+                'grade_section': event['grade_section'],
+                'student_no': event['student_no'],
+                'pin': event['pin'],
+                'language': event['language']
+            }
+        elif op == 'language':
+            self.users.setdefault(telegram_id, {
+                'grade_section': None,
+                'student_no': None,
+                'pin': None
+            })['language'] = event['language']
+        else:
+            logging.warning(f"Unknown journal event {op!r} in {self.path}; ignored")
+
+    # --- Reads ---
+    def get_user(self, telegram_id):
+        with self._lock:
+            user = self.users.get(telegram_id)
+            return dict(user, telegram_id=telegram_id) if user is not None else None
+
+    def get_language(self, telegram_id):
+        with self._lock:
+            return self.users.get(telegram_id, {}).get('language', 'en')
+
+    def get_pin(self, pin):
+        with self._lock:
+            data = self.pins.get(pin)
+            return dict(data, pin=pin) if data is not None else None
+
+    def pin_exists(self, pin):
+        with self._lock:
+            return pin in self.pins
+
+    def student_taken(self, grade_section, student_no):
+        with self._lock:
+            return (grade_section, student_no) in self.students
+
+    def registered_users(self):
+        with self._lock:
+            return [dict(user, telegram_id=telegram_id) for telegram_id, user in self.users.items() if user['grade_section']]
+
+    def counts(self):
+        with self._lock:
+            return {'users': len(self.users), 'pins': len(self.pins)}
+
+    # --- Writes ---
+    def _append(self, event):
+        # Caller holds the lock; the event is durable before state changes
+        event['seq'] = self.seq + 1
+        self._journal.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.seq = event['seq']
+        self._apply(event)
+        if self._journal.tell() >= self.compact_bytes and not self._compacting:
+            self._start_compaction()
+
+    def register(self, telegram_id, grade_section, student_no, pin, language):
+        with self._lock:
+            if (grade_section, student_no) in self.students:
+                raise StudentTaken(f"Student {student_no} in {grade_section} is already registered")
+            if pin in self.pins:
+                raise PinTaken(f"PIN {pin} is already in use")
+            self._append({
+                'op': 'register', 'telegram_id': telegram_id, 'grade_section': grade_section,
+                'student_no': student_no, 'pin': pin, 'language': language
+            })
+
+    def login(self, telegram_id, pin_data, language):
+        with self._lock:
+            self._append({
+                'op': 'login', 'telegram_id': telegram_id, 'grade_section': pin_data['grade_section'],
+                'student_no': pin_data['student_no'], 'pin': pin_data['pin'], 'language': language
+            })
+
+    def set_language(self, telegram_id, language):
+        with self._lock:
+            self._append({'op': 'language', 'telegram_id': telegram_id, 'language': language})
+
+    # --- Compaction ---
+    def _start_compaction(self):
+        # Caller holds the lock (or is __init__). Rotates the live journal aside
+        # so appends continue into a fresh file while the snapshot is written.
+        self._compacting = True
+        if not os.path.exists(self._rotated_path):
+            self._journal.close()
+            os.replace(self.path, self._rotated_path)
+            self._journal = open(self.path, 'a', encoding='utf-8')
+        state = {
+            'seq': self.seq,
+            'users': {k: dict(v) for k, v in self.users.items()},
+            'pins': {k: dict(v) for k, v in self.pins.items()},
+            'meta': dict(self.meta)
+        }
+        threading.Thread(target=self._compact, args=(state,), name='journal-compaction', daemon=True).start()
+
+    def _compact(self, state):
+        try:
+            write_json_atomic(self.snapshot_path, state)
+            os.remove(self._rotated_path)
+            logging.info(f"Compacted {self.path} into {self.snapshot_path} at seq {state['seq']}")
+        except OSError as e:
+            logging.error(f"Journal compaction failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        with self._lock:
+            if self._compacting:
+                return False
+            self._start_compaction()
+            return True
+
+    # --- One-shot JSON Migration ---
+    def migrate_json(self, user_mapping_file, identifiers_file):
+        with self._lock:
+            if self.meta.get('json_migrated') or self.seq or self.users:
+                return None
+            users = load_json(user_mapping_file).get('users', {})
+            identifiers = load_json(identifiers_file)
+            for pin, data in identifiers.items():
+                key = (data['grade_section'], student_key(data['student_no']))
+                if key in self.students:
+                    continue
+                self.pins[pin] = {'grade_section': key[0], 'student_no': key[1], 'telegram_id': str(data['telegram_id'])}
+                self.students[key] = pin
+            for telegram_id, data in users.items():
+                self.users[telegram_id] = {
+                    'grade_section': data.get('grade_section'),
+                    'student_no': student_key(data.get('student_no')),
+                    'pin': data.get('pin'),
+                    'language': data.get('language', 'en')
+                }
+            self.meta['json_migrated'] = f"{len(users)} users, {len(identifiers)} pins"
+            write_json_atomic(self.snapshot_path, {'seq': self.seq, 'users': self.users, 'pins': self.pins, 'meta': self.meta})
+        logging.info(f"Migrated {len(users)} users and {len(identifiers)} PINs from JSON into {self.snapshot_path}")
+        return len(users), len(identifiers)
+
+def read_events(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-append is expected; skip it
+                logging.warning(f"Skipping unreadable journal line {line_no} in {path}")
+
+def truncate_torn_tail(path):
+    # Drops a partial last line so the next append starts on a fresh line
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+            logging.warning(f"Truncated a torn final line in {path}")
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def open_user_store(backend, db_path, journal_path, snapshot_path, compact_bytes):
+    if backend == 'journal':
+        return JournalUserStore(journal_path, snapshot_path, compact_bytes)
+    if backend == 'sqlite':
+        return UserStore(db_path)
+    raise ValueError(f"Unknown USER_STORE backend {backend!r}; use 'sqlite' or 'journal'")
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        logging.error(f"Error parsing {path}; skipped during migration")
+        return {}
@@ -0,0 +1,144 @@
+import sys
+import json
+import hmac
+import logging
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+# === Webhook Ingestion ===
+# A small HTTP server that receives Telegram updates pushed to WEBHOOK_PATH,
+# checks the X-Telegram-Bot-Api-Secret-Token header, answers 200 straight away
+# and only then hands the update to the bot's dispatcher (telebot's worker pool
+# in the sync runtime, the event loop in the async one). Slow sheet lookups can
+# therefore never make Telegram time out and redeliver. GET on any path is a
+# health check for load balancers.
+#
+# Replaying recorded updates against a local server:
+#   python webhook.py post updates.jsonl --url http://127.0.0.1:8443/telegram --secret <secret>
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_UPDATE_BYTES = 1 << 20
+
+class WebhookServer:
+    def __init__(self, host, port, path, secret, dispatch, raw=False):
+        self.path = path
+        self.secret = secret or ''
+        self.dispatch = dispatch
+        self.raw = raw  # dispatch the decoded JSON dict instead of a types.Update
+        self.received = 0
+        self.rejected = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def serve_forever(self):
+        host, port = self.address
+        logging.info(f"Webhook server listening on {host}:{port}{self.path}")
+        self._server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='webhook-server', daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.reply(200, b'ok')
+
+            def do_POST(self):
+                if self.path.split('?', 1)[0] != webhook.path:
+                    self.reply(404)
+                    return
+                if webhook.secret and not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), webhook.secret):
+                    webhook.rejected += 1
+                    logging.warning(f"Rejected webhook call from {self.client_address[0]}: bad secret token")
+                    self.reply(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_UPDATE_BYTES:
+                    self.reply(400)
+                    return
+                try:
+                    body = self.rfile.read(length).decode('utf-8')
+                    update = json.loads(body) if webhook.raw else types.Update.de_json(body)
+                    if webhook.raw and not isinstance(update, dict):
+                        raise ValueError("update is not a JSON object")
+                except (ValueError, KeyError) as e:
+                    logging.error(f"Malformed webhook update: {str(e)}")
+                    self.reply(400)
+                    return
+                # Acknowledge first so Telegram never waits on (or redelivers for) a slow handler
+                self.reply(200)
+                webhook.received += 1
+                try:
+                    webhook.dispatch(update)
+                except Exception:
+                    logging.exception(f"Failed to dispatch update {update.get('update_id') if webhook.raw else update.update_id}")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def register_webhook(bot, url, path, secret):
+    # Points Telegram at the public URL; without one the server still accepts
+    # updates (e.g. behind a proxy that registered the hook elsewhere)
+    if not url:
+        logging.warning("WEBHOOK_URL is not set; not calling setWebhook")
+        return
+    bot.remove_webhook()
+    bot.set_webhook(url=url.rstrip('/') + path, secret_token=secret or None)
+    logging.info(f"Webhook registered at {url.rstrip('/')}{path}")
+
+# === Replay Recorded Updates ===
+def post_updates(path, url, secret):
+    sent = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(url, data=line.strip().encode('utf-8'), method='POST')
+            request.add_header('Content-Type', 'application/json')
+            if secret:
+                request.add_header(SECRET_HEADER, secret)
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            sent += 1
+    print(f"Posted {sent} updates to {url}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook helper utilities.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    post = sub.add_parser('post', help="POST recorded updates (one JSON object per line) to a webhook server")
+    post.add_argument('file')
+    post.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    post.add_argument('--secret', default='')
+    args = parser.parse_args()
+    return post_updates(args.file, args.url, args.secret)
+
+if __name__ == '__main__':
+    sys.exit(main())
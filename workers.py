@@ -0,0 +1,262 @@
+import os
+import sys
+import time
+import queue
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+
+from telebot import apihelper, types
+
+import audit
+
+# === Sharded Worker Processes ===
+# Usage:
+#   python workers.py --workers 4
+#
+# One supervisor process receives updates (long polling or the webhook server,
+# per UPDATE_MODE) and routes each one to a worker process by chat_id, so all
+# updates of a chat are handled by the same worker, in order. Inside a worker,
+# chats are spread over BOT_WORKER_THREADS lanes that each run handlers one
+# update at a time, which keeps per-chat order there too while slow Bot API
+# round trips of different chats overlap. Expensive requests are admitted or
+# refused (bot.admit_update) as the worker takes them off its queue; an
+# admitted one reaches its lane when an admission slot frees up, so later
+# ungated updates of its chat may run first.
+#
+# Shared state:
+# - Users and PINs live in the SQLite store (WAL), which every worker opens;
+#   the journal store is single-process and is refused here.
+# - Gradebooks come from the mmap snapshot, compiled by the supervisor at
+#   start and whenever a workbook changes, so workers decode sheets from
+#   shared pages instead of each parsing XLSX files.
+# - Log lines and audit records go over one queue to the supervisor, which is
+#   the only writer of bot.log and the audit trail.
+# - Per-chat memory (pending registrations, answered callbacks) needs no
+#   sharing because a chat never changes worker.
+# - UPDATE_RECORD_FILE is written by the supervisor as updates arrive.
+#
+# A worker that dies is restarted with a new update queue (a killed reader can
+# leave the old one locked), so the updates it had not finished are lost.
+# bot.py is imported only inside functions: spawned workers must set BOT_SHARD
+# and the log queue before it loads.
+
+RESTART_BACKOFF_MAX = 30.0  # seconds between restarts of a crash-looping worker
+HEALTHY_AFTER = 60.0  # a worker that ran this long resets its backoff
+POLL_TIMEOUT = 20  # long-polling seconds per getUpdates call
+WORKER_QUEUE_SIZE = 10000  # updates buffered per worker before ingress blocks
+
+def shard_of(chat_id, count):
+    return chat_id % count
+
+def chat_key(update):
+    # Raw update dict -> the chat whose handlers it runs in
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if update.get(kind):
+            return update[kind]['chat']['id']
+    callback = update.get('callback_query')
+    if callback:
+        message = callback.get('message')
+        return message['chat']['id'] if message else callback['from']['id']
+    for kind, body in update.items():
+        if isinstance(body, dict) and isinstance(body.get('from'), dict):
+            return body['from']['id']
+    return update.get('update_id', 0)
+
+# === Worker Side ===
+def worker_main(index, count, updates, log_queue, lanes):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor decides when workers stop
+    os.environ['BOT_SHARD'] = f"{index}/{count}"
+    audit.share_queue(log_queue)
+    import bot
+
+    def run_lane(lane):
+        while True:
+            task = lane.get()
+            if task is None:
+                return
+            update, verdict = task
+            try:
+                if verdict is None:
+                    bot.bot.process_new_updates([update])
+                else:
+                    bot.refuse_request(update.message or update.callback_query, verdict)
+            except Exception:
+                logging.exception(f"Update {update.update_id} failed")
+
+    bot.startup()
+    lane_queues = [queue.SimpleQueue() for _ in range(lanes)]
+    threads = [threading.Thread(target=run_lane, args=(lane,), name=f"lane-{i}", daemon=True)
+               for i, lane in enumerate(lane_queues)]
+    for thread in threads:
+        thread.start()
+    logging.info(f"Worker {index}/{count} ready (pid {os.getpid()}, {lanes} lanes)")
+    while True:
+        raw = updates.get()
+        if raw is None:
+            break
+        update = types.Update.de_json(raw)
+        # Chats of this worker are all congruent mod count; divide first to spread them
+        lane = lane_queues[chat_key(raw) // count % lanes]
+        verdict = bot.admit_update(update, lambda admitted, lane=lane: lane.put((admitted, None)))
+        if verdict is not None:
+            lane.put((update, verdict))
+    for lane in lane_queues:
+        lane.put(None)
+    for thread in threads:
+        thread.join()
+
+# === Supervisor Side ===
+class Supervisor:
+    def __init__(self, context, count, log_queue, lanes):
+        self.context = context
+        self.count = count
+        self.log_queue = log_queue
+        self.lanes = lanes
+        self.queues = [context.Queue(WORKER_QUEUE_SIZE) for _ in range(count)]
+        self.processes = [None] * count
+        self.started = [0.0] * count
+        self.backoff = [1.0] * count
+        self.restarts = 0
+        self.routed = 0
+        self._stopping = threading.Event()
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        threading.Thread(target=self._watch, name='worker-watch', daemon=True).start()
+
+    def _spawn(self, index):
+        if self.processes[index] is not None:
+            stale = self.queues[index]
+            self.queues[index] = self.context.Queue(WORKER_QUEUE_SIZE)
+            stale.cancel_join_thread()
+            stale.close()
+        process = self.context.Process(
+            target=worker_main, args=(index, self.count, self.queues[index], self.log_queue, self.lanes),
+            name=f"shard-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.monotonic()
+
+    def _watch(self):
+        while not self._stopping.wait(1.0):
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                ran = time.monotonic() - self.started[index]
+                if ran >= HEALTHY_AFTER:
+                    self.backoff[index] = 1.0
+                logging.error(f"Worker {index} exited with code {process.exitcode} after {ran:.0f}s; "
+                              f"restarting in {self.backoff[index]:.0f}s")
+                if self._stopping.wait(self.backoff[index]):
+                    return
+                self.backoff[index] = min(self.backoff[index] * 2, RESTART_BACKOFF_MAX)
+                self.restarts += 1
+                self._spawn(index)
+
+    def route(self, raw):
+        index = shard_of(chat_key(raw), self.count)
+        while not self._stopping.is_set():
+            try:
+                # Re-read the queue on every try: a restarted worker has a new one
+                self.queues[index].put(raw, timeout=1.0)
+                self.routed += 1
+                return
+            except queue.Full:
+                continue
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        for update_queue in self.queues:
+            update_queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        logging.info(f"Workers stopped after routing {self.routed} updates ({self.restarts} restarts)")
+
+def refresh_snapshot(output):
+    import compile_data
+    problem = compile_data.snapshot_problem(output)
+    if problem is None:
+        return False
+    logging.info(f"Compiling gradebook snapshot: {problem}")
+    started = time.perf_counter()
+    header = compile_data.compile_snapshot(output)
+    logging.info(f"Wrote {output}: {len(header['sheets'])} sheets in {time.perf_counter() - started:.2f}s")
+    return True
+
+def keep_snapshot_fresh(output, interval, stop):
+    # Workers pick up a replaced snapshot by its file stamp; until then a
+    # changed workbook is read from XLSX, so answers are never stale
+    while not stop.wait(interval):
+        try:
+            refresh_snapshot(output)
+        except Exception:
+            logging.exception("Gradebook snapshot refresh failed")
+
+def poll_updates(token, route, stop):
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = apihelper.get_updates(token, offset=offset, timeout=POLL_TIMEOUT, long_polling_timeout=POLL_TIMEOUT)
+        except Exception as e:
+            logging.error(f"getUpdates failed: {str(e)}")
+            stop.wait(3)
+            continue
+        for raw in updates:
+            offset = raw['update_id'] + 1
+            route(raw)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as N worker processes behind one update ingress.")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SHARD_WORKERS', '0')) or os.cpu_count() or 1,
+                        help="worker processes (default: SHARD_WORKERS or the CPU count)")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    audit.share_queue(log_queue, serve=True)
+    import bot  # after share_queue: the supervisor's listener writes every process's logs
+
+    if bot.USER_STORE != 'sqlite':
+        parser.error("worker mode needs USER_STORE=sqlite; the journal store is single-process")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    refresh_snapshot(bot.SNAPSHOT_FILE)
+    supervisor = Supervisor(context, args.workers, log_queue, max(1, bot.BOT_WORKER_THREADS))
+    supervisor.start()
+    logging.info(f"📡 Bot is running with {args.workers} worker processes...")
+    bot.notify_admin_on_restart()
+
+    route = bot.update_recorder.wrap_raw(supervisor.route) if bot.update_recorder else supervisor.route
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    if bot.INGEST_INTERVAL > 0:
+        threading.Thread(target=keep_snapshot_fresh, args=(bot.SNAPSHOT_FILE, bot.INGEST_INTERVAL, stop),
+                         name='snapshot-refresh', daemon=True).start()
+    try:
+        if bot.UPDATE_MODE == 'webhook':
+            from webhook import WebhookServer, register_webhook
+            server = WebhookServer(bot.WEBHOOK_HOST, bot.WEBHOOK_PORT, bot.WEBHOOK_PATH, bot.WEBHOOK_SECRET,
+                                   route, raw=True)
+            register_webhook(bot.bot, bot.WEBHOOK_URL, bot.WEBHOOK_PATH, bot.WEBHOOK_SECRET)
+            server.start()
+            stop.wait()
+            server.shutdown()
+        else:
+            poll_updates(bot.BOT_TOKEN, route, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        supervisor.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+# === Streaming Single-Sheet XLSX Reader ===
+# Reads cached cell values (what openpyxl returns with data_only=True) for a row
+# window of one or more named sheets without materialising the rest of the
+# workbook: only workbook.xml, its rels, sharedStrings.xml and the requested
+# sheet parts are opened, and styles/calcChain are never touched. Cell values
+# are decoded only inside the requested window; the rest of the sheet is just
+# scanned for cell references so max_column matches openpyxl's. Because styles
+# are skipped, numeric cells formatted as dates come back as Excel serials.
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+DOC_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+SHEET_TAG = f'{MAIN_NS}sheet'
+ROW_TAG = f'{MAIN_NS}row'
+CELL_TAG = f'{MAIN_NS}c'
+VALUE_TAG = f'{MAIN_NS}v'
+INLINE_STRING_TAG = f'{MAIN_NS}is'
+TEXT_TAG = f'{MAIN_NS}t'
+RUN_TAG = f'{MAIN_NS}r'
+SHARED_STRING_TAG = f'{MAIN_NS}si'
+RELATIONSHIP_TAG = f'{PKG_REL_NS}Relationship'
+
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+SHARED_STRINGS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings'
+
+def column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - 64)
+    return index
+
+def split_coordinate(coordinate):
+    for i, char in enumerate(coordinate):
+        if char.isdigit():
+            return int(coordinate[i:]), column_index(coordinate[:i])
+    raise ValueError(f"Invalid cell reference {coordinate!r}")
+
+def cast_number(value):
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+def rich_text(element):
+    # Plain <t> plus formatted runs <r><t>, ignoring phonetic <rPh> hints
+    snippets = []
+    plain = element.find(TEXT_TAG)
+    if plain is not None and plain.text:
+        snippets.append(plain.text)
+    for run in element.findall(RUN_TAG):
+        text = run.findtext(TEXT_TAG)
+        if text:
+            snippets.append(text)
+    return ''.join(snippets)
+
+def read_relationships(zf, part):
+    rels_path = posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+    relationships = {}
+    try:
+        source = zf.open(rels_path)
+    except KeyError:
+        return relationships
+    with source:
+        for _, element in iterparse(source):
+            if element.tag == RELATIONSHIP_TAG:
+                target = element.get('Target')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+                relationships[element.get('Id')] = (element.get('Type'), target)
+    return relationships
+
+class XlsxFile:
+    def __init__(self, path):
+        self.path = path
+        self._zf = zipfile.ZipFile(path)
+        self._shared_strings = None
+        workbook_part = 'xl/workbook.xml'
+        for rel_type, target in read_relationships(self._zf, '').values():
+            if rel_type == OFFICE_DOCUMENT_REL:
+                workbook_part = target
+        self._workbook_rels = read_relationships(self._zf, workbook_part)
+        self.sheets = {}
+        with self._zf.open(workbook_part) as source:
+            for _, element in iterparse(source):
+                if element.tag == SHEET_TAG:
+                    self.sheets[element.get('name')] = self._workbook_rels[element.get(f'{DOC_REL_NS}id')][1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zf.close()
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            for rel_type, target in self._workbook_rels.values():
+                if rel_type == SHARED_STRINGS_REL:
+                    with self._zf.open(target) as source:
+                        for _, element in iterparse(source):
+                            if element.tag == SHARED_STRING_TAG:
+                                self._shared_strings.append(rich_text(element).replace('x005F_', ''))
+                                element.clear()
+        return self._shared_strings
+
+    def cell_value(self, element):
+        data_type = element.get('t', 'n')
+        if data_type == 'inlineStr':
+            inline = element.find(INLINE_STRING_TAG)
+            return rich_text(inline) if inline is not None else None
+        value = element.findtext(VALUE_TAG) or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            return cast_number(value)
+        if data_type == 's':
+            return self.shared_strings()[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        return value  # 'str' formula results, 'e' errors and ISO 'd' dates stay as text
+
+    def read_sheet(self, name, min_row, max_row, max_col):
+        # Returns (max_column, rows) where rows are max_col-wide value tuples for
+        # min_row..max_row. Raises KeyError for an unknown sheet, like openpyxl.
+        part = self.sheets[name]
+        rows = [[None] * max_col for _ in range(max_row - min_row + 1)]
+        max_column = 0
+        row_number = 0
+        col_number = 0
+        with self._zf.open(part) as source:
+            for event, element in iterparse(source, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == ROW_TAG:
+                        row_number = int(element.get('r') or row_number + 1)
+                        col_number = 0
+                    continue
+                if tag == CELL_TAG:
+                    coordinate = element.get('r')
+                    if coordinate:
+                        _, col_number = split_coordinate(coordinate)
+                    else:
+                        col_number += 1
+                    if col_number > max_column:
+                        max_column = col_number
+                    if min_row <= row_number <= max_row and col_number <= max_col:
+                        rows[row_number - min_row][col_number - 1] = self.cell_value(element)
+                elif tag == ROW_TAG:
+                    element.clear()
+        return max(max_column, 1), tuple(tuple(row) for row in rows)
+
+def read_sheets(path, names, min_row, max_row, max_col):
+    # {name: (title, max_column, rows)} for each requested sheet present in the workbook
+    sheets = {}
+    with XlsxFile(path) as xlsx:
+        for name in names:
+            if name in xlsx.sheets:
+                max_column, rows = xlsx.read_sheet(name, min_row, max_row, max_col)
+                sheets[name] = (name, max_column, rows)
+    return sheets
+
+def sheet_names(path):
+    with XlsxFile(path) as xlsx:
+        return xlsx.sheet_names